@@ -4,11 +4,15 @@ Tìm kiếm thông minh với AI orchestration
 """
 import streamlit as st
 from backend.langgraph_orchestrator import build_search_graph, invoke_search
+from backend.checkpointing import sqlite_checkpointer, make_run_id
 from backend.project_manager import ProjectManager
+from backend.gemini_service import GeminiService
+from backend.nodes.evaluate import score_pending_articles
 from datetime import datetime
 import os
 from dotenv import load_dotenv
 import json
+import uuid
 
 # Load environment variables
 load_dotenv()
@@ -66,7 +70,7 @@ with st.sidebar:
                 proj_meta = pm.get_project_metadata(selected_project_id)
                 if proj_meta:
                     st.info(f"**Query:** {proj_meta['user_query'][:50]}...")
-                    st.caption(f"Searches: {proj_meta['search_count']} | Articles: {proj_meta['total_articles']}")
+                    st.caption(f"Searches: {proj_meta['search_count']} | Articles: {proj_meta.get('unique_articles', proj_meta['total_articles'])}")
                     
                     # Action buttons
                     col_act1, col_act2 = st.columns(2)
@@ -150,6 +154,76 @@ with st.sidebar:
         use_pubmed = st.checkbox("PubMed", value=True)
         use_scopus = st.checkbox("Scopus", value=False, help="Cần Scopus API key")
         use_semantic = st.checkbox("Semantic Scholar", value=True)
+
+        st.markdown("---")
+        st.markdown("### 🤖 Chấm điểm AI")
+        scoring_batch_size = st.number_input(
+            "Số bài mỗi lần gọi AI (batch)",
+            min_value=1,
+            max_value=20,
+            value=1,
+            help="1 = chấm từng bài (chính xác nhất). Lớn hơn 1 = gộp nhiều abstract vào một lần gọi, nhanh hơn và ít lần gọi hơn."
+        )
+        scoring_concurrency = st.number_input(
+            "Số lần gọi AI song song",
+            min_value=1,
+            max_value=20,
+            value=5,
+            help="Số bài được chấm đồng thời (async). 1 = tuần tự."
+        )
+        lexical_prefilter = st.checkbox(
+            "Lọc sơ bộ bằng từ khóa (BM25)",
+            value=True,
+            help="Chấm điểm cục bộ theo từ khóa trước, tự loại bài lạc đề rõ ràng để tiết kiệm lượt gọi AI."
+        )
+        use_prescreen = st.checkbox(
+            "Sàng lọc bằng mô hình cục bộ",
+            value=False,
+            help="Dùng classifier học từ điểm Gemini trong các dự án đã lưu (python -m backend.prescreen train). Chỉ bài không chắc chắn mới gửi cho AI."
+        )
+        early_stop = st.checkbox(
+            "Dừng chấm khi đủ số lượng",
+            value=True,
+            help="Chấm bài có khả năng liên quan cao trước, dừng khi đủ số bài đạt yêu cầu. Bài còn lại có thể chấm thêm sau."
+        )
+        combined_planner = st.checkbox(
+            "Lập kế hoạch bằng 1 lần gọi AI",
+            value=True,
+            help="Phân tích query, chọn nguồn và tối ưu query cho từng nguồn trong một lần gọi (nhanh hơn). Tự động quay về cách cũ nếu lỗi."
+        )
+        pipeline_mode = st.checkbox(
+            "Chấm điểm ngay khi từng nguồn trả về",
+            value=False,
+            help="Không chờ nguồn chậm nhất: bài của nguồn nhanh được chấm điểm trong lúc các nguồn khác còn đang tìm."
+        )
+        use_cascade = st.checkbox(
+            "Chấm 2 tầng (cascade)",
+            value=False,
+            help="Model rẻ chấm nhanh theo tiêu đề trước; chỉ bài có điểm lưng chừng mới được chấm lại đầy đủ với abstract."
+        )
+        cascade_band = st.slider(
+            "Vùng điểm lưng chừng (escalate)",
+            min_value=1.0,
+            max_value=10.0,
+            value=(5.0, 8.0),
+            step=0.5,
+            disabled=not use_cascade,
+            help="Bài có điểm tầng 1 trong khoảng này sẽ được chấm lại bằng model đầy đủ."
+        )
+
+        st.markdown("---")
+        st.markdown("### 📂 Bài đã lưu trong dự án")
+        use_seen_index = st.checkbox(
+            "Đối chiếu với dự án đang chọn",
+            value=False,
+            help="Bật để đánh dấu / bỏ qua các bài đã lưu trong dự án đang chọn ở tab Dự án."
+        )
+        skip_seen = st.checkbox(
+            "Bỏ qua bài đã lưu",
+            value=False,
+            disabled=not use_seen_index,
+            help="Bài đã lưu trong dự án đang chọn sẽ bị loại khỏi kết quả. Nếu tắt, bài sẽ được đánh dấu 'Đã lưu'; điểm cũ chỉ được dùng lại khi cùng câu truy vấn, ngược lại bài được chấm lại."
+        )
         
         st.markdown("---")
         st.markdown("### Thông tin hiển thị")
@@ -186,6 +260,8 @@ if 'view_project_id' not in st.session_state:
     st.session_state.view_project_id = None
 if 'confirm_delete' not in st.session_state:
     st.session_state.confirm_delete = None
+if 'pending_run' not in st.session_state:
+    st.session_state.pending_run = None  # {'key', 'run_id'} của lần tìm kiếm chưa hoàn thành
 
 # Compile graph once
 if st.session_state.graph_compiled is None and gemini_key:
@@ -195,7 +271,8 @@ if st.session_state.graph_compiled is None and gemini_key:
                 gemini_api_key=gemini_key,
                 pubmed_key=pubmed_key,
                 scopus_key=scopus_key,
-                semantic_key=semantic_key
+                semantic_key=semantic_key,
+                checkpointer=sqlite_checkpointer()
             )
             st.success("✅ LangGraph workflow ready!")
         except Exception as e:
@@ -215,7 +292,7 @@ if st.session_state.view_project_id:
         col_p1, col_p2, col_p3 = st.columns(3)
         
         with col_p1:
-            st.metric("📚 Tổng bài báo", metadata['total_articles'])
+            st.metric("📚 Tổng bài báo", metadata.get('unique_articles', metadata['total_articles']))
         with col_p2:
             st.metric("🔍 Số lần tìm kiếm", metadata['search_count'])
         with col_p3:
@@ -343,11 +420,26 @@ with main_col1:
                 user_preferences = {
                     'max_results': max_results,
                     'year_range': list(year_range),
-                    'sources': sources
+                    'sources': sources,
+                    'project_id': (st.session_state.get('project_selector') or st.session_state.current_project_id)
+                    if use_seen_index else None,
+                    'seen_policy': 'skip' if skip_seen else 'flag',
+                    'pipeline': pipeline_mode,
+                    'planner': 'combined' if combined_planner else 'multi',
+                    'scoring': {
+                        'batch_size': int(scoring_batch_size),
+                        'concurrency': int(scoring_concurrency),
+                        'lexical_prefilter': lexical_prefilter,
+                        'prescreen': use_prescreen,
+                        'early_stop': early_stop,
+                        'cascade': use_cascade,
+                        'cascade_band': list(cascade_band)
+                    }
                 }
 
                 # Node display names and icons
                 node_info = {
+                    'plan_query': {'icon': '🧭', 'name': 'Lập kế hoạch Query'},
                     'analyze_query': {'icon': '🔍', 'name': 'Phân tích Query'},
                     'plan_strategy': {'icon': '📋', 'name': 'Lập Chiến lược'},
                     'optimize_queries': {'icon': '⚙️', 'name': 'Tối ưu Query'},
@@ -369,6 +461,11 @@ with main_col1:
                         lang = analysis.get('language', 'N/A')
                         msg = f"{info['icon']} {info['name']}: {topic} ({lang})"
 
+                    elif node_name == 'plan_query':
+                        strategy = node_state.get('search_strategy', {})
+                        sources = strategy.get('sources', [])
+                        msg = f"{info['icon']} {info['name']}: {len(sources)} nguồn ({strategy.get('planner', 'combined')})"
+
                     elif node_name == 'plan_strategy':
                         strategy = node_state.get('search_strategy', {})
                         sources = strategy.get('sources', [])
@@ -399,6 +496,25 @@ with main_col1:
 
                     st.toast(msg, icon=info['icon'])
 
+                # Literature review hiện dần trong lúc AI đang viết
+                synthesis_box = st.empty()
+                synthesis_parts = []
+
+                def show_synthesis_chunk(text: str):
+                    synthesis_parts.append(text)
+                    synthesis_box.markdown("#### 📝 Đang viết tổng quan tài liệu...\n\n" + ''.join(synthesis_parts) + "▌")
+
+                # Checkpoint run ID: mỗi lần bấm tìm kiếm là một run mới; chỉ lần tìm
+                # kiếm bị ngắt / lỗi với cùng query + preferences mới chạy tiếp từ checkpoint
+                run_key = make_run_id(query, user_preferences)
+                pending_run = st.session_state.pending_run
+                if pending_run and pending_run['key'] == run_key:
+                    run_id = pending_run['run_id']
+                    st.toast("♻️ Tiếp tục lần tìm kiếm trước từ checkpoint", icon="♻️")
+                else:
+                    run_id = f"{run_key}-{uuid.uuid4().hex[:8]}"
+                    st.session_state.pending_run = {'key': run_key, 'run_id': run_id}
+
                 # Execute LangGraph with progress tracking
                 with st.spinner("🧠 AI đang phân tích và tìm kiếm..."):
                     try:
@@ -406,8 +522,12 @@ with main_col1:
                             st.session_state.graph_compiled,
                             user_query=query,
                             user_preferences=user_preferences,
-                            progress_callback=show_progress
+                            progress_callback=show_progress,
+                            stream_callback=show_synthesis_chunk,
+                            run_id=run_id
                         )
+                        st.session_state.pending_run = None
+                        synthesis_box.empty()
                         st.session_state.langgraph_results = final_state
                         st.toast("✅ Hoàn thành tìm kiếm!", icon="✅")
                     except Exception as e:
@@ -442,6 +562,24 @@ with main_col2:
             metadata = final_state.get('metadata', {})
             removed = metadata.get('total_found', 0) - len(final_state['final_results'])
             st.metric("🗑️ Đã loại", f"{removed}")
+
+        # Lazy scoring: bài chưa chấm do early stop
+        pending = final_state.get('pending_articles') or []
+        if pending:
+            st.caption(f"⏸️ {len(pending)} bài chưa được chấm điểm (đã đủ số lượng yêu cầu)")
+            if st.button(f"🤖 Chấm thêm {min(10, len(pending))} bài", use_container_width=True, key="score_pending_btn"):
+                if 'gemini_service' not in st.session_state:
+                    st.session_state.gemini_service = GeminiService(gemini_key)
+                with st.spinner("🤖 Đang chấm điểm thêm..."):
+                    st.session_state.langgraph_results = score_pending_articles(
+                        final_state, st.session_state.gemini_service, limit=10
+                    )
+                st.rerun()
+
+        # Literature review (đã stream trong lúc chạy, bản cuối lưu trong state)
+        if final_state.get('synthesis_summary'):
+            with st.expander("📝 Tổng quan tài liệu (AI)", expanded=True):
+                st.markdown(final_state['synthesis_summary'])
         
         st.markdown("---")
         
@@ -545,7 +683,7 @@ with main_col2:
         
         # === PHẦN 3: CHIẾN LƯỢC AI ===
         with st.expander("🧠 Chiến lược AI đã sử dụng", expanded=False):
-            tab_analysis, tab_strategy = st.tabs(["📊 Phân tích Query", "📋 Chiến lược Tìm kiếm"])
+            tab_analysis, tab_strategy, tab_tokens = st.tabs(["📊 Phân tích Query", "📋 Chiến lược Tìm kiếm", "🪙 Token"])
             
             with tab_analysis:
                 if final_state.get('query_analysis'):
@@ -560,6 +698,22 @@ with main_col2:
                     st.json(strategy)
                 else:
                     st.info("Không có dữ liệu chiến lược")
+
+            with tab_tokens:
+                timings = final_state.get('timings') or {}
+                if 'time_to_first_search_s' in timings:
+                    planner = (final_state.get('search_strategy') or {}).get('planner', 'multi')
+                    st.caption(f"⏱️ Thời gian tới lúc bắt đầu tìm kiếm: {timings['time_to_first_search_s']}s (planner: {planner})")
+                token_usage = final_state.get('token_usage') or {}
+                if token_usage:
+                    st.dataframe(
+                        [{'Node': node, **usage} for node, usage in token_usage.items()],
+                        use_container_width=True,
+                        hide_index=True
+                    )
+                    st.caption("estimated_calls: số lần gọi không có usage_metadata (token được ước lượng ~4 ký tự/token)")
+                else:
+                    st.info("Không có dữ liệu token")
         
         # === PHẦN 4: WORKFLOW LOG ===
         with st.expander("📜 Workflow Log", expanded=False):
@@ -638,6 +792,8 @@ if st.session_state.langgraph_results:
                     
                     # Caption
                     caption_parts = [f"**Nguồn:** {article['source']}"]
+                    if article.get('already_seen'):
+                        caption_parts.append("**📌 Đã lưu trong dự án**")
                     if show_year:
                         caption_parts.append(f"**Năm:** {article['year']}")
                     if show_journal:
@@ -0,0 +1,272 @@
+"""
+Batch Runner
+Chạy nhiều query (vd các câu hỏi liên quan của một review) đồng thời và lưu kết quả vào project
+
+- Một graph, một GeminiService, một AsyncSearchAPIs cho cả batch: SearchCache, rate
+  limiter của Gemini và của từng nguồn, token budget đều dùng chung
+- Các run chạy async trên event loop dùng chung, tối đa `concurrency` run cùng lúc;
+  request tới từng nguồn được giãn theo source_rate_limits nên số run song song chỉ
+  bị giới hạn bởi quota thật của nguồn chậm nhất
+- Checkpoint: state mỗi run lưu theo run_id (sqlite checkpointer) + tiến độ batch trong
+  project (batch_progress.json) → chạy lại cùng batch bỏ qua query đã xong, run dở
+  dang chạy tiếp từ node cuối đã hoàn thành
+
+Usage:
+    python -m backend.batch_runner queries.json --project-name "Wound care review"
+    python -m backend.batch_runner queries.jsonl --project-id <id> --concurrency 6 --token-budget 500000
+    python -m backend.batch_runner queries.txt --project-name demo --stub   # offline
+
+File queries: .txt (mỗi dòng một query), .jsonl (mỗi dòng một query hoặc
+{"query": ..., "preferences": {...}}), hoặc .json (list như trên, hoặc
+{"defaults": {...preferences}, "queries": [...]})
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from .async_apis import AsyncSearchAPIs, StubSearchAPIs
+from .checkpointing import make_run_id, sqlite_checkpointer
+from .event_loop import run_sync
+from .gemini_service import GeminiService
+from .langgraph_orchestrator import ainvoke_search, build_search_graph
+from .llm_providers import StubProvider
+from .project_manager import ProjectManager
+
+
+DEFAULT_PREFERENCES = {
+    'max_results': 10,
+    'year_range': [2020, 2025],
+    'sources': ['PubMed', 'Scopus', 'Semantic Scholar']
+}
+
+
+def source_rate_limits(pubmed_key: str = None, scopus_key: str = None, semantic_key: str = None) -> Dict[str, int]:
+    """
+    Request/phút cho từng nguồn theo quota công bố (để dư một chút)
+
+    - PubMed E-utilities: 3 req/s không key, 10 req/s có key; mỗi search = esearch + efetch
+    - Scopus: ~9 req/s mỗi API key
+    - Semantic Scholar: 1 req/s có key; không key dùng chung pool công khai (~100 req / 5 phút)
+    """
+    return {
+        'PubMed': 270 if pubmed_key else 80,
+        'Scopus': 300 if scopus_key else 0,
+        'Semantic Scholar': 55 if semantic_key else 18
+    }
+
+
+def load_batch(path: str, default_preferences: Dict = None) -> List[Dict]:
+    """Đọc file queries → [{'query', 'preferences', 'run_id'}] (run_id theo query + preferences)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+
+    defaults = dict(default_preferences or DEFAULT_PREFERENCES)
+    if path.endswith('.jsonl'):
+        entries = [json.loads(line) for line in text.splitlines() if line.strip()]
+    elif path.endswith('.json'):
+        data = json.loads(text)
+        if isinstance(data, dict):
+            defaults.update(data.get('defaults') or {})
+            data = data.get('queries', [])
+        entries = data
+    else:
+        entries = [line.strip() for line in text.splitlines() if line.strip() and not line.startswith('#')]
+
+    jobs = []
+    seen = set()
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {'query': entry}
+        query = (entry.get('query') or '').strip()
+        if not query:
+            continue
+        preferences = {**defaults, **(entry.get('preferences') or {})}
+        run_id = entry.get('run_id') or make_run_id(query, preferences)
+        if run_id in seen:
+            continue
+        seen.add(run_id)
+        jobs.append({'query': query, 'preferences': preferences, 'run_id': run_id})
+    return jobs
+
+
+class BatchRunner:
+    """
+    Chạy batch queries với tài nguyên dùng chung
+
+    token_usage trong state của từng run được đếm riêng theo run (ainvoke_search);
+    tổng của cả batch lấy từ gemini.usage
+    """
+
+    def __init__(self, gemini_api_key: str = '', pubmed_key: str = None, scopus_key: str = None,
+                 semantic_key: str = None, project_manager: ProjectManager = None, checkpointer=None,
+                 concurrency: int = 4, token_budget: int = None, llm_requests_per_minute: int = 300,
+                 rate_limits: Dict[str, int] = None, planner_mode: str = 'combined',
+                 llm_provider=None, search_apis: AsyncSearchAPIs = None):
+        self.project_manager = project_manager or ProjectManager()
+        self.concurrency = max(1, concurrency)
+        self.token_budget = token_budget
+        self.gemini = GeminiService(gemini_api_key, requests_per_minute=llm_requests_per_minute,
+                                    provider=llm_provider)
+        if rate_limits is None:
+            rate_limits = source_rate_limits(pubmed_key, scopus_key, semantic_key)
+        self.search_apis = search_apis or AsyncSearchAPIs(pubmed_key, scopus_key, semantic_key,
+                                                          source_rate_limits=rate_limits)
+        self.checkpointer = checkpointer if checkpointer is not None else sqlite_checkpointer(
+            os.path.join(self.project_manager.base_dir, "checkpoints.sqlite"))
+        self.graph = build_search_graph(gemini_api_key, planner_mode=planner_mode,
+                                        search_apis=self.search_apis, checkpointer=self.checkpointer,
+                                        gemini_service=self.gemini)
+
+    # ----- Progress (checkpoint của batch trong project) -----
+
+    def _progress_file(self, project_id: str) -> str:
+        return os.path.join(self.project_manager.base_dir, project_id, "batch_progress.json")
+
+    def load_progress(self, project_id: str) -> Dict[str, Dict]:
+        try:
+            with open(self._progress_file(project_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_progress(self, project_id: str, progress: Dict[str, Dict]):
+        path = self._progress_file(project_id)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(progress, f, indent=2, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+    def tokens_used(self) -> int:
+        usage = self.gemini.usage.snapshot()
+        return usage['prompt_tokens'] + usage['output_tokens']
+
+    # ----- Run -----
+
+    async def _run_job(self, job: Dict, project_id: str, progress: Dict, semaphore: asyncio.Semaphore,
+                       save_lock: asyncio.Lock):
+        async with semaphore:
+            entry = progress.setdefault(job['run_id'], {'query': job['query']})
+            if self.token_budget and self.tokens_used() >= self.token_budget:
+                entry.update({'status': 'skipped_budget'})
+                print(f"⏭️  Token budget reached - skipped: {job['query'][:60]}")
+                return
+
+            entry.update({'status': 'running', 'started_at': datetime.now().isoformat()})
+            start = time.perf_counter()
+            try:
+                state = await ainvoke_search(self.graph, job['query'], job['preferences'], run_id=job['run_id'])
+            except Exception as e:
+                # State tới node cuối đã xong vẫn nằm trong checkpoint → lần chạy sau tiếp tục
+                entry.update({'status': 'failed', 'error': str(e)[:300]})
+                print(f"❌ Batch run failed ({job['query'][:60]}): {e}")
+                return
+
+            loop = asyncio.get_running_loop()
+            async with save_lock:
+                search_id = await loop.run_in_executor(
+                    None, self.project_manager.save_search_results, project_id, state)
+                entry.update({
+                    'status': 'done',
+                    'search_id': search_id,
+                    'kept': len(state.get('final_results') or []),
+                    'refinements': state.get('refinement_count', 0),
+                    'wall_time_s': round(time.perf_counter() - start, 2),
+                    'finished_at': datetime.now().isoformat()
+                })
+                entry.pop('error', None)
+                await loop.run_in_executor(None, self._save_progress, project_id, progress)
+            print(f"📦 Saved {entry['kept']} papers → {search_id} ({job['query'][:60]})")
+
+    async def arun(self, jobs: List[Dict], project_id: str) -> Dict:
+        """
+        Chạy các job chưa xong của batch (job: {'query', 'preferences', 'run_id'}, xem load_batch)
+
+        Returns:
+            Report: số run theo trạng thái, token / search calls của cả batch, wall time
+        """
+        progress = self.load_progress(project_id)
+        pending = [job for job in jobs if progress.get(job['run_id'], {}).get('status') != 'done']
+        print(f"🗂️  Batch: {len(jobs)} queries, {len(jobs) - len(pending)} already done, "
+              f"{len(pending)} to run (concurrency {self.concurrency})")
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        save_lock = asyncio.Lock()
+        start = time.perf_counter()
+        await asyncio.gather(*(self._run_job(job, project_id, progress, semaphore, save_lock) for job in pending))
+        self._save_progress(project_id, progress)
+
+        statuses = {}
+        for job in jobs:
+            status = progress.get(job['run_id'], {}).get('status', 'pending')
+            statuses[status] = statuses.get(status, 0) + 1
+        usage = self.gemini.usage.snapshot()
+        return {
+            'project_id': project_id,
+            'queries': len(jobs),
+            'ran': len(pending),
+            'status': statuses,
+            'wall_time_s': round(time.perf_counter() - start, 2),
+            'llm_calls': usage['calls'],
+            'llm_tokens': usage['prompt_tokens'] + usage['output_tokens'],
+            'token_budget': self.token_budget,
+            'search_calls': dict(getattr(self.search_apis, 'calls', {}))
+        }
+
+    def run(self, jobs: List[Dict], project_id: str) -> Dict:
+        """Sync wrapper: chạy batch trên event loop dùng chung"""
+        return run_sync(self.arun(jobs, project_id))
+
+
+def main():
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Run a batch of search queries into a project")
+    parser.add_argument('queries', help="Queries file (.txt / .jsonl / .json)")
+    parser.add_argument('--project-id', help="Existing project to write results to")
+    parser.add_argument('--project-name', help="Create a new project with this name")
+    parser.add_argument('--projects-dir', default="projects")
+    parser.add_argument('--concurrency', type=int, default=4, help="Graph runs in flight at once")
+    parser.add_argument('--token-budget', type=int, help="Stop starting new runs after this many LLM tokens")
+    parser.add_argument('--llm-rpm', type=int, default=300, help="Shared Gemini requests per minute")
+    parser.add_argument('--planner', choices=['combined', 'multi'], default='combined')
+    parser.add_argument('--max-results', type=int, help="Default max_results for queries without preferences")
+    parser.add_argument('--stub', action='store_true', help="Offline run with StubProvider + StubSearchAPIs")
+    args = parser.parse_args()
+
+    if not args.project_id and not args.project_name:
+        parser.error("--project-id or --project-name is required")
+
+    defaults = dict(DEFAULT_PREFERENCES)
+    if args.max_results:
+        defaults['max_results'] = args.max_results
+    jobs = load_batch(args.queries, defaults)
+
+    load_dotenv()
+    keys = {
+        'gemini_api_key': os.getenv('GEMINI_API_KEY', ''),
+        'pubmed_key': os.getenv('PUBMED_API_KEY') or None,
+        'scopus_key': os.getenv('SCOPUS_API_KEY') or None,
+        'semantic_key': os.getenv('SEMANTIC_SCHOLAR_API_KEY') or None
+    }
+    stub = {}
+    if args.stub:
+        keys = {'gemini_api_key': ''}
+        stub = {'llm_provider': StubProvider(), 'search_apis': StubSearchAPIs(
+            source_rate_limits=source_rate_limits())}
+
+    project_manager = ProjectManager(args.projects_dir)
+    project_id = args.project_id or project_manager.create_project(
+        args.project_name, jobs[0]['query'] if jobs else '', description=f"Batch: {os.path.basename(args.queries)}")
+
+    runner = BatchRunner(**keys, **stub, project_manager=project_manager, concurrency=args.concurrency,
+                         token_budget=args.token_budget, llm_requests_per_minute=args.llm_rpm,
+                         planner_mode=args.planner)
+    report = runner.run(jobs, project_id)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Checkpointing
+Lưu state của graph sau mỗi node (LangGraph checkpointer, key = run ID / thread_id)
+để run bị ngắt (lỗi API, Streamlit rerun, process restart) hoặc được yêu cầu lại
+chạy tiếp từ node cuối đã hoàn thành - không phân tích / tìm kiếm lại
+
+- sqlite_checkpointer(): AsyncSqliteSaver (file local), tạo trên event loop dùng chung
+  vì graph chạy async (ainvoke / astream) trên loop đó
+- memory_checkpointer(): InMemorySaver (trong process, cho benchmark / thử nghiệm)
+"""
+import hashlib
+import json
+import os
+
+import aiosqlite
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from .event_loop import run_sync
+
+
+DEFAULT_CHECKPOINT_PATH = os.path.join("projects", "checkpoints.sqlite")
+
+
+def sqlite_checkpointer(path: str = DEFAULT_CHECKPOINT_PATH) -> AsyncSqliteSaver:
+    """
+    SQLite checkpointer cho build_search_graph(checkpointer=...)
+
+    Connection (aiosqlite) gắn với event loop dùng chung → chỉ dùng graph qua
+    ainvoke_search / invoke_search
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    async def _open():
+        saver = AsyncSqliteSaver(aiosqlite.connect(path))
+        await saver.setup()
+        return saver
+
+    return run_sync(_open())
+
+
+def memory_checkpointer() -> InMemorySaver:
+    return InMemorySaver()
+
+
+def make_run_id(user_query: str, user_preferences: dict) -> str:
+    """
+    Run ID deterministic theo query + preferences: cùng yêu cầu → cùng checkpoint
+    (run đã xong được trả lại, không tìm lại; UI thêm hậu tố riêng cho mỗi lần bấm tìm kiếm)
+    """
+    payload = json.dumps([user_query.strip(), user_preferences], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.md5(payload.encode('utf-8')).hexdigest()[:16]
@@ -0,0 +1,57 @@
+"""
+Shared Event Loop
+Một event loop sống lâu (daemon thread) cho toàn bộ process: graph chạy async
+(ainvoke / astream), search APIs, Gemini async client và speculative prefetch
+dùng chung loop này thay vì tạo / đóng loop mới cho mỗi lần gọi
+(giữ được connection pool và các tài nguyên async dài hạn)
+
+Code sync (Streamlit, benchmark, node sync) chỉ gọi qua run_sync() - wrapper mỏng
+"""
+import asyncio
+import threading
+from typing import Optional
+
+
+class BackgroundLoop:
+    """Event loop chạy run_forever trên daemon thread, khởi động lazy"""
+
+    def __init__(self, name: str = 'search-event-loop'):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name=self.name, daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def in_loop_thread(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, coro):
+        """Lên lịch coroutine trên loop, trả về concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: float = None):
+        """Chạy coroutine và chờ kết quả (chỉ gọi từ thread khác loop thread)"""
+        if self.in_loop_thread():
+            coro.close()
+            raise RuntimeError("run_sync() called from the event loop thread - use 'await' instead")
+        return self.submit(coro).result(timeout)
+
+
+_shared_loop = BackgroundLoop()
+
+
+def shared_loop() -> BackgroundLoop:
+    return _shared_loop
+
+
+def run_sync(coro, timeout: float = None):
+    """Sync wrapper: chạy coroutine trên event loop dùng chung"""
+    return _shared_loop.run(coro, timeout)
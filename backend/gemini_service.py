@@ -1,19 +1,229 @@
 """
 Gemini AI Service
 """
-from google import genai
-from google.genai import types
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import asyncio
+import contextvars
+import hashlib
 import json
+import threading
+import time
+
+from .prompts.budget import TokenUsage, count_tokens, run_usage
+from .llm_providers import LLMProvider, GeminiProvider
+
+
+DEFAULT_MODEL = 'gemini-2.0-flash'
+
+# Gemini chỉ tạo cached content từ một ngưỡng token tối thiểu (tuỳ model, ≥ 1024)
+MIN_CACHE_TOKENS = 1024
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Gemini trả về 429 / RESOURCE_EXHAUSTED khi vượt quota"""
+    text = str(error)
+    return '429' in text or 'RESOURCE_EXHAUSTED' in text
+
+
+class RateLimiter:
+    """
+    Rate limiter dùng chung cho mọi lời gọi Gemini (sync & async)
+
+    - Giãn cách request theo requests_per_minute
+    - backoff(): khi một call bị 429, tất cả call khác cùng tạm dừng
+    """
+
+    def __init__(self, requests_per_minute: int = 300):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._next_slot = 0.0
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Đặt slot kế tiếp, trả về số giây cần chờ"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot, self._blocked_until)
+            self._next_slot = slot + self.interval
+            return slot - now
+
+    def acquire(self):
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def backoff(self, seconds: float):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
 
 class GeminiService:
     """Class xử lý Gemini AI"""
 
-    def __init__(self, api_key: str):
+    # Cách gửi phần prompt dùng chung (rubric): 'cache' (cached content, fallback
+    # system_instruction), 'system' (system_instruction), 'inline' (ghép vào từng prompt)
+    CONTEXT_MODES = ('cache', 'system', 'inline')
+
+    def __init__(self, api_key: str, requests_per_minute: int = 300, context_mode: str = 'system',
+                 context_ttl: int = 900, provider: LLMProvider = None,
+                 min_cache_tokens: int = MIN_CACHE_TOKENS):
         self.api_key = api_key
-        self.client = None
-        if self.api_key:
-            self.client = genai.Client(api_key=self.api_key)
+        # LLM backend: GeminiProvider (API key) hoặc provider truyền vào (vd StubProvider offline)
+        self.provider = provider
+        if self.provider is None and self.api_key:
+            self.provider = GeminiProvider(self.api_key)
+        # Shared across all nodes & concurrent scoring tasks
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        self.usage = TokenUsage()
+        self.context_mode = context_mode if context_mode in self.CONTEXT_MODES else 'system'
+        self.context_ttl = context_ttl
+        self.min_cache_tokens = min_cache_tokens
+        self._contexts = {}
+        self._creating = set()
+        self._contexts_lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        """Có LLM backend để gọi hay không"""
+        return self.provider is not None
+
+    @property
+    def client(self):
+        """google-genai client gốc (chỉ có với GeminiProvider)"""
+        return getattr(self.provider, 'client', None)
+
+    def _require_provider(self) -> LLMProvider:
+        if self.provider is None:
+            raise RuntimeError("No LLM provider configured (missing GEMINI_API_KEY)")
+        return self.provider
+
+    def generate(self, contents, model: str = DEFAULT_MODEL, task: str = 'text',
+                 usage_prompt: str = None, **config):
+        """
+        Một lời gọi LLM (sync), ghi token spend vào self.usage
+
+        Args:
+            contents: Prompt
+            model: Tên model
+            task: Loại lời gọi ('analyze', 'score', 'synthesis'...) - provider thật bỏ qua,
+                  StubProvider dùng để sinh response đúng format
+            usage_prompt: Text dùng để ước lượng token nếu response không có usage_metadata
+                          (mặc định = contents)
+            **config: generation config (temperature, response_mime_type, cached_content...)
+        """
+        response = self._require_provider().generate(model, contents, config or None, task)
+        self.record_usage(response, usage_prompt or contents)
+        return response
+
+    async def agenerate(self, contents, model: str = DEFAULT_MODEL, task: str = 'text',
+                        usage_prompt: str = None, **config):
+        """Async version of generate"""
+        response = await self._require_provider().agenerate(model, contents, config or None, task)
+        self.record_usage(response, usage_prompt or contents)
+        return response
+
+    def generate_stream(self, contents, model: str = DEFAULT_MODEL, task: str = 'text',
+                        usage_prompt: str = None, **config) -> Iterator[str]:
+        """
+        Streaming: yield từng đoạn text ngay khi model sinh ra
+
+        Token spend được ghi một lần khi stream kết thúc (kể cả khi lỗi giữa chừng),
+        theo usage_metadata của chunk cuối cùng có metadata.
+        """
+        parts, usage = [], None
+        try:
+            for chunk in self._require_provider().generate_stream(model, contents, config or None, task):
+                usage = getattr(chunk, 'usage_metadata', None) or usage
+                text = getattr(chunk, 'text', None)
+                if text:
+                    parts.append(text)
+                    yield text
+        finally:
+            if parts or usage is not None:
+                self.record_usage(SimpleNamespace(text=''.join(parts), usage_metadata=usage),
+                                  usage_prompt or contents)
+
+    def generate_batch(self, requests: List[Dict], max_concurrency: int = 5) -> List:
+        """
+        Nhiều lời gọi độc lập song song (thread pool, dùng được cả khi đang trong event loop)
+
+        Args:
+            requests: [{'contents': ..., 'model': ..., 'task': ..., **config}]
+
+        Returns:
+            [response | Exception] theo đúng thứ tự requests
+        """
+        if not requests:
+            return []
+
+        def call(request):
+            try:
+                return self.generate(**request)
+            except Exception as e:
+                return e
+
+        # Mỗi worker chạy trong bản sao context của caller (giữ bộ đếm token của run)
+        contexts = [contextvars.copy_context() for _ in requests]
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(requests)))) as executor:
+            return list(executor.map(lambda context, request: context.run(call, request), contexts, requests))
+
+    def shared_context(self, model: str, system_instruction: str) -> Optional[Dict]:
+        """
+        Config cho các lời gọi dùng chung một system instruction (vd rubric chấm điểm)
+
+        - 'system' (mặc định): {'system_instruction': ...}
+        - 'cache': tạo cached content một lần cho (model, instruction), dùng lại tới khi hết TTL;
+          instruction dưới min_cache_tokens (Gemini từ chối) hoặc tạo lỗi → system_instruction
+        - 'inline': None → caller ghép instruction vào prompt như cũ
+        """
+        if self.context_mode == 'inline':
+            return None
+
+        fallback = {'system_instruction': system_instruction}
+        if self.context_mode != 'cache' or not self.provider or count_tokens(system_instruction) < self.min_cache_tokens:
+            return fallback
+
+        key = (model, hashlib.md5(system_instruction.encode('utf-8')).hexdigest())
+        with self._contexts_lock:
+            entry = self._contexts.get(key)
+            if entry and entry['expires'] > time.monotonic():
+                return entry['config']
+            if key in self._creating:
+                # Đang tạo cache ở thread khác → không chờ, dùng system_instruction
+                return fallback
+            self._creating.add(key)
+
+        # Gọi API tạo cache ngoài lock: các scorer khác không bị chặn
+        config = fallback
+        try:
+            name = self.provider.create_cache(model, system_instruction, self.context_ttl)
+            config = {'cached_content': name}
+            print(f"   → Context cache created for {model} ({name})")
+        except Exception as e:
+            print(f"   → Context cache unavailable ({str(e)[:80]}), using system_instruction")
+
+        with self._contexts_lock:
+            self._creating.discard(key)
+            # Hết hạn sớm hơn TTL một chút để không dùng cache đã bị xóa
+            self._contexts[key] = {'config': config, 'expires': time.monotonic() + self.context_ttl - 30}
+        return config
+
+    def record_usage(self, response, prompt: str = None):
+        """
+        Ghi token spend của một response (usage_metadata, hoặc ước lượng từ prompt) vào
+        bộ đếm chung của service và bộ đếm của run hiện tại (nếu có)
+        """
+        self.usage.record(response, prompt)
+        current = run_usage()
+        if current is not None:
+            current.record(response, prompt)
 
     def optimize_query(self, user_input: str) -> Dict[str, str]:
         """
@@ -24,7 +234,7 @@ class GeminiService:
             "strategy": "..."
         }
         """
-        if not self.client:
+        if not self.available:
             return {"english_query": user_input, "vietnamese_query": user_input, "strategy": "No API Key"}
 
         prompt = f"""
@@ -45,13 +255,7 @@ class GeminiService:
         """
         
         try:
-            response = self.client.models.generate_content(
-                model='gemini-2.0-flash', # Using latest flash model as requested implicitly by "newest lib"
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    response_mime_type='application/json'
-                )
-            )
+            response = self.generate(prompt, model=DEFAULT_MODEL, response_mime_type='application/json')
             
             # With response_mime_type='application/json', the text should be valid JSON
             text = response.text.strip()
@@ -65,7 +269,7 @@ class GeminiService:
         """
         Tư vấn chiến lược tìm kiếm
         """
-        if not self.client:
+        if not self.available:
             return "Vui lòng nhập API Key để nhận tư vấn."
 
         prompt = f"""
@@ -80,10 +284,7 @@ class GeminiService:
         """
         
         try:
-            response = self.client.models.generate_content(
-                model='gemini-2.0-flash',
-                contents=prompt
-            )
+            response = self.generate(prompt, model=DEFAULT_MODEL)
             return response.text
         except Exception as e:
             return f"Lỗi khi gọi Gemini: {str(e)}"
@@ -4,16 +4,23 @@ Xây dựng & compile workflow graph
 """
 from langgraph.graph import StateGraph, END
 from typing import Literal
+import asyncio
+import queue
+import time
 from .state_schema import SearchState
+from .nodes.planner import plan_query
 from .nodes.analyze import analyze_query
 from .nodes.plan import plan_strategy
 from .nodes.optimize import optimize_queries
-from .nodes.execute import execute_search
+from .nodes.execute import aexecute_search
 from .nodes.evaluate import evaluate_results
 from .nodes.refine import refine_query
 from .nodes.synthesize import synthesize_findings  # NEW
 from .gemini_service import GeminiService
 from .async_apis import AsyncSearchAPIs
+from .event_loop import shared_loop
+from .speculative import SpeculativePrefetcher, with_speculative_prefetch
+from .prompts.budget import TokenUsage, add_node_usage, run_usage, start_run_usage, end_run_usage
 
 
 def should_refine(state: SearchState) -> Literal["refine", "synthesize"]:
@@ -57,8 +64,56 @@ def should_refine(state: SearchState) -> Literal["refine", "synthesize"]:
     return "refine"
 
 
+def track_tokens(node_name: str, node_fn, gemini: GeminiService):
+    """
+    Wrap một node (sync hoặc async):
+    - cộng token spend của các lời gọi Gemini trong node vào state['token_usage']
+    - cộng thời gian chạy node vào state['timings'] (giây); lần đầu tới execute_search
+      ghi 'time_to_first_search_s' = tổng thời gian các node trước đó
+    """
+    def begin(state: SearchState):
+        timings = dict(state.get('timings') or {})
+        if node_name == 'execute_search' and 'time_to_first_search_s' not in timings:
+            timings['time_to_first_search_s'] = round(sum(v for k, v in timings.items() if k in NODE_NAMES), 2)
+        # Bộ đếm của run (ainvoke_search); gọi graph trực tiếp → bộ đếm chung của service
+        usage = run_usage() or gemini.usage
+        return timings, usage, usage.snapshot(), time.perf_counter()
+
+    def finish(state: SearchState, timings, usage, before, start) -> SearchState:
+        timings[node_name] = round(timings.get(node_name, 0.0) + time.perf_counter() - start, 2)
+        state['timings'] = timings
+        state['token_usage'] = add_node_usage(state.get('token_usage'), node_name,
+                                              TokenUsage.delta(usage.snapshot(), before))
+        return state
+
+    if asyncio.iscoroutinefunction(node_fn):
+        async def awrapped(state: SearchState) -> SearchState:
+            context = begin(state)
+            return finish(await node_fn(state), *context)
+        return awrapped
+
+    def wrapped(state: SearchState) -> SearchState:
+        context = begin(state)
+        return finish(node_fn(state), *context)
+    return wrapped
+
+
+NODE_NAMES = ('plan_query', 'analyze_query', 'plan_strategy', 'optimize_queries', 'execute_search',
+              'evaluate_results', 'refine_query', 'synthesize_findings')
+
+
+def route_planner(default_mode: str):
+    """Entry router: user_preferences['planner'] ('combined' | 'multi') hoặc mode mặc định của graph"""
+    def route(state: SearchState) -> Literal["plan_query", "analyze_query"]:
+        mode = state['user_preferences'].get('planner', default_mode)
+        return "analyze_query" if mode == 'multi' else "plan_query"
+    return route
+
+
 def build_search_graph(gemini_api_key: str, pubmed_key: str = None,
-                       scopus_key: str = None, semantic_key: str = None):
+                       scopus_key: str = None, semantic_key: str = None,
+                       planner_mode: str = 'combined', llm_provider=None, search_apis=None,
+                       checkpointer=None, gemini_service: GeminiService = None):
     """
     Build LangGraph workflow with AI Filtering & Synthesis
 
@@ -68,27 +123,60 @@ def build_search_graph(gemini_api_key: str, pubmed_key: str = None,
                                             └─ REFINE ←┘ (if needed)
                                                        ↓
                                                    SYNTHESIZE → END
+
+    planner_mode='combined': START → PLAN_QUERY (1 call) → EXECUTE → ...
+    (fallback về multi-call bên trong node nếu lỗi). user_preferences['planner']
+    chọn mode cho từng lần chạy.
+
+    llm_provider / search_apis: thay backend thật (vd StubProvider + StubSearchAPIs
+    để chạy và benchmark toàn bộ graph offline); gemini_service: dùng chung một
+    GeminiService (rate limiter + token usage) giữa nhiều graph / run
+
+    Trong lúc evaluate chấm điểm, tìm kiếm của fallback refinement được prefetch
+    (SpeculativePrefetcher, budget riêng) khi user_preferences['speculative_prefetch'] = True
+    (mặc định tắt: chỉ trúng khi refine rơi vào fallback)
+
+    execute_search là node async → chạy graph bằng ainvoke_search / astream
+    (hoặc invoke_search - sync wrapper trên event loop dùng chung)
+
+    checkpointer: LangGraph checkpointer (vd checkpointing.sqlite_checkpointer()) →
+    state được lưu sau mỗi node theo run_id, invoke_search(run_id=...) chạy tiếp
+    run bị ngắt từ node cuối đã hoàn thành
     """
     # Initialize services
-    gemini = GeminiService(gemini_api_key)
-    async_apis = AsyncSearchAPIs(pubmed_key, scopus_key, semantic_key)
+    gemini = gemini_service or GeminiService(gemini_api_key, provider=llm_provider)
+    async_apis = search_apis or AsyncSearchAPIs(pubmed_key, scopus_key, semantic_key)
+    prefetcher = SpeculativePrefetcher(async_apis)
+
+    async def execute_node(state: SearchState) -> SearchState:
+        return await aexecute_search(state, async_apis, gemini, prefetcher)
 
     # Create graph
     workflow = StateGraph(SearchState)
 
     # Add nodes with partial application
-    workflow.add_node("analyze_query", lambda state: analyze_query(state, gemini))
-    workflow.add_node("plan_strategy", lambda state: plan_strategy(state, gemini))
-    workflow.add_node("optimize_queries", lambda state: optimize_queries(state, gemini))
-    workflow.add_node("execute_search", lambda state: execute_search(state, async_apis))
-    workflow.add_node("evaluate_results", lambda state: evaluate_results(state, gemini, async_apis))
-    workflow.add_node("refine_query", lambda state: refine_query(state, gemini))
-    workflow.add_node("synthesize_findings", lambda state: synthesize_findings(state, gemini))  # NEW
+    nodes = {
+        "plan_query": lambda state: plan_query(state, gemini),
+        "analyze_query": lambda state: analyze_query(state, gemini),
+        "plan_strategy": lambda state: plan_strategy(state, gemini),
+        "optimize_queries": lambda state: optimize_queries(state, gemini),
+        "execute_search": execute_node,
+        "evaluate_results": with_speculative_prefetch(
+            lambda state: evaluate_results(state, gemini, async_apis), prefetcher),
+        "refine_query": lambda state: refine_query(state, gemini),
+        "synthesize_findings": lambda state: synthesize_findings(state, gemini)  # NEW
+    }
+    for node_name, node_fn in nodes.items():
+        workflow.add_node(node_name, track_tokens(node_name, node_fn, gemini))
 
-    # Set entry point
-    workflow.set_entry_point("analyze_query")
+    # Entry: combined planner hoặc analyze → plan → optimize
+    workflow.set_conditional_entry_point(
+        route_planner(planner_mode),
+        {"plan_query": "plan_query", "analyze_query": "analyze_query"}
+    )
 
     # Add edges (deterministic flow)
+    workflow.add_edge("plan_query", "execute_search")
     workflow.add_edge("analyze_query", "plan_strategy")
     workflow.add_edge("plan_strategy", "optimize_queries")
     workflow.add_edge("optimize_queries", "execute_search")
@@ -111,7 +199,7 @@ def build_search_graph(gemini_api_key: str, pubmed_key: str = None,
     workflow.add_edge("synthesize_findings", END)  # NEW
 
     # Compile
-    graph = workflow.compile()
+    graph = workflow.compile(checkpointer=checkpointer)
 
     print("✅ LangGraph Research Agent workflow compiled successfully!")
     print("   → NEW: AI abstract filtering + literature synthesis enabled")
@@ -119,9 +207,40 @@ def build_search_graph(gemini_api_key: str, pubmed_key: str = None,
     return graph
 
 
-def invoke_search(graph, user_query: str, user_preferences: dict, progress_callback=None):
+def invoke_search(graph, user_query: str, user_preferences: dict, progress_callback=None,
+                  stream_callback=None, run_id: str = None):
+    """
+    Sync wrapper (Streamlit boundary) cho ainvoke_search
+
+    Graph chạy trên event loop dùng chung (event_loop.shared_loop); các callback được
+    chuyển về và gọi trên thread của caller (Streamlit chỉ cho cập nhật UI từ script thread)
     """
-    Execute search workflow
+    events = queue.Queue()
+    future = shared_loop().submit(ainvoke_search(
+        graph, user_query, user_preferences,
+        progress_callback=(lambda node_name, node_state: events.put(('progress', node_name, node_state)))
+        if progress_callback else None,
+        stream_callback=(lambda text: events.put(('chunk', text))) if stream_callback else None,
+        run_id=run_id
+    ))
+    future.add_done_callback(lambda _: events.put(('done',)))
+
+    while True:
+        event = events.get()
+        if event[0] == 'done':
+            break
+        if event[0] == 'progress':
+            progress_callback(event[1], event[2])
+        else:
+            stream_callback(event[1])
+
+    return future.result()
+
+
+async def ainvoke_search(graph, user_query: str, user_preferences: dict, progress_callback=None,
+                         stream_callback=None, run_id: str = None):
+    """
+    Execute search workflow (async: graph.ainvoke / graph.astream)
 
     Args:
         graph: Compiled LangGraph
@@ -132,6 +251,11 @@ def invoke_search(graph, user_query: str, user_preferences: dict, progress_callb
             'sources': ['PubMed', 'Scopus', 'Semantic Scholar']
         }
         progress_callback: Optional callback function(node_name: str, state: dict) for progress updates
+        stream_callback: Optional callback function(text: str) nhận từng chunk của
+            literature review trong lúc synthesize_findings đang sinh (stream_mode='custom')
+        run_id: thread_id của checkpoint (graph compile với checkpointer). Run cùng ID
+            bị ngắt giữa chừng → chạy tiếp từ node cuối đã hoàn thành; đã xong → trả
+            state đã lưu, không chạy lại
 
     Returns:
         Final state với results
@@ -149,11 +273,17 @@ def invoke_search(graph, user_query: str, user_preferences: dict, progress_callb
         # NEW: AI Filtering fields
         'filtered_results': None,
         'discarded_articles': None,
+        'pending_articles': None,
         'relevance_scores': None,
         'filter_statistics': None,
+        'article_scores': None,
+        'pipeline_stats': None,
+        'article_pool': {},
         # NEW: Synthesis fields
         'synthesis_summary': None,
         'synthesis_metadata': None,
+        'token_usage': {},
+        'timings': {},
         # Output
         'final_results': [],
         'metadata': {},
@@ -167,20 +297,47 @@ def invoke_search(graph, user_query: str, user_preferences: dict, progress_callb
     print(f"Preferences: {user_preferences}")
     print(f"{'='*60}\n")
 
-    # Invoke graph with streaming if callback provided
-    if progress_callback:
-        # Stream through workflow nodes
-        for event in graph.stream(initial_state):
-            # Event is a dict with node name as key
-            for node_name, node_state in event.items():
-                print(f"📍 Node: {node_name}")
-                progress_callback(node_name, node_state)
-
-        # Get final state
-        final_state = node_state
-    else:
-        # Regular invoke without streaming
-        final_state = graph.invoke(initial_state)
+    # Checkpoint: resume theo run_id
+    config = None
+    graph_input = initial_state
+    if run_id and graph.checkpointer is not None:
+        config = {'configurable': {'thread_id': run_id}}
+        snapshot = await graph.aget_state(config)
+        if snapshot.values and snapshot.values.get('user_query') == user_query:
+            if snapshot.next:
+                print(f"♻️  Resuming run {run_id} from checkpoint (next: {', '.join(snapshot.next)})")
+                graph_input = None
+            else:
+                print(f"♻️  Run {run_id} already completed - loading state from checkpoint")
+                return snapshot.values
+
+    # Token usage đếm riêng cho run này (nhiều run có thể chạy song song trên cùng service)
+    usage_token = start_run_usage()
+    try:
+        # Invoke graph with streaming if callback provided
+        if progress_callback or stream_callback:
+            # Stream through workflow nodes (updates) + synthesis chunks (custom)
+            node_state = None
+            async for mode, event in graph.astream(graph_input, config, stream_mode=['updates', 'custom']):
+                if mode == 'custom':
+                    if stream_callback and isinstance(event, dict) and 'synthesis_chunk' in event:
+                        stream_callback(event['synthesis_chunk'])
+                    continue
+                # Event is a dict with node name as key
+                for node_name, node_state in event.items():
+                    print(f"📍 Node: {node_name}")
+                    if progress_callback:
+                        progress_callback(node_name, node_state)
+
+            # Get final state
+            final_state = node_state
+            if final_state is None and config:
+                final_state = (await graph.aget_state(config)).values
+        else:
+            # Regular invoke without streaming
+            final_state = await graph.ainvoke(graph_input, config)
+    finally:
+        end_run_usage(usage_token)
 
     print(f"\n{'='*60}")
     print(f"✅ Research Agent Workflow Completed")
@@ -207,6 +364,16 @@ def invoke_search(graph, user_query: str, user_preferences: dict, progress_callb
         print(f"  - Status: {synth_meta.get('status', 'unknown')}")
         print(f"  - Papers synthesized: {synth_meta.get('papers_count', 0)}")
 
+    timings = final_state.get('timings') or {}
+    if 'time_to_first_search_s' in timings:
+        planner = (final_state.get('search_strategy') or {}).get('planner', 'multi')
+        print(f"\nTime to first search: {timings['time_to_first_search_s']}s (planner: {planner})")
+
+    token_total = (final_state.get('token_usage') or {}).get('total')
+    if token_total:
+        print(f"\nToken usage: {token_total['calls']} calls, {token_total['prompt_tokens']} prompt + "
+              f"{token_total['output_tokens']} output tokens")
+
     print(f"{'='*60}\n")
 
     return final_state
@@ -0,0 +1,150 @@
+"""
+Local Lexical Pre-ranking (BM25)
+Chấm điểm title + abstract theo query, keywords & MeSH terms - không cần network,
+dùng để quyết định bài nào cần gửi cho LLM filter
+"""
+import re
+import unicodedata
+from collections import Counter
+from typing import List, Dict, Tuple
+
+import numpy as np
+
+
+STOPWORDS = {
+    'a', 'an', 'the', 'of', 'in', 'on', 'for', 'and', 'or', 'not', 'with', 'to', 'from',
+    'by', 'at', 'as', 'is', 'are', 'was', 'were', 'be', 'been', 'this', 'that', 'these',
+    'those', 'it', 'its', 'we', 'our', 'using', 'use', 'used', 'based', 'study', 'studies',
+    'results', 'methods', 'conclusion', 'conclusions', 'background', 'objective', 'mesh',
+    'title', 'abs', 'key', 'vs', 'than', 'between', 'into', 'after', 'during', 'about'
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase, bỏ dấu, bỏ stopwords, stem rất nhẹ (bỏ 's' số nhiều)"""
+    if not text or text == 'N/A':
+        return []
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    tokens = []
+    for token in re.findall(r'[a-z0-9]+', text):
+        if token in STOPWORDS or len(token) < 2:
+            continue
+        if len(token) > 4 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def article_text(article: Dict) -> str:
+    return f"{article.get('title', '')} {article.get('abstract', '')}"
+
+
+class BM25Scorer:
+    """Okapi BM25, vectorized với numpy trên term-frequency matrix (docs x query terms)"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+    def score(self, query_terms: List[str], documents: List[str]) -> np.ndarray:
+        """
+        Args:
+            query_terms: Tokens của query (được lặp lại = trọng số cao hơn)
+            documents: Raw text của từng document
+
+        Returns:
+            BM25 score cho mỗi document
+        """
+        if not documents:
+            return np.zeros(0)
+
+        query_weights = Counter(query_terms)
+        terms = list(query_weights)
+        if not terms:
+            return np.zeros(len(documents))
+
+        term_index = {term: j for j, term in enumerate(terms)}
+        tf = np.zeros((len(documents), len(terms)), dtype=np.float64)
+        doc_len = np.zeros(len(documents), dtype=np.float64)
+
+        for i, doc in enumerate(documents):
+            tokens = tokenize(doc)
+            doc_len[i] = len(tokens)
+            for token, count in Counter(tokens).items():
+                j = term_index.get(token)
+                if j is not None:
+                    tf[i, j] = count
+
+        n_docs = len(documents)
+        df = (tf > 0).sum(axis=0)
+        idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+
+        avg_len = doc_len.mean() if doc_len.mean() > 0 else 1.0
+        norm = self.k1 * (1.0 - self.b + self.b * doc_len / avg_len)
+        term_scores = idf * (tf * (self.k1 + 1.0)) / (tf + norm[:, None])
+
+        weights = np.array([query_weights[t] for t in terms], dtype=np.float64)
+        return term_scores @ weights
+
+
+def build_query_terms(user_query: str, query_analysis: Dict = None) -> List[str]:
+    """Query + keywords + MeSH terms (keywords/MeSH lặp lại 1 lần → trọng số x2)"""
+    terms = tokenize(user_query)
+    if query_analysis:
+        for phrase in query_analysis.get('keywords', []) + query_analysis.get('mesh_terms', []):
+            terms.extend(tokenize(phrase) * 2)
+    return terms
+
+
+def lexical_gate(articles: List[Dict], user_query: str, query_analysis: Dict = None,
+                 top_k: int = 20, discard_ratio: float = 0.1) -> Tuple[List[Dict], List[Dict], Dict]:
+    """
+    Chia articles thành: gửi LLM (top-K + vùng không chắc chắn) và tự động loại
+
+    - Score được chuẩn hóa theo score cao nhất (0-1) và ghi vào article['lexical_score']
+    - Loại bài có normalized score < discard_ratio và không thuộc top-K
+      (scoring_tier = 'lexical', không có relevance_score vì LLM chưa chấm)
+    - Nếu không có bài nào khớp từ khóa (vd query tiếng Việt, abstract tiếng Anh)
+      → gate bị bỏ qua, gửi tất cả cho LLM
+
+    Returns:
+        (to_llm, auto_discarded, stats)
+    """
+    stats = {'scored': len(articles), 'sent_to_llm': len(articles), 'auto_discarded': 0, 'llm_calls_saved': 0}
+    if not articles:
+        return articles, [], stats
+
+    query_terms = build_query_terms(user_query, query_analysis)
+    scores = BM25Scorer().score(query_terms, [article_text(a) for a in articles])
+    max_score = scores.max() if len(scores) else 0.0
+
+    if max_score <= 0:
+        print("   → Lexical gate skipped (no keyword overlap with any article)")
+        return articles, [], stats
+
+    normalized = scores / max_score
+    ranks = np.argsort(-normalized, kind='stable')
+    top = set(ranks[:top_k].tolist())
+
+    to_llm = []
+    auto_discarded = []
+    for idx, article in enumerate(articles):
+        article['lexical_score'] = round(float(normalized[idx]), 3)
+        if idx in top or normalized[idx] >= discard_ratio:
+            to_llm.append(article)
+        else:
+            article['discard_reason'] = (
+                f"Lexical pre-filter: very low keyword match ({normalized[idx]:.2f} of best match)"
+            )
+            article['scoring_tier'] = 'lexical'
+            auto_discarded.append(article)
+
+    stats.update({
+        'sent_to_llm': len(to_llm),
+        'auto_discarded': len(auto_discarded),
+        'llm_calls_saved': len(auto_discarded)
+    })
+    print(f"   → Lexical gate: {len(to_llm)} to LLM, {len(auto_discarded)} auto-discarded "
+          f"({len(auto_discarded)} LLM calls saved)")
+    return to_llm, auto_discarded, stats
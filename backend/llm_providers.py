@@ -0,0 +1,369 @@
+"""
+LLM Providers
+Interface chung cho mọi lời gọi LLM của GeminiService (sync / async / cached context):
+- GeminiProvider: bọc google-genai client
+- StubProvider: trả kết quả cố định (deterministic) theo prompt, latency + lỗi giả lập,
+  để chạy và đo toàn bộ graph offline (không cần API key / network)
+"""
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+from .prompts.budget import count_tokens
+
+
+class LLMProvider(ABC):
+    """
+    Interface tối thiểu mà GeminiService cần (subclass thiếu method → lỗi ngay khi khởi tạo)
+
+    Response trả về phải có .text và (tuỳ chọn) .usage_metadata như google-genai,
+    để TokenUsage ghi token spend giống nhau cho mọi provider.
+    """
+
+    name = 'base'
+
+    @abstractmethod
+    def generate(self, model: str, contents, config: Dict = None, task: str = 'text'):
+        """Một lời gọi (sync), trả về response có .text"""
+
+    @abstractmethod
+    async def agenerate(self, model: str, contents, config: Dict = None, task: str = 'text'):
+        """Async version of generate"""
+
+    def generate_stream(self, model: str, contents, config: Dict = None, task: str = 'text'):
+        """Yield các chunk (.text, chunk cuối có .usage_metadata); mặc định = 1 chunk duy nhất"""
+        yield self.generate(model, contents, config, task)
+
+    @abstractmethod
+    def create_cache(self, model: str, system_instruction: str, ttl: int) -> str:
+        """Tạo cached content, trả về tên cache (raise nếu provider không hỗ trợ)"""
+
+
+class GeminiProvider(LLMProvider):
+    """google-genai client (models / aio.models / caches)"""
+
+    name = 'gemini'
+
+    def __init__(self, api_key: str = None, client=None):
+        if client is None:
+            from google import genai
+            client = genai.Client(api_key=api_key)
+        self.client = client
+
+    def generate(self, model: str, contents, config: Dict = None, task: str = 'text'):
+        return self.client.models.generate_content(model=model, contents=contents, config=config)
+
+    async def agenerate(self, model: str, contents, config: Dict = None, task: str = 'text'):
+        return await self.client.aio.models.generate_content(model=model, contents=contents, config=config)
+
+    def generate_stream(self, model: str, contents, config: Dict = None, task: str = 'text'):
+        yield from self.client.models.generate_content_stream(model=model, contents=contents, config=config)
+
+    def create_cache(self, model: str, system_instruction: str, ttl: int) -> str:
+        from google.genai import types
+        cache = self.client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                system_instruction=system_instruction,
+                ttl=f'{ttl}s'
+            )
+        )
+        return cache.name
+
+
+class StubProviderError(Exception):
+    """Lỗi giả lập của StubProvider (message chứa 429 khi mô phỏng rate limit)"""
+
+
+QUERY_RE = re.compile(r'(?:Query(?: gốc)?|Original(?: query)?|USER QUERY)\**:?\**\s*"([^"]+)"')
+WORD_RE = re.compile(r'[^\W\d_]{3,}', re.UNICODE)
+STUB_STOPWORDS = {'and', 'the', 'for', 'with', 'from', 'của', 'trong', 'các', 'những', 'cho', 'và'}
+MEDICAL_CUES = ('wound', 'patient', 'clinical', 'disease', 'cancer', 'diagnos', 'therapy',
+                'vết thương', 'bệnh', 'điều trị', 'health', 'medical')
+CS_CUES = ('algorithm', 'network', 'software', 'computer', 'learning', 'robot', 'blockchain')
+
+
+def _digest(*parts) -> int:
+    return zlib.crc32('|'.join(str(p) for p in parts).encode('utf-8'))
+
+
+def extract_query(prompt: str) -> str:
+    match = QUERY_RE.search(prompt or '')
+    return match.group(1) if match else ''
+
+
+def query_keywords(query: str, limit: int = 5) -> list:
+    words = [w for w in WORD_RE.findall(query.lower()) if w not in STUB_STOPWORDS]
+    return list(dict.fromkeys(words))[:limit] or ['research']
+
+
+def stub_analysis(query: str) -> Dict:
+    lowered = query.lower()
+    if any(cue in lowered for cue in MEDICAL_CUES):
+        topic = 'medical'
+    elif any(cue in lowered for cue in CS_CUES):
+        topic = 'computer_science'
+    else:
+        topic = 'other'
+    keywords = query_keywords(query)
+    return {
+        'topic': topic,
+        'intent': 'review' if 'review' in lowered or 'tổng quan' in lowered else 'general_research',
+        'language': 'en' if query.isascii() else 'vi',
+        'complexity': 'medium',
+        'keywords': keywords,
+        'mesh_terms': [k.title() for k in keywords[:2]] if topic == 'medical' else []
+    }
+
+
+def stub_queries(query: str, sources) -> Dict[str, str]:
+    keywords = query_keywords(query, 3)
+    queries = {
+        'PubMed': ('pubmed', ' AND '.join(keywords)),
+        'Scopus': ('scopus', 'TITLE-ABS-KEY("' + '" AND "'.join(keywords) + '")'),
+        'Semantic Scholar': ('semantic', query)
+    }
+    return dict(queries[s] for s in sources if s in queries)
+
+
+def preferred_sources(prompt: str) -> list:
+    match = re.search(r'Preferred sources:\s*(.+)', prompt)
+    listed = [s.strip() for s in match.group(1).split(',')] if match else []
+    sources = [s for s in listed if s in ('PubMed', 'Scopus', 'Semantic Scholar')]
+    return sources or ['PubMed', 'Semantic Scholar']
+
+
+def stub_score(text: str) -> Dict:
+    """Điểm theo title (nếu có) để single / batch / cascade cho cùng kết quả"""
+    title = re.search(r'Title: (.+)', text)
+    score = _digest(title.group(1).strip() if title else text) % 10 + 1
+    return {
+        'relevance_score': score,
+        'keep': score >= 7,
+        'reasoning': f"Stub score {score}/10",
+        'key_finding': 'Stub finding' if score >= 7 else 'N/A'
+    }
+
+
+def _respond_analyze(prompt, config):
+    return json.dumps(stub_analysis(extract_query(prompt)), ensure_ascii=False)
+
+
+def _respond_strategy(prompt, config):
+    sources = preferred_sources(prompt)
+    return json.dumps({
+        'sources': sources,
+        'source_priority': ' > '.join(sources),
+        'parallel_search': True,
+        'filters': {'year_range': [2020, 2025], 'max_results_per_source': 10},
+        'reason': 'Stub strategy'
+    })
+
+
+def _respond_optimize(prompt, config):
+    quoted = re.search(r'"([^"]+)"', prompt)
+    query = extract_query(prompt) or (quoted.group(1) if quoted else '')
+    if 'PubMed' in prompt:
+        return stub_queries(query, ['PubMed'])['pubmed']
+    if 'Scopus' in prompt:
+        return stub_queries(query, ['Scopus'])['scopus']
+    return query
+
+
+def _respond_plan(prompt, config):
+    query = extract_query(prompt)
+    sources = preferred_sources(prompt)
+    return json.dumps({
+        'analysis': stub_analysis(query),
+        'strategy': {'sources': sources, 'source_priority': ' > '.join(sources), 'reason': 'Stub plan'},
+        'queries': stub_queries(query, sources)
+    }, ensure_ascii=False)
+
+
+def _respond_refine(prompt, config):
+    query = extract_query(prompt)
+    keys = set(re.findall(r'"(pubmed|scopus|semantic)":', prompt))
+    queries = stub_queries(query, ['PubMed', 'Scopus', 'Semantic Scholar'])
+    variants = re.search(r'(\d+) query variants', prompt)
+    if variants:
+        # Variant 1 giữ nguyên topic (review), các variant sau thêm một khía cạnh
+        facets = ('review', 'outcomes', 'accuracy', 'validation', 'cost', 'adoption')
+        count = int(variants.group(1))
+        new_queries = {k: [f"{v} OR {facets[i % len(facets)]}" for i in range(count)]
+                       for k, v in queries.items() if k in keys}
+    else:
+        new_queries = {k: f"{v} OR review" for k, v in queries.items() if k in keys}
+    return json.dumps({
+        'new_queries': new_queries,
+        'adjust_filters': {'year_range': [2015, 2025]},
+        'explanation': 'Stub refinement: broadened year range'
+    }, ensure_ascii=False)
+
+
+def _respond_score(prompt, config):
+    return json.dumps(stub_score(prompt))
+
+
+def _respond_score_batch(prompt, config):
+    blocks = re.split(r'--- PAPER (\d+) ---', prompt)[1:]
+    entries = []
+    for paper_id, block in zip(blocks[::2], blocks[1::2]):
+        entries.append({'paper_id': int(paper_id), **stub_score(block.strip())})
+    return json.dumps(entries)
+
+
+def _respond_synthesis(prompt, config):
+    n_papers = len(re.findall(r'^\[\d+\]', prompt, re.MULTILINE))
+    query = extract_query(prompt)
+    return (f"### Literature Review (stub)\n\n**Query:** {query}\n\n"
+            f"Synthesized {n_papers} papers. Main themes, methods and gaps are summarized "
+            f"deterministically for offline benchmarking [1].")
+
+
+def _respond_synthesis_chunk(prompt, config):
+    titles = re.findall(r'^\[(\d+)\] .*?: (.+)$', prompt, re.MULTILINE)
+    return "\n".join(f"- {title.strip()[:60]} reports relevant findings [{n}]" for n, title in titles)
+
+
+def _respond_synthesis_reduce(prompt, config):
+    return "\n".join(line for line in prompt.splitlines() if line.startswith('- '))
+
+
+def _respond_text(prompt, config):
+    if (config or {}).get('response_mime_type') == 'application/json':
+        return json.dumps({'result': 'stub'})
+    return f"Stub response ({count_tokens(prompt)} prompt tokens)"
+
+
+STUB_RESPONDERS = {
+    'analyze': _respond_analyze,
+    'strategy': _respond_strategy,
+    'optimize': _respond_optimize,
+    'plan': _respond_plan,
+    'refine': _respond_refine,
+    'score': _respond_score,
+    'score_batch': _respond_score_batch,
+    'synthesis': _respond_synthesis,
+    'synthesis_chunk': _respond_synthesis_chunk,
+    'synthesis_reduce': _respond_synthesis_reduce,
+    'text': _respond_text
+}
+
+
+class StubProvider(LLMProvider):
+    """
+    Provider giả lập, deterministic theo prompt
+
+    - Nội dung response sinh từ prompt theo task (analyze / plan / score / ...),
+      cùng prompt → cùng kết quả
+    - Latency = base_latency + latency_per_1k * (token chưa cache + cached_discount * token đã cache)
+      + output_token_latency * token sinh ra (stream: chunk đầu tới sau phần prompt)
+    - error_rate: tỉ lệ lỗi giả lập, quyết định bằng hash(seed, prompt, lần thử) nên retry
+      của cùng prompt có thể thành công; rate_limit_share = phần lỗi mang mã 429
+    """
+
+    name = 'stub'
+
+    def __init__(self, base_latency: float = 0.05, latency_per_1k: float = 0.2,
+                 cached_discount: float = 0.25, error_rate: float = 0.0,
+                 rate_limit_share: float = 0.5, seed: int = 0, output_tokens: int = None,
+                 stream_chunk_words: int = 12, output_token_latency: float = 0.002):
+        self.base_latency = base_latency
+        self.latency_per_1k = latency_per_1k
+        self.cached_discount = cached_discount
+        self.error_rate = error_rate
+        self.rate_limit_share = rate_limit_share
+        self.seed = seed
+        self.output_tokens = output_tokens
+        self.stream_chunk_words = stream_chunk_words
+        self.output_token_latency = output_token_latency
+        self.cached = {}
+        self.stats = {'calls': 0, 'errors': 0, 'by_task': {}}
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def create_cache(self, model: str, system_instruction: str, ttl: int) -> str:
+        with self._lock:
+            name = f"cachedContents/stub-{len(self.cached) + 1}"
+            self.cached[name] = count_tokens(system_instruction)
+        return name
+
+    def _maybe_fail(self, task: str, contents: str):
+        if self.error_rate <= 0:
+            return
+        key = hashlib.md5(f"{task}:{contents}".encode('utf-8')).hexdigest()
+        with self._lock:
+            attempt = self._attempts.get(key, 0)
+            self._attempts[key] = attempt + 1
+        roll = _digest(self.seed, key, attempt) % 10000 / 10000
+        if roll < self.error_rate:
+            with self._lock:
+                self.stats['errors'] += 1
+            if roll < self.error_rate * self.rate_limit_share:
+                raise StubProviderError("429 RESOURCE_EXHAUSTED (stub rate limit)")
+            raise StubProviderError("503 UNAVAILABLE (stub error)")
+
+    def _respond(self, model: str, contents, config, task: str):
+        config = dict(config or {})
+        contents = contents if isinstance(contents, str) else str(contents)
+        with self._lock:
+            self.stats['calls'] += 1
+            self.stats['by_task'][task] = self.stats['by_task'].get(task, 0) + 1
+        self._maybe_fail(task, contents)
+
+        cached = self.cached.get(config.get('cached_content'), 0)
+        uncached = count_tokens(contents) + count_tokens(config.get('system_instruction'))
+        text = STUB_RESPONDERS.get(task, _respond_text)(contents, config)
+        response = SimpleNamespace(
+            text=text,
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=uncached + cached,
+                candidates_token_count=self.output_tokens or count_tokens(text),
+                cached_content_token_count=cached
+            )
+        )
+        latency = self.base_latency + (uncached + self.cached_discount * cached) / 1000 * self.latency_per_1k
+        return response, latency
+
+    def _total_latency(self, response, prompt_latency: float) -> float:
+        return prompt_latency + response.usage_metadata.candidates_token_count * self.output_token_latency
+
+    def generate(self, model: str, contents, config: Dict = None, task: str = 'text'):
+        response, latency = self._respond(model, contents, config, task)
+        time.sleep(self._total_latency(response, latency))
+        return response
+
+    async def agenerate(self, model: str, contents, config: Dict = None, task: str = 'text'):
+        response, latency = self._respond(model, contents, config, task)
+        await asyncio.sleep(self._total_latency(response, latency))
+        return response
+
+    def generate_stream(self, model: str, contents, config: Dict = None, task: str = 'text'):
+        """Chunk đầu sau latency của prompt, các chunk sau cách nhau theo số token sinh ra"""
+        response, latency = self._respond(model, contents, config, task)
+        time.sleep(latency)
+        words = response.text.split(' ')
+        step = max(1, self.stream_chunk_words)
+        chunks = [' '.join(words[i:i + step]) + (' ' if i + step < len(words) else '')
+                  for i in range(0, len(words), step)]
+        for n, chunk in enumerate(chunks):
+            if n:
+                time.sleep(count_tokens(chunk) * self.output_token_latency)
+            last = n == len(chunks) - 1
+            yield SimpleNamespace(text=chunk, usage_metadata=response.usage_metadata if last else None)
+
+
+def create_provider(kind: str = 'gemini', api_key: str = None, **options) -> Optional[LLMProvider]:
+    """'gemini' (cần api_key, không có → None) | 'stub'"""
+    if kind == 'stub':
+        return StubProvider(**options)
+    if kind == 'gemini':
+        return GeminiProvider(api_key) if api_key else None
+    raise ValueError(f"Unknown LLM provider: {kind}")
@@ -45,13 +45,11 @@ Trả về CHÍNH XÁC JSON format (KHÔNG có markdown):
     
     try:
         # Call Gemini
-        response = gemini.client.models.generate_content(
-            model='gemini-2.0-flash',
-            contents=prompt,
-            config={
-                'response_mime_type': 'application/json',
-                'temperature': 0.3
-            }
+        response = gemini.generate(
+            prompt,
+            task='analyze',
+            response_mime_type='application/json',
+            temperature=0.3
         )
         
         analysis_text = response.text.strip()
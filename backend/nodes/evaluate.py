@@ -4,13 +4,28 @@ Node: Evaluate Results with AI Abstract Filtering
 """
 from typing import Dict, List
 from ..state_schema import SearchState
-from ..gemini_service import GeminiService
+from ..gemini_service import GeminiService, is_rate_limit_error
+from ..event_loop import run_sync
 from ..async_apis import AsyncSearchAPIs
-from ..prompts.filter_prompt import create_filter_prompt
+from ..prompts.filter_prompt import create_filter_prompt, create_filter_rubric, create_paper_prompt, \
+    create_batch_filter_prompt
+from ..prompts.budget import TokenUsage, count_tokens, pack_by_tokens, add_node_usage
+from ..project_manager import ProjectManager
+from ..record_linkage import article_key, article_keys
+from ..lexical_ranker import lexical_gate, BM25Scorer, build_query_terms, article_text
+from ..prescreen import DEFAULT_MODEL_PATH as DEFAULT_PRESCREEN_MODEL, load_model as load_prescreen_model, \
+    prescreen as run_prescreen
+import asyncio
+import inspect
 import json
+import math
 import time
 
 
+SCORING_MODEL = 'gemini-2.0-flash'
+CASCADE_MODELS = ('gemini-2.0-flash-lite', SCORING_MODEL)
+
+
 def evaluate_results(state: SearchState, gemini: GeminiService, async_apis: AsyncSearchAPIs) -> SearchState:
     """
     NEW EVALUATION PROCESS:
@@ -20,6 +35,10 @@ def evaluate_results(state: SearchState, gemini: GeminiService, async_apis: Asyn
     4. Calculate math-based quality score
     5. Decide refinement based on kept_count vs target
 
+    Kết quả được cộng dồn qua các vòng refinement (state['article_pool']):
+    bài đã chấm ở vòng trước không chấm lại, filtered_results / quyết định
+    refinement dựa trên tập bài kept tích lũy (tắt: user_preferences['accumulate_results'] = False)
+
     Stopping criteria:
     1. Kept papers >= 50% of target
     2. Already refined 2 times
@@ -29,18 +48,21 @@ def evaluate_results(state: SearchState, gemini: GeminiService, async_apis: Asyn
     query_analysis = state.get('query_analysis', {})
     preferences = state['user_preferences']
     refinement_count = state.get('refinement_count', 0)
+    accumulate = preferences.get('accumulate_results', True)
+    article_pool = dict(state.get('article_pool') or {}) if accumulate else {}
 
     # Count total results
     total_count = sum(len(articles) for articles in results_dict.values())
 
-    # Basic check: No results
-    if total_count == 0:
+    # Basic check: No results (và chưa có gì tích lũy từ vòng trước)
+    if total_count == 0 and not article_pool:
         state['needs_refinement'] = True
         state['refinement_reason'] = "No results found"
         state['quality_score'] = 0.0
         state['final_results'] = []
         state['filtered_results'] = []
         state['discarded_articles'] = []
+        state['pending_articles'] = []
         state['filter_statistics'] = {
             'total_found': 0,
             'kept': 0,
@@ -59,36 +81,118 @@ def evaluate_results(state: SearchState, gemini: GeminiService, async_apis: Asyn
     unique_articles = async_apis.deduplicate_results(results_dict)
     print(f"   → {len(unique_articles)} unique articles after deduplication")
 
+    # Step 1a: Bài đã chấm ở vòng trước (article pool) → giữ nguyên, không chấm lại
+    unique_articles, carried = split_pooled(unique_articles, article_pool)
+    if carried:
+        print(f"   → {len(carried)} articles already scored in earlier iterations (carried forward)")
+
+    # Step 1b: Project-wide dedup - bài đã lưu trong project không cần chấm lại
+    unique_articles, known_articles = apply_seen_index(unique_articles, preferences, user_query)
+
+    # Step 1c: Bài đã được chấm trong lúc tìm kiếm (pipelined execute)
+    scoring_options = dict(preferences.get('scoring', {}))
+    score_threshold = scoring_options.get('score_threshold', 7.0)
+    unique_articles, prescored = split_prescored(unique_articles, state.get('article_scores') or {})
+    if prescored:
+        print(f"   → {len(prescored)} articles already scored during search (pipeline)")
+
     # Step 2: AI Filter & Rank every article
     print(f"\n🤖 Step 2: AI filtering {len(unique_articles)} articles by relevance...")
-    filtered_results, discarded_articles, relevance_scores = filter_by_ai_relevance(
+    if scoring_options.pop('early_stop', False):
+        # Bài đã biết / đã chấm (score >= 7) cũng tính vào target
+        known_kept = sum(1 for a in known_articles if a['relevance_score'] >= score_threshold)
+        known_kept += sum(1 for _, result in prescored
+                          if result.get('keep') and float(result.get('relevance_score', 0)) >= score_threshold)
+        known_kept += sum(1 for a in article_pool.values() if a.get('kept'))
+        scoring_options['early_stop_at'] = max(0, preferences.get('max_results', 10) - known_kept)
+
+    ignored = sorted(set(scoring_options) - SCORING_OPTIONS)
+    if ignored:
+        print(f"   ⚠️  Ignoring unknown scoring options: {', '.join(ignored)}")
+    filtered_results, discarded_articles, relevance_scores, scoring_stats = filter_by_ai_relevance(
         unique_articles,
         user_query,
         query_analysis,
-        gemini
+        gemini,
+        **{k: v for k, v in scoring_options.items() if k in SCORING_OPTIONS}
     )
+    pending_articles = scoring_stats.pop('pending_articles', [])
+
+    for article, result in prescored:
+        if result.get('scoring_tier') == 'lexical':
+            article['scoring_tier'] = 'lexical'
+            article['discard_reason'] = result.get('reasoning', '')
+            discarded_articles.append(article)
+            continue
+        _apply_score(article, result, article_key(article), score_threshold,
+                     filtered_results, discarded_articles, relevance_scores,
+                     tier='pipeline', model=result.get('scoring_model', SCORING_MODEL))
+    unique_articles = unique_articles + [article for article, _ in prescored]
+    pipeline_stats = state.get('pipeline_stats') or {}
+    scoring_stats['llm_calls'] += pipeline_stats.get('llm_calls', 0)
+
+    # Bài đã biết: dùng lại score đã lưu trong project
+    for article in known_articles:
+        score = article['relevance_score']
+        relevance_scores[article_key(article)] = score
+        if score >= score_threshold:
+            filtered_results.append(article)
+        else:
+            discarded_articles.append(article)
+    unique_articles = unique_articles + known_articles
+    new_articles = len(unique_articles)
+
+    # Cộng dồn vào pool, thống kê & quyết định trên tập tích lũy
+    if accumulate:
+        state['article_scores'] = record_scores(state.get('article_scores'), filtered_results, discarded_articles)
+    article_pool = add_to_pool(article_pool, filtered_results, discarded_articles, refinement_count)
+    filtered_results = [a for a in article_pool.values() if a['kept']]
+    discarded_articles = [a for a in article_pool.values() if not a['kept']]
+    # Bài bị lexical gate loại không có điểm LLM → không tính vào relevance_scores / avg_score
+    relevance_scores = {key: a['relevance_score'] for key, a in article_pool.items()
+                        if a.get('relevance_score') is not None}
+    unique_articles = list(article_pool.values()) + pending_articles
+    scored_count = len(article_pool)
 
     # Step 3: Calculate statistics
     total_found = len(unique_articles)
     kept_count = len(filtered_results)
     discarded_count = len(discarded_articles)
-    avg_score = sum(relevance_scores.values()) / total_found if total_found > 0 else 0.0
-    pass_rate = kept_count / total_found if total_found > 0 else 0.0
+    avg_score = sum(relevance_scores.values()) / len(relevance_scores) if relevance_scores else 0.0
+    pass_rate = kept_count / scored_count if scored_count > 0 else 0.0
 
     filter_statistics = {
         'total_found': total_found,
         'kept': kept_count,
         'discarded': discarded_count,
         'avg_score': round(avg_score, 2),
-        'pass_rate': round(pass_rate * 100, 1)  # Percentage
+        'pass_rate': round(pass_rate * 100, 1),  # Percentage
+        'already_seen': sum(1 for a in unique_articles if a.get('already_seen')),
+        'llm_calls_saved_seen': len(known_articles),
+        'pending': len(pending_articles),
+        'llm_calls': scoring_stats['llm_calls'],
+        'llm_calls_saved_lexical': (scoring_stats.get('lexical', {}).get('llm_calls_saved', 0)
+                                    + pipeline_stats.get('llm_calls_saved_lexical', 0)),
+        'llm_calls_saved_prescreen': (scoring_stats.get('prescreen', {}).get('llm_calls_saved', 0)
+                                      + pipeline_stats.get('llm_calls_saved_prescreen', 0)),
+        'scoring_batches': scoring_stats['batches'],
+        'cascade_tiers': scoring_stats.get('cascade', {}).get('tiers', []),
+        'scored_during_search': len(prescored),
+        'pipeline': state.get('pipeline_stats'),
+        'new_this_iteration': new_articles,
+        'carried_forward': len(carried),
+        'pool_size': len(article_pool)
     }
 
     print(f"\n📊 Filter Statistics:")
-    print(f"   - Total found: {total_found}")
+    print(f"   - Total found: {total_found} ({new_articles} new this iteration, {len(carried)} carried forward)")
     print(f"   - Kept (score >= 7): {kept_count}")
     print(f"   - Discarded: {discarded_count}")
     print(f"   - Avg relevance score: {avg_score:.2f}/10")
     print(f"   - Pass rate: {pass_rate*100:.1f}%")
+    print(f"   - LLM calls: {scoring_stats['llm_calls']} "
+          f"(saved: {filter_statistics['llm_calls_saved_lexical']} lexical, "
+          f"{filter_statistics['llm_calls_saved_prescreen']} pre-screen, {len(known_articles)} already seen)")
 
     # Step 4: Calculate quality score (math-based, not AI guessing)
     quality_score = pass_rate  # Simple: % of papers that passed filter
@@ -112,8 +216,10 @@ def evaluate_results(state: SearchState, gemini: GeminiService, async_apis: Asyn
         reason = f"Sufficient quality papers ({kept_count} >= {requested*0.5:.0f})"
 
     # Update state with new fields
+    state['article_pool'] = article_pool
     state['filtered_results'] = filtered_results
     state['discarded_articles'] = discarded_articles
+    state['pending_articles'] = pending_articles
     state['relevance_scores'] = relevance_scores
     state['filter_statistics'] = filter_statistics
     state['final_results'] = filtered_results  # Final results are the filtered ones
@@ -135,6 +241,7 @@ def evaluate_results(state: SearchState, gemini: GeminiService, async_apis: Asyn
     state['metadata'] = {
         'total_found': total_count,
         'unique_count': len(unique_articles),
+        'pool_size': len(article_pool),
         'filtered_count': kept_count,
         'quality_score': quality_score,
         'refinement_count': refinement_count,
@@ -144,13 +251,173 @@ def evaluate_results(state: SearchState, gemini: GeminiService, async_apis: Asyn
     return state
 
 
+def score_cache_keys(article: Dict) -> List[str]:
+    """Key tra cứu state['article_scores']: mọi ID đã biết + hash của title"""
+    keys = article_keys(article)
+    title_key = article_key({'title': article.get('title', '')})
+    return keys if title_key in keys else keys + [title_key]
+
+
+def split_pooled(articles: List[Dict], article_pool: Dict) -> tuple:
+    """
+    Tách bài đã có trong state['article_pool'] (đã chấm ở vòng trước)
+
+    Returns:
+        (new_articles, carried_articles)
+    """
+    if not article_pool:
+        return articles, []
+    index = {key for article in article_pool.values() for key in score_cache_keys(article)}
+    new, carried = [], []
+    for article in articles:
+        (carried if any(key in index for key in score_cache_keys(article)) else new).append(article)
+    return new, carried
+
+
+def add_to_pool(article_pool: Dict, kept: List[Dict], discarded: List[Dict], iteration: int) -> Dict:
+    """Thêm bài vừa chấm vào pool {article key: article}, giữ thứ tự tìm thấy"""
+    article_pool = dict(article_pool)
+    for articles, is_kept in ((kept, True), (discarded, False)):
+        for article in articles:
+            key = article_key(article)
+            if key in article_pool:
+                continue
+            article['kept'] = is_kept
+            article.setdefault('found_in_iteration', iteration)
+            article_pool[key] = article
+    return article_pool
+
+
+def record_scores(article_scores: Dict, kept: List[Dict], discarded: List[Dict]) -> Dict:
+    """
+    Ghi kết quả chấm vào state['article_scores'] (mọi key của bài) để các vòng sau
+    (pipelined execute, split_prescored) dùng lại thay vì gọi LLM
+    """
+    article_scores = dict(article_scores or {})
+    for articles, is_kept in ((kept, True), (discarded, False)):
+        for article in articles:
+            if article.get('relevance_score') is not None:
+                entry = {
+                    'relevance_score': article['relevance_score'],
+                    'keep': is_kept,
+                    'reasoning': article.get('ai_reasoning', ''),
+                    'key_finding': article.get('key_finding', 'N/A'),
+                    'scoring_model': article.get('scoring_model', SCORING_MODEL)
+                }
+            elif article.get('scoring_tier') == 'lexical':
+                # Bị lexical gate loại: ghi lại quyết định, không có điểm LLM
+                entry = {'relevance_score': None, 'keep': False, 'scoring_tier': 'lexical',
+                         'reasoning': article.get('discard_reason', '')}
+            else:
+                continue
+            for key in score_cache_keys(article):
+                article_scores.setdefault(key, entry)
+    return article_scores
+
+
+def split_prescored(articles: List[Dict], article_scores: Dict) -> tuple:
+    """
+    Tách bài đã có điểm trong state['article_scores']
+
+    Returns:
+        (articles_to_score, [(article, cached_result)])
+    """
+    if not article_scores:
+        return articles, []
+    to_score, prescored = [], []
+    for article in articles:
+        result = next((article_scores[k] for k in score_cache_keys(article) if k in article_scores), None)
+        if result is None:
+            to_score.append(article)
+        else:
+            prescored.append((article, result))
+    return to_score, prescored
+
+
+def same_query(a: str, b: str) -> bool:
+    return bool(a) and bool(b) and ' '.join(a.lower().split()) == ' '.join(b.lower().split())
+
+
+def apply_seen_index(articles: List[Dict], preferences: Dict, user_query: str = '') -> tuple:
+    """
+    Đối chiếu articles với seen index của project (user_preferences['project_id'])
+
+    seen_policy:
+    - 'flag' (default): đánh dấu already_seen; chỉ dùng lại score đã lưu (không gọi LLM)
+      khi score được chấm cho cùng câu truy vấn, ngược lại chấm lại
+    - 'skip': loại bỏ bài đã lưu khỏi kết quả
+
+    Returns:
+        (articles_to_score, known_articles_with_scores)
+    """
+    project_id = preferences.get('project_id')
+    if not project_id:
+        return articles, []
+
+    try:
+        pm = ProjectManager(preferences.get('projects_dir', 'projects'))
+        seen_articles = pm.get_seen_articles(project_id)
+    except Exception as e:
+        print(f"   ⚠️  Cannot load seen index for project {project_id}: {e}")
+        return articles, []
+
+    if not seen_articles:
+        return articles, []
+
+    policy = preferences.get('seen_policy', 'flag')
+    to_score = []
+    known = []
+    skipped = 0
+
+    for article in articles:
+        stored = next((seen_articles[k] for k in article_keys(article) if k in seen_articles), None)
+        if stored is None:
+            to_score.append(article)
+            continue
+
+        if policy == 'skip':
+            skipped += 1
+            continue
+
+        article['already_seen'] = True
+        article['seen_in_search'] = stored.get('first_seen')
+        # Score của query khác không dùng lại được (relevance phụ thuộc query)
+        if stored.get('relevance_score') is not None and same_query(stored.get('scored_query'), user_query):
+            article['relevance_score'] = float(stored['relevance_score'])
+            article['score_reused'] = True
+            article['ai_reasoning'] = stored.get('ai_reasoning', 'Score reused from project')
+            article['key_finding'] = stored.get('key_finding', 'N/A')
+            known.append(article)
+        else:
+            to_score.append(article)
+
+    print(f"   → Project {project_id}: {len(known)} already-scored, {skipped} skipped as already seen")
+    return to_score, known
+
+
 def filter_by_ai_relevance(
     articles: List[Dict],
     user_query: str,
     query_analysis: Dict,
     gemini: GeminiService,
     score_threshold: float = 7.0,
-    batch_size: int = 1  # Process one at a time for better accuracy
+    batch_size: int = 1,  # 1 = one article per call (most accurate)
+    batch_token_budget: int = 6000,
+    concurrency: int = 5,
+    call_timeout: float = 30.0,
+    lexical_prefilter: bool = True,
+    lexical_top_k: int = 20,
+    lexical_discard_ratio: float = 0.1,
+    prescreen: bool = False,
+    prescreen_model: str = DEFAULT_PRESCREEN_MODEL,
+    prescreen_keep_above: float = 0.9,
+    prescreen_discard_below: float = 0.1,
+    early_stop_at: int = None,
+    wave_size: int = None,
+    cascade: bool = False,
+    cascade_models: tuple = CASCADE_MODELS,
+    cascade_band: tuple = (5.0, 8.0),
+    cascade_first_pass: str = 'title'
 ) -> tuple:
     """
     Filter articles using AI to read abstracts and score relevance
@@ -161,80 +428,654 @@ def filter_by_ai_relevance(
         query_analysis: Query analysis from analyze node
         gemini: Gemini service
         score_threshold: Minimum score to keep (default: 7.0)
-        batch_size: Number of articles to process at once (default: 1 for accuracy)
+        batch_size: Max articles per Gemini call (default: 1 for accuracy).
+            With batch_size > 1, articles are packed into batch prompts and
+            only papers with missing/malformed entries are re-scored one by one.
+        batch_token_budget: Approx. prompt token budget per batch call
+        concurrency: Max in-flight single-paper calls (default: 5, 1 = sequential).
+            With concurrency > 1, calls go through the async Gemini client,
+            bounded by a semaphore and the shared rate limiter.
+        call_timeout: Per-call timeout in seconds (concurrent mode)
+        lexical_prefilter: Rank articles locally with BM25 first and auto-discard
+            those far below the best match (top-K always go to the LLM)
+        lexical_top_k: Number of best lexical matches always sent to the LLM
+        lexical_discard_ratio: Auto-discard below this fraction of the best BM25 score
+        prescreen: Use the local classifier trained on past Gemini scores; only
+            low-confidence papers go to Gemini (PRESCREEN_DISABLED=1 turns it off)
+        prescreen_model: Path of the trained classifier
+        prescreen_keep_above / prescreen_discard_below: Confidence thresholds
+        early_stop_at: If set, score in descending prior order (lexical score,
+            citations, source rank) and stop once this many papers are kept.
+            Unscored papers are returned in scoring_stats['pending_articles'].
+        wave_size: Articles scored between two early-stop checks
+        cascade: Two-tier cascade - cheap first pass settles clear accepts/rejects,
+            only papers with score in cascade_band are escalated
+        cascade_models: Model chain, cheapest first; the last model does
+            full-abstract single-paper scoring
+        cascade_band: (low, high) - scores in [low, high) are escalated
+        cascade_first_pass: 'title' (title-only), 'batch' (batched prompt)
+            or 'full' (full abstract) for the first tier
 
     Returns:
-        (filtered_results, discarded_articles, relevance_scores)
+        (filtered_results, discarded_articles, relevance_scores, scoring_stats)
     """
     filtered_results = []
     discarded_articles = []
     relevance_scores = {}
+    scoring_stats = {'llm_calls': 0, 'batches': []}
 
-    total = len(articles)
+    # Local BM25 gate: obvious off-topic hits never reach Gemini
+    if lexical_prefilter and len(articles) > lexical_top_k:
+        articles, auto_discarded, scoring_stats['lexical'] = lexical_gate(
+            articles, user_query, query_analysis,
+            top_k=lexical_top_k, discard_ratio=lexical_discard_ratio
+        )
+        discarded_articles.extend(auto_discarded)
 
-    for i, article in enumerate(articles, 1):
-        print(f"   Processing {i}/{total}: {article.get('title', 'N/A')[:60]}...")
+    # Local classifier: settle high-confidence papers without an LLM call
+    if prescreen:
+        model = load_prescreen_model(prescreen_model)
+        if model is None:
+            print("   → Pre-screen skipped (model missing or disabled)")
+        elif articles:
+            keep, discard, articles, scoring_stats['prescreen'] = run_prescreen(
+                articles, user_query, model,
+                keep_above=prescreen_keep_above, discard_below=prescreen_discard_below
+            )
+            for article in keep + discard:
+                relevance_scores[article_key(article)] = article['relevance_score']
+            filtered_results.extend(keep)
+            discarded_articles.extend(discard)
 
-        try:
-            # Create unique ID for tracking
-            article_id = article.get('doi') or article.get('pmid') or f"article_{i}"
-
-            # Build filter prompt
-            prompt = create_filter_prompt(user_query, article, query_analysis)
-
-            # Call Gemini API
-            response = gemini.client.models.generate_content(
-                model='gemini-2.0-flash',
-                contents=prompt,
-                config={
-                    'response_mime_type': 'application/json',
-                    'temperature': 0.2  # Low temp for consistent scoring
-                }
+    llm_options = {
+        'score_threshold': score_threshold,
+        'batch_size': batch_size,
+        'batch_token_budget': batch_token_budget,
+        'concurrency': concurrency,
+        'call_timeout': call_timeout
+    }
+    scorer = score_with_llm
+    if cascade:
+        scorer = score_with_cascade
+        llm_options.update({
+            'cascade_models': cascade_models,
+            'cascade_band': cascade_band,
+            'cascade_first_pass': cascade_first_pass
+        })
+
+    # Ordered scoring: highest-prior papers first, stop once enough are kept
+    pending_articles = []
+    if early_stop_at is not None and articles:
+        articles = order_by_prior(articles, user_query, query_analysis)
+        wave = wave_size or max(concurrency, batch_size, 5)
+        for start in range(0, len(articles), wave):
+            if len(filtered_results) >= early_stop_at:
+                pending_articles = articles[start:]
+                break
+            scorer(
+                articles[start:start + wave], user_query, query_analysis, gemini,
+                filtered_results, discarded_articles, relevance_scores, scoring_stats,
+                **llm_options
             )
+        for article in pending_articles:
+            article['scoring_tier'] = 'pending'
+        if pending_articles:
+            print(f"   → Early stop: {len(filtered_results)} kept >= target {early_stop_at}, "
+                  f"{len(pending_articles)} articles left unscored ({len(pending_articles)} LLM calls saved)")
+    else:
+        scorer(
+            articles, user_query, query_analysis, gemini,
+            filtered_results, discarded_articles, relevance_scores, scoring_stats,
+            **llm_options
+        )
+    scoring_stats['pending_articles'] = pending_articles
 
-            # Parse response
-            result = json.loads(response.text.strip())
+    for batch in scoring_stats['batches']:
+        print(f"   ⏱️  {batch['mode']} batch: {batch['calls']} calls, "
+              f"p50 {batch['p50_s']}s, p95 {batch['p95_s']}s, max {batch['max_s']}s")
 
-            score = float(result.get('relevance_score', 5.0))
-            keep = result.get('keep', False)
-            reasoning = result.get('reasoning', 'No reasoning provided')
-            key_finding = result.get('key_finding', 'N/A')
+    return filtered_results, discarded_articles, relevance_scores, scoring_stats
 
-            # Store score
-            relevance_scores[article_id] = score
 
-            # Add metadata to article
-            article['relevance_score'] = score
-            article['ai_reasoning'] = reasoning
-            article['key_finding'] = key_finding
+# Keyword options mà filter_by_ai_relevance nhận (user_preferences['scoring'] được lọc theo)
+SCORING_OPTIONS = frozenset(inspect.signature(filter_by_ai_relevance).parameters) - {
+    'articles', 'user_query', 'query_analysis', 'gemini'}
 
-            # Categorize
-            if keep and score >= score_threshold:
-                filtered_results.append(article)
-                print(f"      ✅ KEEP (Score: {score}/10)")
-            else:
-                article['discard_reason'] = reasoning
-                discarded_articles.append(article)
-                print(f"      ❌ DISCARD (Score: {score}/10) - {reasoning[:50]}...")
+
+def prompt_view(article: Dict, title_only: bool = False) -> Dict:
+    """Article như được đưa vào prompt (title-only = bỏ abstract cho pass rẻ)"""
+    return {**article, 'abstract': 'N/A'} if title_only else article
+
+
+# Source rank used as a scoring prior (same priority as deduplication)
+SOURCE_PRIOR = {'PubMed': 1.0, 'Scopus': 0.8, 'Semantic Scholar': 0.6}
+
+
+def order_by_prior(articles: List[Dict], user_query: str, query_analysis: Dict) -> List[Dict]:
+    """
+    Sắp xếp articles theo prior giảm dần:
+    0.6 * lexical score + 0.25 * citations (log, chuẩn hóa) + 0.15 * source rank
+    """
+    if any('lexical_score' not in a for a in articles):
+        scores = BM25Scorer().score(build_query_terms(user_query, query_analysis),
+                                    [article_text(a) for a in articles])
+        max_score = scores.max() if len(scores) and scores.max() > 0 else 1.0
+        for article, score in zip(articles, scores):
+            article.setdefault('lexical_score', round(float(score / max_score), 3))
+
+    def citations(article):
+        try:
+            return math.log1p(max(0, int(article.get('cited_by') or 0)))
+        except (TypeError, ValueError):
+            return 0.0
+
+    max_citations = max((citations(a) for a in articles), default=0.0) or 1.0
+    for article in articles:
+        article['scoring_prior'] = round(
+            0.6 * article['lexical_score']
+            + 0.25 * citations(article) / max_citations
+            + 0.15 * SOURCE_PRIOR.get(article.get('source'), 0.5),
+            3
+        )
+
+    return sorted(articles, key=lambda a: -a['scoring_prior'])
+
+
+def score_pending_articles(state: SearchState, gemini: GeminiService, limit: int = None) -> SearchState:
+    """
+    Lazy scoring: chấm tiếp các bài bị bỏ qua khi early stop (gọi từ UI)
+
+    Args:
+        state: Final state có 'pending_articles'
+        gemini: Gemini service
+        limit: Số bài tối đa cần chấm (None = tất cả)
+    """
+    pending = state.get('pending_articles') or []
+    if not pending:
+        return state
+
+    to_score = pending if limit is None else pending[:limit]
+    scoring_options = dict(state['user_preferences'].get('scoring', {}))
+    llm_options = {k: scoring_options[k] for k in
+                   ('score_threshold', 'batch_size', 'batch_token_budget', 'concurrency', 'call_timeout')
+                   if k in scoring_options}
+
+    scorer = score_with_llm
+    if scoring_options.get('cascade'):
+        scorer = score_with_cascade
+        llm_options.update({k: scoring_options[k] for k in
+                            ('cascade_models', 'cascade_band', 'cascade_first_pass')
+                            if k in scoring_options})
+
+    filtered, discarded, scores = [], [], {}
+    stats = {'llm_calls': 0, 'batches': []}
+    for article in to_score:
+        article.pop('scoring_tier', None)
+    usage_before = gemini.usage.snapshot()
+    scorer(to_score, state['user_query'], state.get('query_analysis', {}), gemini,
+           filtered, discarded, scores, stats, **llm_options)
+    state['token_usage'] = add_node_usage(state.get('token_usage'), 'evaluate_results',
+                                          TokenUsage.delta(gemini.usage.snapshot(), usage_before))
+
+    state['pending_articles'] = pending[len(to_score):]
+    state['article_pool'] = add_to_pool(state.get('article_pool') or {}, filtered, discarded,
+                                        state.get('refinement_count', 0))
+    state['article_scores'] = record_scores(state.get('article_scores'), filtered, discarded)
+    state['filtered_results'] = (state.get('filtered_results') or []) + filtered
+    state['final_results'] = state['filtered_results']
+    state['discarded_articles'] = (state.get('discarded_articles') or []) + discarded
+    state['relevance_scores'] = {**(state.get('relevance_scores') or {}), **scores}
+
+    filter_stats = state.get('filter_statistics') or {}
+    filter_stats['kept'] = len(state['filtered_results'])
+    filter_stats['discarded'] = len(state['discarded_articles'])
+    filter_stats['pending'] = len(state['pending_articles'])
+    filter_stats['llm_calls'] = filter_stats.get('llm_calls', 0) + stats['llm_calls']
+    all_scores = state['relevance_scores']
+    filter_stats['avg_score'] = round(sum(all_scores.values()) / len(all_scores), 2) if all_scores else 0.0
+    state['filter_statistics'] = filter_stats
+
+    print(f"   → Lazy scoring: {len(filtered)} kept, {len(discarded)} discarded, "
+          f"{len(state['pending_articles'])} still pending")
+    return state
+
+
+def score_with_llm(articles: List[Dict], user_query: str, query_analysis: Dict,
+                   gemini: GeminiService, filtered_results: List[Dict],
+                   discarded_articles: List[Dict], relevance_scores: Dict, scoring_stats: Dict,
+                   score_threshold: float = 7.0, batch_size: int = 1,
+                   batch_token_budget: int = 6000, concurrency: int = 5,
+                   call_timeout: float = 30.0, model: str = SCORING_MODEL,
+                   title_only: bool = False, tier: str = 'llm'):
+    """
+    Score articles with Gemini (batched → concurrent → sequential fallback)
+    and append them to filtered_results / discarded_articles in input order
+
+    Each scored article records scoring_tier (= tier) and scoring_model.
+    """
+    total = len(articles)
+
+    # Batched mode: score as many articles as possible with batch prompts first
+    batch_results = {}
+    if batch_size > 1 and total > 1:
+        batch_results = score_in_batches(
+            articles, user_query, query_analysis, gemini,
+            batch_size=batch_size, token_budget=batch_token_budget,
+            scoring_stats=scoring_stats, model=model, title_only=title_only
+        )
+        print(f"   → Batch scoring covered {len(batch_results)}/{total} articles, "
+              f"{total - len(batch_results)} will be re-scored individually")
+
+    # Concurrent mode: score the remaining articles in parallel (order preserved)
+    single_outcomes = {}
+    pending = [idx for idx in range(total) if idx not in batch_results]
+    if pending:
+        # Tạo shared context (cached rubric) trước khi các task async dùng chung
+        gemini.shared_context(model, create_filter_rubric(user_query, query_analysis))
+    if concurrency > 1 and pending:
+        print(f"   → Scoring {len(pending)} articles concurrently (max {concurrency} in flight)...")
+        outcomes = run_sync(score_articles_concurrently(
+            [articles[idx] for idx in pending], user_query, query_analysis, gemini,
+            max_concurrency=concurrency, timeout=call_timeout,
+            model=model, title_only=title_only
+        ))
+        single_outcomes = dict(zip(pending, outcomes))
+        scoring_stats['llm_calls'] += len(pending)
+        scoring_stats['batches'].append(
+            latency_summary([latency for _, latency in outcomes], mode=f'{tier}:concurrent')
+        )
+
+    sequential_latencies = []
+    for i, article in enumerate(articles, 1):
+        # Create unique ID for tracking
+        article_id = article_key(article)
+
+        if i - 1 in batch_results:
+            _apply_score(article, batch_results[i - 1], article_id, score_threshold,
+                         filtered_results, discarded_articles, relevance_scores,
+                         tier=f'{tier}_batch', model=model)
+            continue
+
+        print(f"   Processing {i}/{total}: {article.get('title', 'N/A')[:60]}...")
+
+        if i - 1 in single_outcomes:
+            outcome, _ = single_outcomes[i - 1]
+        else:
+            start = time.perf_counter()
+            try:
+                outcome = score_single_article(article, user_query, query_analysis, gemini,
+                                               model=model, title_only=title_only)
+            except Exception as e:
+                outcome = e
+            sequential_latencies.append(time.perf_counter() - start)
+            scoring_stats['llm_calls'] += 1
 
             # Small delay to avoid rate limits
             time.sleep(0.1)
 
-        except json.JSONDecodeError as e:
-            print(f"      ⚠️  JSON parse error, using fallback - {e}")
-            # Fallback: assign neutral score
-            score = 5.0
-            article['relevance_score'] = score
-            article['discard_reason'] = "AI parse error - assigned neutral score"
-            relevance_scores[article_id] = score
-            discarded_articles.append(article)
+        if isinstance(outcome, Exception):
+            _apply_error(article, outcome, article_id,
+                         filtered_results, discarded_articles, relevance_scores)
+            article['scoring_tier'] = tier
+        else:
+            _apply_score(article, outcome, article_id, score_threshold,
+                         filtered_results, discarded_articles, relevance_scores,
+                         tier=tier, model=model)
+
+    if sequential_latencies:
+        scoring_stats['batches'].append(latency_summary(sequential_latencies, mode=f'{tier}:sequential'))
+
+
+
+def score_with_cascade(articles: List[Dict], user_query: str, query_analysis: Dict,
+                       gemini: GeminiService, filtered_results: List[Dict],
+                       discarded_articles: List[Dict], relevance_scores: Dict, scoring_stats: Dict,
+                       cascade_models: tuple = CASCADE_MODELS, cascade_band: tuple = (5.0, 8.0),
+                       cascade_first_pass: str = 'title', **llm_options):
+    """
+    Cascade scoring: tier rẻ chốt các bài rõ ràng, chỉ bài borderline được escalate
+
+    - Tier 1 dùng cascade_models[0] theo cascade_first_pass ('title' = chỉ title,
+      'batch' = batch prompt, 'full' = full abstract)
+    - Bài có score trong [low, high) hoặc bị lỗi → escalate lên tier kế tiếp
+    - Tier cuối: full-abstract single-paper call, quyết định mọi bài còn lại
+    - article['scoring_tier'] / ['scoring_model'] ghi tier đã quyết định bài đó
+    """
+    low, high = cascade_band
+    tier_stats = scoring_stats.setdefault('cascade', {'band': [low, high], 'tiers': []})['tiers']
+    remaining = articles
+
+    for level, model in enumerate(cascade_models):
+        if not remaining:
+            break
+        final = level == len(cascade_models) - 1
+        options = dict(llm_options, model=model, batch_size=1)
+        mode = 'full'
+        if level == 0 and not final and cascade_first_pass == 'title':
+            mode = 'title'
+            options['title_only'] = True
+        elif level == 0 and not final and cascade_first_pass == 'batch':
+            mode = 'batch'
+            options['batch_size'] = max(llm_options.get('batch_size', 1), 5)
+        # Batched pass: score_with_llm tự thêm hậu tố '_batch'
+        tier = f'cascade_{level + 1}_title' if mode == 'title' else f'cascade_{level + 1}'
+
+        if level >= len(tier_stats):
+            tier_stats.append({'tier': tier, 'model': model, 'scored': 0, 'settled': 0, 'escalated': 0})
+        stats = tier_stats[level]
+        stats['scored'] += len(remaining)
+
+        print(f"   → Cascade tier {level + 1} ({model}, {mode}): scoring {len(remaining)} articles...")
+        if final:
+            score_with_llm(remaining, user_query, query_analysis, gemini,
+                           filtered_results, discarded_articles, relevance_scores, scoring_stats,
+                           tier=tier, **options)
+            stats['settled'] += len(remaining)
+            break
+
+        tier_kept, tier_discarded, tier_scores = [], [], {}
+        score_with_llm(remaining, user_query, query_analysis, gemini,
+                       tier_kept, tier_discarded, tier_scores, scoring_stats,
+                       tier=tier, **options)
+
+        kept_ids = {id(a) for a in tier_kept}
+        escalate = []
+        for article in remaining:
+            score = article['relevance_score']
+            article.setdefault('cascade_scores', []).append({'tier': tier, 'model': model, 'score': score})
+            if article.pop('scoring_error', False) or low <= score < high:
+                article.pop('discard_reason', None)
+                escalate.append(article)
+                continue
+            relevance_scores[article_key(article)] = score
+            (filtered_results if id(article) in kept_ids else discarded_articles).append(article)
+
+        stats['settled'] += len(remaining) - len(escalate)
+        stats['escalated'] += len(escalate)
+        print(f"   → Cascade tier {level + 1}: {len(remaining) - len(escalate)} settled, "
+              f"{len(escalate)} borderline escalated (band {low}-{high})")
+        remaining = escalate
+
+
+def _apply_error(article: Dict, error: Exception, article_id: str,
+                 filtered_results: List[Dict], discarded_articles: List[Dict],
+                 relevance_scores: Dict):
+    """Xử lý lỗi khi chấm điểm một article"""
+    if isinstance(error, json.JSONDecodeError):
+        print(f"      ⚠️  JSON parse error, using fallback - {error}")
+        # Fallback: assign neutral score
+        score = 5.0
+        article['relevance_score'] = score
+        article['discard_reason'] = "AI parse error - assigned neutral score"
+        article['scoring_error'] = True
+        relevance_scores[article_id] = score
+        discarded_articles.append(article)
+    else:
+        print(f"      ⚠️  Error evaluating article: {error}")
+        # On error, keep the article (benefit of doubt)
+        article['scoring_error'] = True
+        article['relevance_score'] = 6.0
+        article['ai_reasoning'] = f"Error during evaluation: {str(error) or type(error).__name__}"
+        relevance_scores[article_id] = 6.0
+        filtered_results.append(article)
+
+
+def latency_summary(latencies: List[float], mode: str = '') -> Dict:
+    """p50 / p95 / max latency (giây) của một batch lời gọi"""
+    if not latencies:
+        return {'mode': mode, 'calls': 0, 'p50_s': 0.0, 'p95_s': 0.0, 'max_s': 0.0}
+    ordered = sorted(latencies)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+
+    return {
+        'mode': mode,
+        'calls': len(ordered),
+        'p50_s': round(percentile(0.5), 3),
+        'p95_s': round(percentile(0.95), 3),
+        'max_s': round(ordered[-1], 3)
+    }
+
+
+def build_filter_request(article: Dict, user_query: str, query_analysis: Dict,
+                         gemini: GeminiService, model: str = SCORING_MODEL,
+                         title_only: bool = False) -> tuple:
+    """
+    Single-paper request: rubric + query context gửi một lần cho cả run
+    (cached content / system_instruction), mỗi call chỉ mang thông tin bài báo
+
+    Returns:
+        (contents, config_extra, sent_text) - sent_text dùng để ước lượng token
+        khi response không có usage_metadata
+    """
+    view = prompt_view(article, title_only)
+    context = gemini.shared_context(model, create_filter_rubric(user_query, query_analysis))
+    if context is None:
+        prompt = create_filter_prompt(user_query, view, query_analysis)
+        return prompt, {}, prompt
+
+    prompt = create_paper_prompt(user_query, view, query_analysis)
+    sent = prompt if 'cached_content' in context else f"{context['system_instruction']}\n{prompt}"
+    return prompt, context, sent
+
+
+async def score_single_article_async(article: Dict, user_query: str, query_analysis: Dict,
+                                     gemini: GeminiService, model: str = SCORING_MODEL,
+                                     title_only: bool = False) -> Dict:
+    """Async version of score_single_article (gemini.agenerate)"""
+    prompt, context, sent = build_filter_request(article, user_query, query_analysis, gemini,
+                                                 model, title_only)
+
+    response = await gemini.agenerate(
+        prompt,
+        model=model,
+        task='score',
+        usage_prompt=sent,
+        **context,
+        response_mime_type='application/json',
+        temperature=0.2
+    )
+
+    return json.loads(response.text.strip())
+
+
+async def score_articles_concurrently(articles: List[Dict], user_query: str, query_analysis: Dict,
+                                      gemini: GeminiService, max_concurrency: int = 5,
+                                      timeout: float = 30.0, rate_limit_retries: int = 2,
+                                      model: str = SCORING_MODEL, title_only: bool = False) -> List[tuple]:
+    """
+    Score articles in parallel with bounded concurrency
+
+    - Semaphore giới hạn số call đồng thời
+    - gemini.rate_limiter dùng chung: 429 ở một call làm mọi call khác tạm dừng
+    - Timeout riêng cho từng call
+
+    Returns:
+        [(result_dict | Exception, latency_seconds)] theo đúng thứ tự input
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def score(article):
+        async with semaphore:
+            start = time.perf_counter()
+            for attempt in range(rate_limit_retries + 1):
+                await gemini.rate_limiter.acquire_async()
+                try:
+                    result = await asyncio.wait_for(
+                        score_single_article_async(article, user_query, query_analysis, gemini,
+                                                   model=model, title_only=title_only),
+                        timeout=timeout
+                    )
+                    return result, time.perf_counter() - start
+                except asyncio.TimeoutError:
+                    return TimeoutError(f"Gemini call timed out after {timeout}s"), time.perf_counter() - start
+                except Exception as e:
+                    if is_rate_limit_error(e) and attempt < rate_limit_retries:
+                        gemini.rate_limiter.backoff(2.0 * (attempt + 1))
+                        continue
+                    return e, time.perf_counter() - start
+
+    return await asyncio.gather(*(score(article) for article in articles))
+
+
+def score_single_article(article: Dict, user_query: str, query_analysis: Dict,
+                         gemini: GeminiService, model: str = SCORING_MODEL,
+                         title_only: bool = False) -> Dict:
+    """
+    Score one article with one Gemini call
+
+    Returns:
+        Parsed result {relevance_score, keep, reasoning, key_finding}
+
+    Raises:
+        json.JSONDecodeError / API errors (handled by caller)
+    """
+    prompt, context, sent = build_filter_request(article, user_query, query_analysis, gemini,
+                                                 model, title_only)
+
+    gemini.rate_limiter.acquire()
+    response = gemini.generate(
+        prompt,
+        model=model,
+        task='score',
+        usage_prompt=sent,
+        **context,
+        response_mime_type='application/json',
+        temperature=0.2  # Low temp for consistent scoring
+    )
+
+    return json.loads(response.text.strip())
+
+
+def _apply_score(article: Dict, result: Dict, article_id: str, score_threshold: float,
+                 filtered_results: List[Dict], discarded_articles: List[Dict],
+                 relevance_scores: Dict, tier: str = 'llm', model: str = SCORING_MODEL):
+    """Ghi score vào article và phân loại keep/discard"""
+    score = float(result.get('relevance_score', 5.0))
+    keep = result.get('keep', False)
+    reasoning = result.get('reasoning', 'No reasoning provided')
+    key_finding = result.get('key_finding', 'N/A')
+
+    # Store score
+    relevance_scores[article_id] = score
+
+    # Add metadata to article
+    article['relevance_score'] = score
+    article['ai_reasoning'] = reasoning
+    article['key_finding'] = key_finding
+    article['scoring_tier'] = tier
+    article['scoring_model'] = model
+
+    # Categorize
+    if keep and score >= score_threshold:
+        filtered_results.append(article)
+        print(f"      ✅ KEEP (Score: {score}/10)")
+    else:
+        article['discard_reason'] = reasoning
+        discarded_articles.append(article)
+        print(f"      ❌ DISCARD (Score: {score}/10) - {reasoning[:50]}...")
+
+
+def pack_batches(articles: List[Dict], user_query: str, query_analysis: Dict,
+                 batch_size: int, token_budget: int, title_only: bool = False) -> List[List[int]]:
+    """
+    Gom index của articles thành các batch: tối đa batch_size bài,
+    tổng prompt không vượt token_budget (batch 1 bài luôn được chấp nhận)
+    """
+    base_tokens = count_tokens(create_batch_filter_prompt(user_query, [], query_analysis))
+    paper_tokens = [
+        count_tokens(create_batch_filter_prompt(
+            user_query, [prompt_view(article, title_only)], query_analysis
+        )) - base_tokens
+        for article in articles
+    ]
+    return pack_by_tokens(paper_tokens, token_budget, batch_size, base_tokens)
 
+
+def parse_batch_response(text: str, batch_len: int) -> Dict[int, Dict]:
+    """
+    Parse JSON array từ batch prompt
+
+    Returns:
+        {position_in_batch: result} - chỉ gồm các entry hợp lệ
+        (paper_id trong khoảng, relevance_score là số 1-10, keep là bool)
+    """
+    try:
+        data = json.loads(text.strip())
+    except json.JSONDecodeError:
+        return {}
+
+    if isinstance(data, dict):
+        # Một số response bọc array trong object, vd {"papers": [...]}
+        data = next((v for v in data.values() if isinstance(v, list)), [])
+    if not isinstance(data, list):
+        return {}
+
+    parsed = {}
+    for entry in data:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            position = int(entry.get('paper_id')) - 1
+            score = float(entry.get('relevance_score'))
+        except (TypeError, ValueError):
+            continue
+        if not 0 <= position < batch_len or not 1.0 <= score <= 10.0:
+            continue
+        if not isinstance(entry.get('keep'), bool):
+            continue
+        parsed.setdefault(position, entry)
+    return parsed
+
+
+def score_in_batches(articles: List[Dict], user_query: str, query_analysis: Dict,
+                     gemini: GeminiService, batch_size: int = 5,
+                     token_budget: int = 6000, scoring_stats: Dict = None,
+                     model: str = SCORING_MODEL, title_only: bool = False) -> Dict[int, Dict]:
+    """
+    Score articles với create_batch_filter_prompt
+
+    Returns:
+        {article_index: result} cho các article có entry hợp lệ.
+        Article thiếu/lỗi không có trong dict → caller chấm lại từng bài.
+    """
+    results = {}
+    latencies = []
+    batches = pack_batches(articles, user_query, query_analysis, batch_size, token_budget, title_only)
+
+    for n, batch in enumerate(batches, 1):
+        batch_articles = [prompt_view(articles[idx], title_only) for idx in batch]
+        print(f"   Batch {n}/{len(batches)}: scoring {len(batch)} articles in one call...")
+
+        start = time.perf_counter()
+        try:
+            prompt = create_batch_filter_prompt(user_query, batch_articles, query_analysis)
+            gemini.rate_limiter.acquire()
+            response = gemini.generate(
+                prompt,
+                model=model,
+                task='score_batch',
+                response_mime_type='application/json',
+                temperature=0.2
+            )
+            parsed = parse_batch_response(response.text, len(batch))
         except Exception as e:
-            print(f"      ⚠️  Error evaluating article: {e}")
-            # On error, keep the article (benefit of doubt)
-            article['relevance_score'] = 6.0
-            article['ai_reasoning'] = f"Error during evaluation: {str(e)}"
-            relevance_scores[article_id] = 6.0
-            filtered_results.append(article)
+            print(f"      ⚠️  Batch scoring error: {e}")
+            parsed = {}
+        latencies.append(time.perf_counter() - start)
+
+        for position, entry in parsed.items():
+            results[batch[position]] = entry
+
+        missing = len(batch) - len(parsed)
+        if missing:
+            print(f"      ⚠️  {missing} missing/malformed entries → individual re-scoring")
+
+        time.sleep(0.1)
+
+    if scoring_stats is not None:
+        scoring_stats['llm_calls'] += len(batches)
+        scoring_stats['batches'].append(latency_summary(latencies, mode=f'batched:{model}'))
 
-    return filtered_results, discarded_articles, relevance_scores
+    return results
@@ -2,13 +2,171 @@
 Node: Execute Search
 Thực thi tìm kiếm SONG SONG với async
 """
-from typing import Dict
+from typing import Dict, List
 from ..state_schema import SearchState
 from ..async_apis import AsyncSearchAPIs
+from ..gemini_service import GeminiService
+from ..event_loop import run_sync
+from ..prompts.filter_prompt import create_filter_rubric
+from ..lexical_ranker import BM25Scorer, build_query_terms, article_text
+from .evaluate import (SCORING_MODEL, SCORING_OPTIONS, apply_seen_index, filter_by_ai_relevance, record_scores,
+                       score_cache_keys, split_pooled)
+from .planner import SOURCE_QUERY_KEYS
 import asyncio
+import contextvars
+import functools
+import hashlib
+import json
+import time
 
 
-async def execute_search_async(state: SearchState, async_apis: AsyncSearchAPIs) -> SearchState:
+SOURCE_NAMES = {key: name for name, key in SOURCE_QUERY_KEYS.items()}
+
+
+def source_fingerprint(query: str, year_range: List[int], max_per_source: int = None) -> str:
+    """Hash của query + filters hiệu lực cho một nguồn (max_per_source=None → chỉ query + năm)"""
+    payload = json.dumps([query, list(year_range), max_per_source], ensure_ascii=False)
+    return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+
+def plan_delta(state: SearchState, queries: Dict[str, str], year_range: List[int], max_per_source: int,
+               verbose: bool = True) -> Dict:
+    """
+    Delta execution theo từng nguồn, so với lần chạy trước:
+
+    - query + filters giống hệt (strategy['executed_fingerprints']) và đã có kết quả
+      → dùng lại từ state['search_results']
+    - query + năm giống, chỉ tăng max_results_per_source (cursor trong strategy['source_cursors'])
+      → chỉ lấy trang tiếp theo (offset = số bài đã lấy) rồi nối vào kết quả cũ;
+      nguồn đã hết kết quả (trang trước trả thiếu) → dùng lại luôn
+    - còn lại → chạy lại từ đầu
+
+    Returns: {'run': queries cần chạy, 'pages': {key: (offset, count)}, 'reused': {source: articles},
+              'previous': {source: articles có trang mới nối vào}, 'fingerprints', 'bases'}
+    """
+    strategy = state['search_strategy']
+    previous_fingerprints = strategy.get('executed_fingerprints') or {}
+    cursors = strategy.get('source_cursors') or {}
+    previous_results = state.get('search_results') or {}
+
+    delta = {'run': {}, 'pages': {}, 'reused': {}, 'previous': {}, 'fingerprints': {}, 'bases': {}}
+    for key, query in queries.items():
+        name = SOURCE_NAMES.get(key, key)
+        fingerprint = source_fingerprint(query, year_range, max_per_source)
+        base = source_fingerprint(query, year_range)
+        delta['fingerprints'][key] = fingerprint
+        delta['bases'][key] = base
+        previous = previous_results.get(name)
+        cursor = cursors.get(key) or {}
+
+        # Nguồn trước đó trả về 0 bài (có thể do lỗi) vẫn được chạy lại
+        if previous and previous_fingerprints.get(key) == fingerprint:
+            delta['reused'][name] = previous
+        elif previous and cursor.get('base') == base and max_per_source > cursor.get('next_offset', 0):
+            if cursor.get('exhausted'):
+                delta['reused'][name] = previous
+            else:
+                delta['run'][key] = query
+                delta['pages'][key] = (cursor['next_offset'], max_per_source - cursor['next_offset'])
+                delta['previous'][name] = previous
+        else:
+            delta['run'][key] = query
+
+    if not verbose:
+        return delta
+    if delta['reused']:
+        print(f"   ♻️  Reusing results for {', '.join(delta['reused'])} (query & filters unchanged)")
+    for key, (offset, count) in delta['pages'].items():
+        print(f"   📄 {SOURCE_NAMES.get(key, key)}: fetching next page (offset {offset}, {count} records)")
+    return delta
+
+
+def record_delta(state: SearchState, delta: Dict, results_dict: Dict[str, List[Dict]], max_per_source: int):
+    """Lưu fingerprints + cursor từng nguồn để vòng refine sau tính delta"""
+    strategy = state['search_strategy']
+    cursors = dict(strategy.get('source_cursors') or {})
+    for key in delta['run']:
+        name = SOURCE_NAMES.get(key, key)
+        articles = results_dict.get(name, [])
+        if key in delta['pages']:
+            offset, count = delta['pages'][key]
+            received = len(articles) - len(delta['previous'].get(name, []))
+        else:
+            offset, count, received = 0, max_per_source, len(articles)
+        cursors[key] = {'base': delta['bases'][key], 'next_offset': offset + count, 'exhausted': received < count}
+
+    strategy['executed_fingerprints'] = delta['fingerprints']
+    strategy['source_cursors'] = {key: cursors[key] for key in delta['bases'] if key in cursors}
+    strategy['last_execution'] = {
+        'executed': [SOURCE_NAMES.get(key, key) for key in delta['run'] if key not in delta['pages']],
+        'paged': [SOURCE_NAMES.get(key, key) for key in delta['pages']],
+        'reused': list(delta['reused']),
+        'prefetch': delta.get('prefetch')
+    }
+
+
+async def select_query_variants(state: SearchState, async_apis: AsyncSearchAPIs, year_range: List[int],
+                                max_per_source: int):
+    """
+    Fan-out: refine đề xuất K query cho mỗi nguồn (strategy['query_variants']) → chạy song song
+    tất cả variants, chấm kết quả bằng BM25 theo query + keywords (local, không gọi LLM) và
+    chọn variant tốt nhất làm optimized_queries[key]
+
+    Điểm của variant = tổng BM25 của các bài CHƯA có trong article_pool (bài mới & liên quan).
+    Kết quả đã nằm trong SearchCache nên lượt tìm kiếm chính không tải lại.
+    """
+    strategy = state['search_strategy']
+    variants = {key: queries for key, queries in (strategy.pop('query_variants', None) or {}).items()
+                if len(queries) > 1 and key in strategy.get('optimized_queries', {})}
+    if not variants:
+        return
+
+    jobs = [(key, query) for key, queries in variants.items() for query in queries]
+    print(f"   🔀 Fan-out: {len(jobs)} query variants across {len(variants)} sources")
+    outcomes = await asyncio.gather(*(
+        async_apis.search_source(key, query, max_per_source, year_range[0], year_range[1])
+        for key, query in jobs
+    ), return_exceptions=True)
+
+    query_terms = build_query_terms(state['user_query'], state.get('query_analysis'))
+    article_pool = state.get('article_pool') or {}
+    selection = {}
+    for key in variants:
+        results = [(query, [] if isinstance(outcome, Exception) else outcome)
+                   for (job_key, query), outcome in zip(jobs, outcomes) if job_key == key]
+        # Một corpus chung cho mọi variant của nguồn → IDF so sánh được giữa các variant
+        fresh = [(query, split_pooled(articles, article_pool)[0]) for query, articles in results]
+        documents = [article_text(a) for _, articles in fresh for a in articles]
+        scores = BM25Scorer().score(query_terms, documents).tolist()
+
+        variant_scores, offset = {}, 0
+        for query, articles in fresh:
+            variant_scores[query] = round(sum(scores[offset:offset + len(articles)]), 2)
+            offset += len(articles)
+        best = max(variant_scores, key=variant_scores.get)
+        strategy['optimized_queries'][key] = best
+        selection[SOURCE_NAMES.get(key, key)] = {'chosen': best, 'scores': variant_scores}
+        print(f"   🔀 {SOURCE_NAMES.get(key, key)}: chose variant {list(variant_scores).index(best) + 1}/"
+              f"{len(variant_scores)} (BM25 {list(variant_scores.values())}): {best}")
+
+    strategy['variant_selection'] = selection
+
+
+async def claim_prefetch(state: SearchState, prefetcher, delta: Dict, year_range: List[int], max_per_source: int):
+    """Vòng refine đã được speculative prefetch → chờ kết quả vào cache; đoán sai → huỷ prefetch"""
+    key = state['search_strategy'].pop('prefetch', None)
+    if prefetcher is None or key is None:
+        return
+    search_key = prefetcher.key_for(delta['run'], delta['pages'], year_range, max_per_source)
+    loop = asyncio.get_event_loop()
+    if await loop.run_in_executor(None, prefetcher.claim, key, search_key):
+        print(f"   🔮 Speculative prefetch matched this refinement (served from cache)")
+        delta['prefetch'] = 'hit'
+    else:
+        delta['prefetch'] = 'miss'
+
+
+async def execute_search_async(state: SearchState, async_apis: AsyncSearchAPIs, prefetcher=None) -> SearchState:
     """
     Thực thi tìm kiếm song song trên các nguồn đã chọn
     với caching & early stopping
@@ -23,16 +181,27 @@ async def execute_search_async(state: SearchState, async_apis: AsyncSearchAPIs)
     print(f"\n🚀 Executing parallel search:")
     print(f"   - Year range: {year_range[0]}-{year_range[1]}")
     print(f"   - Max per source: {max_per_source}")
-    
-    # Execute parallel search
-    results_dict = await async_apis.search_all_parallel(
-        queries=queries,
-        max_results_per_source=max_per_source,
-        year_start=year_range[0],
-        year_end=year_range[1]
-    )
-    
+
+    await select_query_variants(state, async_apis, year_range, max_per_source)
+    delta = plan_delta(state, queries, year_range, max_per_source)
+    await claim_prefetch(state, prefetcher, delta, year_range, max_per_source)
+
+    # Execute parallel search (chỉ các nguồn có thay đổi / trang tiếp theo)
+    fetched = {}
+    if delta['run']:
+        fetched = await async_apis.search_all_parallel(
+            queries=delta['run'],
+            max_results_per_source=max_per_source,
+            year_start=year_range[0],
+            year_end=year_range[1],
+            pages=delta['pages']
+        )
+    results_dict = dict(delta['reused'])
+    for source, articles in fetched.items():
+        results_dict[source] = delta['previous'].get(source, []) + articles
+
     state['search_results'] = results_dict
+    record_delta(state, delta, results_dict, max_per_source)
     
     # Log results count
     total_count = sum(len(articles) for articles in results_dict.values())
@@ -49,15 +218,174 @@ async def execute_search_async(state: SearchState, async_apis: AsyncSearchAPIs)
     return state
 
 
-def execute_search(state: SearchState, async_apis: AsyncSearchAPIs) -> SearchState:
+async def execute_search_pipelined_async(state: SearchState, async_apis: AsyncSearchAPIs,
+                                         gemini: GeminiService, prefetcher=None) -> SearchState:
     """
-    Wrapper để chạy async function trong sync context
+    Pipelined mode: chấm điểm ngay khi từng nguồn trả về
+
+    - Kết quả của mỗi nguồn → dedup tăng dần (theo mọi ID + title đã thấy) → seen index
+      của project (bài đã chấm cho cùng query ghi thẳng vào article_scores) → hàng đợi
+    - Mỗi batch nguồn đi qua filter_by_ai_relevance với cùng scoring options như
+      evaluate_results (lexical gate, pre-screen, batch_size, cascade, early stop),
+      kết quả ghi vào state['article_scores']
+    - evaluate_results dùng lại các điểm này thay vì gọi LLM lần nữa
+    - Time-to-first-score chỉ phụ thuộc nguồn nhanh nhất
     """
-    # Chạy async function
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    strategy = state['search_strategy']
+    queries = strategy.get('optimized_queries', {})
+    filters = strategy.get('filters', {})
+    preferences = state['user_preferences']
+    user_query = state['user_query']
+    query_analysis = state.get('query_analysis', {})
+    scoring_options = dict(preferences.get('scoring', {}))
+    early_stop = scoring_options.pop('early_stop', False)
+    scoring_options = {k: v for k, v in scoring_options.items() if k in SCORING_OPTIONS}
+    score_threshold = scoring_options.get('score_threshold', 7.0)
+
+    year_range = filters.get('year_range', [2020, 2025])
+    max_per_source = filters.get('max_results_per_source', 10)
+
+    print(f"\n🚀 Executing pipelined search + scoring:")
+    print(f"   - Year range: {year_range[0]}-{year_range[1]}")
+    print(f"   - Max per source: {max_per_source}")
+    print(f"   - Scoring concurrency: {scoring_options.get('concurrency', 5)}")
+
+    await select_query_variants(state, async_apis, year_range, max_per_source)
+    delta = plan_delta(state, queries, year_range, max_per_source)
+    await claim_prefetch(state, prefetcher, delta, year_range, max_per_source)
+
+    article_scores = dict(state.get('article_scores') or {})
+    seen_keys = set(article_scores)
+    stats = {'sources': {}, 'queued': 0, 'scored': 0, 'errors': 0, 'llm_calls': 0,
+             'llm_calls_saved_lexical': 0, 'llm_calls_saved_prescreen': 0, 'time_to_first_score_s': None}
+    # Early stop: bài kept từ vòng trước / trong project / trong lúc tìm kiếm tính vào target
+    kept = sum(1 for a in (state.get('article_pool') or {}).values() if a.get('kept'))
+    started = time.perf_counter()
+    queue = asyncio.Queue()
+
+    # Tạo cached rubric một lần trước khi chấm các batch
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, gemini.shared_context, SCORING_MODEL,
+                               create_filter_rubric(user_query, query_analysis))
+
+    async def worker():
+        # Một worker: batch sau chấm khi batch trước xong (concurrency nằm trong từng batch)
+        # để early stop đếm đúng số bài kept
+        nonlocal kept
+        while True:
+            articles = await queue.get()
+            if articles is None:
+                return
+            options = dict(scoring_options)
+            if early_stop:
+                options['early_stop_at'] = max(0, preferences.get('max_results', 10) - kept)
+                if options['early_stop_at'] == 0:
+                    # Để evaluate_results đánh dấu pending
+                    continue
+            score = functools.partial(filter_by_ai_relevance, articles, user_query, query_analysis, gemini,
+                                      **options)
+            filtered, discarded, _, scoring_stats = await loop.run_in_executor(
+                None, contextvars.copy_context().run, score)
+
+            # Bài lỗi / pending không ghi lại → evaluate_results chấm lại / đánh dấu pending
+            failed = [a for a in filtered + discarded if a.get('scoring_error')]
+            filtered = [a for a in filtered if not a.get('scoring_error')]
+            discarded = [a for a in discarded if not a.get('scoring_error')]
+            article_scores.update(record_scores(article_scores, filtered, discarded))
+            kept += len(filtered)
+
+            stats['errors'] += len(failed)
+            stats['scored'] += len(filtered) + len(discarded)
+            stats['llm_calls'] += scoring_stats['llm_calls']
+            stats['llm_calls_saved_lexical'] += scoring_stats.get('lexical', {}).get('llm_calls_saved', 0)
+            stats['llm_calls_saved_prescreen'] += scoring_stats.get('prescreen', {}).get('llm_calls_saved', 0)
+            if stats['time_to_first_score_s'] is None and (filtered or discarded):
+                stats['time_to_first_score_s'] = round(time.perf_counter() - started, 2)
+                print(f"   ⏱️  First batch scored after {stats['time_to_first_score_s']}s")
+
+    scorer = asyncio.create_task(worker())
+
+    # Bài của nguồn dùng lại đã nằm trong article_scores / article_pool từ vòng trước
+    results_dict = dict(delta['reused'])
     try:
-        updated_state = loop.run_until_complete(execute_search_async(state, async_apis))
-        return updated_state
+        async for source, articles in async_apis.search_stream(
+            queries=delta['run'],
+            max_results_per_source=max_per_source,
+            year_start=year_range[0],
+            year_end=year_range[1],
+            pages=delta['pages']
+        ):
+            results_dict[source] = delta['previous'].get(source, []) + articles
+            fresh = dedup_incremental(articles, seen_keys)
+            fresh, known = apply_seen_index(fresh, preferences, user_query)
+            # Score đã lưu trong project cho cùng query → không gọi LLM
+            known_kept = [a for a in known if a['relevance_score'] >= score_threshold]
+            article_scores.update(record_scores(
+                article_scores, known_kept, [a for a in known if a['relevance_score'] < score_threshold]))
+            kept += len(known_kept)
+            if fresh:
+                queue.put_nowait(fresh)
+            stats['queued'] += len(fresh)
+            stats['sources'][source] = {
+                'articles': len(articles),
+                'queued': len(fresh),
+                'known': len(known),
+                'arrived_s': round(time.perf_counter() - started, 2)
+            }
+            print(f"   → {source}: {len(articles)} articles after {stats['sources'][source]['arrived_s']}s, "
+                  f"{len(fresh)} new queued for scoring")
     finally:
-        loop.close()
+        queue.put_nowait(None)
+        await scorer
+
+    stats['total_s'] = round(time.perf_counter() - started, 2)
+    state['search_results'] = results_dict
+    state['article_scores'] = article_scores
+    state['pipeline_stats'] = stats
+    record_delta(state, delta, results_dict, max_per_source)
+
+    total_count = sum(len(articles) for articles in results_dict.values())
+    state['messages'].append({
+        'role': 'system',
+        'content': f"✅ Found {total_count} articles from {len(results_dict)} sources, "
+                   f"{stats['scored']} scored while searching"
+    })
+
+    print(f"\n📊 Search Results (pipelined):")
+    for source, articles in results_dict.items():
+        print(f"   - {source}: {len(articles)} articles")
+    print(f"   - Scored during search: {stats['scored']} ({stats['errors']} errors, "
+          f"{stats['llm_calls']} LLM calls) in {stats['total_s']}s")
+
+    return state
+
+
+def dedup_incremental(articles: List[Dict], seen_keys: set) -> List[Dict]:
+    """Bài chưa thấy (theo DOI / PMID / source ID / title); cập nhật seen_keys"""
+    fresh = []
+    for article in articles:
+        keys = score_cache_keys(article)
+        if any(key in seen_keys for key in keys):
+            continue
+        seen_keys.update(keys)
+        fresh.append(article)
+    return fresh
+
+
+async def aexecute_search(state: SearchState, async_apis: AsyncSearchAPIs, gemini: GeminiService = None,
+                          prefetcher=None) -> SearchState:
+    """
+    Node async (graph chạy bằng ainvoke / astream trên event loop dùng chung)
+
+    user_preferences['pipeline'] = True (và có gemini) → tìm kiếm + chấm điểm song song
+    prefetcher: SpeculativePrefetcher - dùng lại prefetch của vòng refine (nếu đoán đúng)
+    """
+    if gemini is not None and gemini.available and state['user_preferences'].get('pipeline'):
+        return await execute_search_pipelined_async(state, async_apis, gemini, prefetcher)
+    return await execute_search_async(state, async_apis, prefetcher)
+
+
+def execute_search(state: SearchState, async_apis: AsyncSearchAPIs, gemini: GeminiService = None,
+                   prefetcher=None) -> SearchState:
+    """Sync wrapper (script / benchmark): chạy aexecute_search trên event loop dùng chung"""
+    return run_sync(aexecute_search(state, async_apis, gemini, prefetcher))
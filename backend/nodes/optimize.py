@@ -2,31 +2,29 @@
 Node: Optimize Queries
 Tối ưu query cho từng nguồn riêng biệt
 """
-from typing import Dict
+from typing import Dict, List
 from ..state_schema import SearchState
 from ..gemini_service import GeminiService
-import json
+import hashlib
 
 
-def optimize_queries(state: SearchState, gemini: GeminiService) -> SearchState:
+def build_source_prompts(user_query: str, analysis: Dict, sources: List[str]) -> Dict[str, tuple]:
     """
-    Tạo optimized query cho từng nguồn:
+    Prompt + fallback query cho từng nguồn:
     - PubMed: MeSH terms + Boolean operators
     - Scopus: TITLE-ABS-KEY syntax
     - Semantic Scholar: Natural language (keep Vietnamese if needed)
+
+    Returns:
+        {source_key: (prompt, fallback_query)}
     """
-    user_query = state['user_query']
-    analysis = state['query_analysis']
-    strategy = state['search_strategy']
-    sources = strategy['sources']
-    
-    optimized_queries = {}
-    
+    keywords = analysis.get('keywords', [])
+    prompts = {}
+
     # PubMed optimization
     if 'PubMed' in sources:
         mesh_terms = analysis.get('mesh_terms', [])
-        keywords = analysis.get('keywords', [])
-        
+
         prompt_pubmed = f"""
 Tạo PubMed query tối ưu từ:
 - Original query: "{user_query}"
@@ -41,23 +39,10 @@ Yêu cầu:
 
 Trả về CHỈ query string (KHÔNG giải thích, KHÔNG JSON):
 """
-        
-        try:
-            response = gemini.client.models.generate_content(
-                model='gemini-2.0-flash',
-                contents=prompt_pubmed,
-                config={'temperature': 0.2}
-            )
-            optimized_queries['pubmed'] = response.text.strip().strip('"\'`')
-            print(f"🔍 PubMed query: {optimized_queries['pubmed']}")
-        except Exception as e:
-            print(f"⚠️  PubMed query optimization failed: {e}")
-            optimized_queries['pubmed'] = ' AND '.join(keywords[:3])
-    
+        prompts['pubmed'] = (prompt_pubmed, ' AND '.join(keywords[:3]))
+
     # Scopus optimization
     if 'Scopus' in sources:
-        keywords = analysis.get('keywords', [])
-        
         prompt_scopus = f"""
 Tạo Scopus query tối ưu từ:
 - Original query: "{user_query}"
@@ -70,24 +55,13 @@ Yêu cầu:
 
 Trả về CHỈ query string (KHÔNG giải thích, KHÔNG JSON):
 """
-        
-        try:
-            response = gemini.client.models.generate_content(
-                model='gemini-2.0-flash',
-                contents=prompt_scopus,
-                config={'temperature': 0.2}
-            )
-            optimized_queries['scopus'] = response.text.strip().strip('"\'`')
-            print(f"🔍 Scopus query: {optimized_queries['scopus']}")
-        except Exception as e:
-            print(f"⚠️  Scopus query optimization failed: {e}")
-            keywords_str = '" AND "'.join(keywords[:3])
-            optimized_queries['scopus'] = f'TITLE-ABS-KEY("{keywords_str}")'
-    
+        keywords_str = '" AND "'.join(keywords[:3])
+        prompts['scopus'] = (prompt_scopus, f'TITLE-ABS-KEY("{keywords_str}")')
+
     # Semantic Scholar optimization
     if 'Semantic Scholar' in sources:
         language = analysis.get('language', 'en')
-        
+
         if language == 'vi':
             # Giữ nguyên tiếng Việt hoặc cải thiện nhẹ
             prompt_semantic = f"""
@@ -103,7 +77,6 @@ Trả về CHỈ query string (KHÔNG giải thích):
 """
         else:
             # Optimize English query
-            keywords = analysis.get('keywords', [])
             prompt_semantic = f"""
 Tạo Semantic Scholar query từ:
 - Original: "{user_query}"
@@ -116,26 +89,76 @@ Yêu cầu:
 
 Trả về CHỈ query string (KHÔNG giải thích):
 """
-        
-        try:
-            response = gemini.client.models.generate_content(
-                model='gemini-2.0-flash',
-                contents=prompt_semantic,
-                config={'temperature': 0.2}
-            )
-            optimized_queries['semantic'] = response.text.strip().strip('"\'`')
-            print(f"🔍 Semantic query: {optimized_queries['semantic']}")
-        except Exception as e:
-            print(f"⚠️  Semantic query optimization failed: {e}")
-            optimized_queries['semantic'] = user_query
-    
-    # Update strategy với optimized queries
-    state['search_strategy']['optimized_queries'] = optimized_queries
-    
+        prompts['semantic'] = (prompt_semantic, user_query)
+
+    return prompts
+
+
+def parse_source_query(response) -> str:
+    """Response → query string (raise nếu lỗi / rỗng)"""
+    if isinstance(response, Exception):
+        raise response
+    query = response.text.strip().strip('"\'`')
+    if not query:
+        raise ValueError("empty query")
+    return query
+
+
+def prompt_fingerprint(prompt: str) -> str:
+    return hashlib.md5(prompt.encode('utf-8')).hexdigest()
+
+
+def optimize_queries(state: SearchState, gemini: GeminiService) -> SearchState:
+    """
+    Tạo optimized query cho từng nguồn - các nguồn độc lập nên chạy SONG SONG
+    (gemini.generate_batch), node chỉ mất thời gian của prompt chậm nhất.
+    Nguồn nào lỗi dùng fallback query riêng của nguồn đó.
+
+    Delta: nguồn đã có query (từ lần optimize trước, combined planner hoặc refine)
+    mà input không đổi (fingerprint của prompt = strategy['optimize_fingerprints'])
+    được giữ nguyên - không gọi lại Gemini và không ghi đè query mới của refine.
+    """
+    user_query = state['user_query']
+    analysis = state['query_analysis']
+    strategy = state['search_strategy']
+    sources = strategy['sources']
+
+    prompts = build_source_prompts(user_query, analysis, sources)
+    fingerprints = {key: prompt_fingerprint(prompt) for key, (prompt, _) in prompts.items()}
+    previous_queries = strategy.get('optimized_queries') or {}
+    previous_fingerprints = strategy.get('optimize_fingerprints') or {}
+
+    optimized_queries = {}
+    for key in prompts:
+        unchanged = previous_fingerprints.get(key, fingerprints[key]) == fingerprints[key]
+        if previous_queries.get(key) and unchanged:
+            optimized_queries[key] = previous_queries[key]
+    if optimized_queries:
+        print(f"♻️  Keeping queries for {', '.join(optimized_queries)} (inputs unchanged)")
+
+    to_optimize = {key: value for key, value in prompts.items() if key not in optimized_queries}
+    if to_optimize:
+        responses = gemini.generate_batch(
+            [{'contents': prompt, 'task': 'optimize', 'temperature': 0.2} for prompt, _ in to_optimize.values()],
+            max_concurrency=len(to_optimize)
+        )
+
+        for key, response in zip(to_optimize, responses):
+            try:
+                optimized_queries[key] = parse_source_query(response)
+                print(f"🔍 {key} query: {optimized_queries[key]}")
+            except Exception as e:
+                print(f"⚠️  {key} query optimization failed: {e}")
+                optimized_queries[key] = prompts[key][1]
+
+    # Update strategy với optimized queries (giữ thứ tự nguồn)
+    state['search_strategy']['optimized_queries'] = {key: optimized_queries[key] for key in prompts}
+    state['search_strategy']['optimize_fingerprints'] = fingerprints
+
     # Log
     state['messages'].append({
         'role': 'system',
-        'content': f"✅ Optimized {len(optimized_queries)} queries"
+        'content': f"✅ Optimized {len(to_optimize)} queries ({len(prompts) - len(to_optimize)} unchanged)"
     })
-    
+
     return state
@@ -2,12 +2,79 @@
 Node: Plan Strategy
 Quyết định chiến lược tìm kiếm dựa trên phân tích
 """
-from typing import Dict
+from typing import Dict, List, Tuple
 from ..state_schema import SearchState
 from ..gemini_service import GeminiService
 import json
 
 
+# Nguồn ưu tiên theo topic (nguồn đầu tiên = priority cao nhất)
+TOPIC_SOURCES = {
+    'medical': ['PubMed', 'Semantic Scholar'],
+    'biology': ['PubMed', 'Semantic Scholar'],
+    'engineering': ['Scopus', 'Semantic Scholar'],
+    'computer_science': ['Scopus', 'Semantic Scholar'],
+    'physics': ['Scopus', 'Semantic Scholar'],
+    'social_science': ['Scopus', 'Semantic Scholar']
+}
+SOURCE_ORDER = ['PubMed', 'Scopus', 'Semantic Scholar']
+BROAD_INTENTS = ('review', 'meta_analysis')
+
+
+def rule_based_strategy(analysis: Dict, preferences: Dict) -> Tuple[Dict, List[str]]:
+    """
+    Chiến lược tính cục bộ từ query_analysis + preferences (cùng bộ quy tắc với prompt LLM)
+
+    Returns:
+        (strategy, ambiguities) - ambiguities rỗng = quy tắc đủ chắc chắn, không cần LLM
+    """
+    analysis = analysis or {}
+    topic = analysis.get('topic', '')
+    language = analysis.get('language', 'en')
+    intent = analysis.get('intent', '')
+    user_sources = preferences.get('sources', [])
+    ambiguities = []
+    reasons = []
+
+    if user_sources:
+        sources = list(user_sources)
+        reasons.append("user-selected sources")
+    else:
+        if topic in TOPIC_SOURCES:
+            sources = list(TOPIC_SOURCES[topic])
+            reasons.append(f"topic={topic} → {sources[0]} first")
+        else:
+            sources = ['PubMed', 'Semantic Scholar']
+            ambiguities.append(f"topic '{topic or 'unknown'}' has no source rule")
+
+        if intent in BROAD_INTENTS:
+            sources += [s for s in SOURCE_ORDER if s not in sources]
+            reasons.append(f"intent={intent} → all sources")
+
+        if language == 'vi' and 'Semantic Scholar' not in sources:
+            sources.append('Semantic Scholar')
+        if language == 'vi':
+            reasons.append("Vietnamese query → Semantic Scholar required")
+        elif language not in ('en', 'vi'):
+            ambiguities.append(f"language '{language}'")
+
+    if not analysis.get('keywords'):
+        ambiguities.append("analysis has no keywords")
+
+    strategy = {
+        'sources': sources,
+        'source_priority': ' > '.join(sources),
+        'parallel_search': True,
+        'filters': {
+            'year_range': preferences.get('year_range', [2020, 2025]),
+            'max_results_per_source': max(5, preferences.get('max_results', 10) // max(1, len(sources)))
+        },
+        'reason': "Rule-based: " + '; '.join(reasons) if reasons else "Rule-based defaults",
+        'decided_by': 'rules'
+    }
+    return apply_preferences(strategy, preferences), ambiguities
+
+
 def plan_strategy(state: SearchState, gemini: GeminiService) -> SearchState:
     """
     Quyết định:
@@ -26,6 +93,21 @@ def plan_strategy(state: SearchState, gemini: GeminiService) -> SearchState:
     
     # Get user-selected sources (nếu có)
     user_sources = preferences.get('sources', [])
+
+    # Fast path: quy tắc cục bộ, chỉ gọi LLM khi có ambiguity flag
+    if preferences.get('strategy_mode', 'rules') == 'rules':
+        strategy, ambiguities = rule_based_strategy(analysis, preferences)
+        if not ambiguities:
+            state['search_strategy'] = strategy
+            state['messages'].append({
+                'role': 'system',
+                'content': f"✅ Strategy (rules): {', '.join(strategy['sources'])}"
+            })
+            print(f"📋 Search Strategy (rule-based, no LLM call):")
+            print(f"   - Sources: {', '.join(strategy['sources'])}")
+            print(f"   - Reason: {strategy['reason']}")
+            return state
+        print(f"   → Strategy rules ambiguous ({'; '.join(ambiguities)}), asking Gemini")
     
     prompt = f"""
 Dựa trên phân tích query và preferences, đề xuất chiến lược tìm kiếm tối ưu:
@@ -59,30 +141,18 @@ Trả về JSON (KHÔNG có markdown):
 """
     
     try:
-        response = gemini.client.models.generate_content(
-            model='gemini-2.0-flash',
-            contents=prompt,
-            config={
-                'response_mime_type': 'application/json',
-                'temperature': 0.3
-            }
+        response = gemini.generate(
+            prompt,
+            task='strategy',
+            response_mime_type='application/json',
+            temperature=0.3
         )
         
         strategy_text = response.text.strip()
         strategy = json.loads(strategy_text)
-        
-        # Override with user preferences if specified
-        if user_sources:
-            strategy['sources'] = user_sources
-        
-        if 'year_range' in preferences:
-            strategy['filters']['year_range'] = preferences['year_range']
-        
-        if 'max_results' in preferences:
-            # Chia đều cho các sources
-            num_sources = len(strategy['sources'])
-            per_source = max(5, preferences['max_results'] // num_sources)
-            strategy['filters']['max_results_per_source'] = per_source
+        strategy.setdefault('sources', user_sources or ['PubMed', 'Semantic Scholar'])
+        strategy['decided_by'] = 'llm'
+        apply_preferences(strategy, preferences)
         
         state['search_strategy'] = strategy
         
@@ -122,3 +192,23 @@ Trả về JSON (KHÔNG có markdown):
         })
     
     return state
+
+
+def apply_preferences(strategy: Dict, preferences: Dict) -> Dict:
+    """Override strategy bằng lựa chọn của user (sources, year_range, max_results)"""
+    user_sources = preferences.get('sources', [])
+    strategy.setdefault('filters', {})
+
+    if user_sources:
+        strategy['sources'] = user_sources
+
+    if 'year_range' in preferences:
+        strategy['filters']['year_range'] = preferences['year_range']
+
+    if 'max_results' in preferences:
+        # Chia đều cho các sources
+        num_sources = max(1, len(strategy['sources']))
+        per_source = max(5, preferences['max_results'] // num_sources)
+        strategy['filters']['max_results_per_source'] = per_source
+
+    return strategy
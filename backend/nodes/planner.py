@@ -0,0 +1,153 @@
+"""
+Node: Query Planner (combined)
+Một lời gọi Gemini có response schema thay cho analyze → plan → optimize
+(tối đa 5 lời gọi nối tiếp); lỗi → fallback về đường multi-call cũ
+"""
+from typing import Dict
+from ..state_schema import SearchState
+from ..gemini_service import GeminiService
+from .analyze import analyze_query
+from .plan import plan_strategy, apply_preferences
+from .optimize import optimize_queries
+import json
+
+
+ALL_SOURCES = ['PubMed', 'Scopus', 'Semantic Scholar']
+
+PLANNER_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'analysis': {
+            'type': 'OBJECT',
+            'properties': {
+                'topic': {'type': 'STRING'},
+                'intent': {'type': 'STRING'},
+                'language': {'type': 'STRING', 'enum': ['vi', 'en', 'mixed']},
+                'complexity': {'type': 'STRING', 'enum': ['simple', 'medium', 'complex']},
+                'keywords': {'type': 'ARRAY', 'items': {'type': 'STRING'}},
+                'mesh_terms': {'type': 'ARRAY', 'items': {'type': 'STRING'}}
+            },
+            'required': ['topic', 'intent', 'language', 'complexity', 'keywords', 'mesh_terms']
+        },
+        'strategy': {
+            'type': 'OBJECT',
+            'properties': {
+                'sources': {'type': 'ARRAY', 'items': {'type': 'STRING', 'enum': ALL_SOURCES}},
+                'source_priority': {'type': 'STRING'},
+                'reason': {'type': 'STRING'}
+            },
+            'required': ['sources', 'source_priority', 'reason']
+        },
+        'queries': {
+            'type': 'OBJECT',
+            'properties': {
+                'pubmed': {'type': 'STRING'},
+                'scopus': {'type': 'STRING'},
+                'semantic': {'type': 'STRING'}
+            }
+        }
+    },
+    'required': ['analysis', 'strategy', 'queries']
+}
+
+SOURCE_QUERY_KEYS = {'PubMed': 'pubmed', 'Scopus': 'scopus', 'Semantic Scholar': 'semantic'}
+
+
+def create_planner_prompt(user_query: str, preferences: Dict) -> str:
+    user_sources = preferences.get('sources', [])
+    return f"""
+Bạn là chuyên gia tìm kiếm y văn / học thuật. Với yêu cầu sau, hãy trả về trong MỘT JSON:
+phân tích query, chiến lược tìm kiếm và query tối ưu cho từng nguồn.
+
+Query: "{user_query}"
+
+**User Preferences:**
+- Max results: {preferences.get('max_results', 10)}
+- Year range: {preferences.get('year_range', [2020, 2025])}
+- Preferred sources: {', '.join(user_sources) if user_sources else 'Auto-select'}
+
+**1. analysis**
+- topic: medical, engineering, computer_science, social_science, biology, physics, other
+- intent: review, clinical_trial, case_study, meta_analysis, general_research
+- language: vi, en, mixed
+- complexity: simple, medium, complex
+- keywords: 3-7 từ khóa quan trọng (tiếng Anh)
+- mesh_terms: MeSH terms nếu là y học, nếu không thì []
+
+**2. strategy**
+- topic="medical" → ưu tiên PubMed; engineering/computer_science → ưu tiên Scopus
+- language="vi" → BẮT BUỘC có Semantic Scholar
+- intent="review"/"meta_analysis" → nhiều nguồn
+- Nếu user đã chọn sources → dùng đúng các nguồn đó
+
+**3. queries** (chỉ cho các nguồn trong strategy.sources, chỉ query string)
+- pubmed: Boolean (AND, OR, NOT), MeSH terms dạng term[MeSH], ngắn gọn
+- scopus: TITLE-ABS-KEY("keyword1" AND "keyword2")
+- semantic: ngôn ngữ tự nhiên, ngắn gọn; giữ tiếng Việt nếu language="vi", ngược lại tiếng Anh
+"""
+
+
+def plan_query(state: SearchState, gemini: GeminiService) -> SearchState:
+    """
+    Combined planner: query_analysis + search_strategy (kèm optimized_queries)
+    từ một lời gọi schema-constrained
+
+    Nếu lời gọi lỗi hoặc thiếu query cho nguồn nào → chạy analyze → plan → optimize như cũ
+    """
+    user_query = state['user_query']
+    preferences = state['user_preferences']
+    prompt = create_planner_prompt(user_query, preferences)
+
+    try:
+        response = gemini.generate(
+            prompt,
+            task='plan',
+            response_mime_type='application/json',
+            response_schema=PLANNER_SCHEMA,
+            temperature=0.3
+        )
+        plan = json.loads(response.text.strip())
+
+        analysis = plan['analysis']
+        strategy = dict(plan['strategy'])
+        strategy['parallel_search'] = True
+        strategy['filters'] = {}
+        apply_preferences(strategy, preferences)
+        if not strategy.get('sources'):
+            raise ValueError("no sources selected")
+
+        queries = {k: str(v).strip().strip('"\'`') for k, v in (plan.get('queries') or {}).items() if v}
+        missing = [s for s in strategy['sources'] if not queries.get(SOURCE_QUERY_KEYS.get(s, ''))]
+        if missing:
+            raise ValueError(f"missing queries for {', '.join(missing)}")
+        strategy['optimized_queries'] = {SOURCE_QUERY_KEYS[s]: queries[SOURCE_QUERY_KEYS[s]]
+                                         for s in strategy['sources'] if s in SOURCE_QUERY_KEYS}
+        strategy['planner'] = 'combined'
+
+    except Exception as e:
+        print(f"⚠️  Combined planner failed ({e}), falling back to analyze → plan → optimize")
+        state['messages'].append({
+            'role': 'system',
+            'content': "⚠️  Combined planner failed, using multi-call planning"
+        })
+        state = analyze_query(state, gemini)
+        state = plan_strategy(state, gemini)
+        state = optimize_queries(state, gemini)
+        state['search_strategy']['planner'] = 'multi_fallback'
+        return state
+
+    state['query_analysis'] = analysis
+    state['search_strategy'] = strategy
+
+    state['messages'].append({
+        'role': 'system',
+        'content': f"✅ Planned in one call: topic={analysis.get('topic')}, sources={', '.join(strategy['sources'])}"
+    })
+
+    print(f"📊 Query Plan (combined):")
+    print(f"   - Topic: {analysis.get('topic')} / Intent: {analysis.get('intent')} / Language: {analysis.get('language')}")
+    print(f"   - Sources: {', '.join(strategy['sources'])}")
+    for key, query in strategy['optimized_queries'].items():
+        print(f"   🔍 {key}: {query}")
+
+    return state
@@ -2,23 +2,70 @@
 Node: Refine Query
 Cải thiện query dựa trên lý do refinement
 """
-from typing import Dict
+from typing import Dict, List
 from ..state_schema import SearchState
 from ..gemini_service import GeminiService
 import json
 
 
+def fallback_filters(filters: Dict, cursors: Dict) -> tuple:
+    """
+    Filters của fallback refinement (deterministic, dùng chung cho speculative prefetch):
+    tăng 50% số lượng; còn nguồn chưa hết kết quả → giữ query + năm để execute chỉ lấy
+    trang tiếp theo (offset), ngược lại mở rộng 5 năm về trước
+
+    Returns: (filters mới, message)
+    """
+    new_filters = dict(filters)
+    year_range = filters.get('year_range', [2020, 2025])
+    current_max = filters.get('max_results_per_source', 10)
+    new_filters['max_results_per_source'] = int(current_max * 1.5)
+
+    if cursors and not all(cursor.get('exhausted') for cursor in cursors.values()):
+        return new_filters, "⚠️  Fallback refinement: fetching next page of results"
+
+    new_filters['year_range'] = [max(2000, year_range[0] - 5), year_range[1]]
+    return new_filters, "⚠️  Fallback refinement: expanded year range & increased max results"
+
+
+def variant_list(value, limit: int) -> List[str]:
+    """new_queries[source] là string hoặc mảng variants → list query khác nhau (tối đa limit)"""
+    values = value if isinstance(value, list) else [value]
+    queries = [str(v).strip().strip('"\'`') for v in values if v and str(v).strip()]
+    return list(dict.fromkeys(queries))[:limit]
+
+
 def refine_query(state: SearchState, gemini: GeminiService) -> SearchState:
     """
     Tự động cải thiện query & strategy:
     - Mở rộng/thu hẹp query
     - Điều chỉnh filters (năm, số lượng)
     - Thay đổi nguồn tìm kiếm
+
+    user_preferences['refine_variants'] = K > 1: LLM đề xuất K query cho mỗi nguồn
+    (strategy['query_variants']); execute_search chạy song song tất cả và chọn variant
+    tốt nhất bằng BM25 local → một vòng refine thử được nhiều hướng cùng lúc
     """
     reason = state['refinement_reason']
+    variants = max(1, int(state['user_preferences'].get('refine_variants', 1)))
     current_strategy = state['search_strategy']
     query_analysis = state['query_analysis']
     user_query = state['user_query']
+    # Fingerprint / delta bookkeeping không cần gửi cho LLM
+    strategy_view = {k: v for k, v in current_strategy.items()
+                     if k not in ('optimize_fingerprints', 'executed_fingerprints', 'source_cursors', 'last_execution',
+                                  'prefetch', 'query_variants', 'variant_selection')}
+    if variants > 1:
+        query_format = ('        "pubmed": ["PubMed variant 1", "PubMed variant 2"],\n'
+                        '        "scopus": ["Scopus variant 1", "Scopus variant 2"],\n'
+                        '        "semantic": ["Semantic variant 1", "Semantic variant 2"]')
+        variant_rule = (f"   - Mỗi nguồn đề xuất {variants} query variants KHÁC NHAU (mảng, từ hẹp → rộng, "
+                        f"thử synonyms / bỏ bớt điều kiện); hệ thống chạy song song và chọn variant tốt nhất\n")
+    else:
+        query_format = ('        "pubmed": "improved PubMed query",\n'
+                        '        "scopus": "improved Scopus query",\n'
+                        '        "semantic": "improved Semantic query"')
+        variant_rule = ""
     
     print(f"\n🔧 Refining query...")
     print(f"   - Reason: {reason}")
@@ -33,20 +80,20 @@ Kết quả tìm kiếm không đạt yêu cầu. Hãy cải thiện chiến lư
 **Phân tích:** {json.dumps(query_analysis, indent=2, ensure_ascii=False)}
 
 **Chiến lược hiện tại:**
-{json.dumps(current_strategy, indent=2, ensure_ascii=False)}
+{json.dumps(strategy_view, indent=2, ensure_ascii=False)}
 
 Đề xuất cải thiện:
 1. **new_queries**: Queries mới cho mỗi nguồn (có thể mở rộng keywords, thêm synonyms)
-2. **adjust_filters**: Điều chỉnh filters
+{variant_rule}2. **adjust_filters**: Điều chỉnh filters
    - Nếu không có kết quả → mở rộng year_range, tăng max_results
    - Nếu chất lượng kém → thu hẹp query, thêm filters
+   - Nếu query vẫn đúng nhưng cần thêm bài → giữ nguyên query & year_range, chỉ tăng max_results_per_source
+     (hệ thống chỉ tải trang kết quả tiếp theo)
 
 Trả về JSON (KHÔNG có markdown):
 {{
     "new_queries": {{
-        "pubmed": "improved PubMed query",
-        "scopus": "improved Scopus query",
-        "semantic": "improved Semantic query"
+{query_format}
     }},
     "adjust_filters": {{
         "year_range": [2015, 2025],
@@ -57,13 +104,11 @@ Trả về JSON (KHÔNG có markdown):
 """
     
     try:
-        response = gemini.client.models.generate_content(
-            model='gemini-2.0-flash',
-            contents=prompt,
-            config={
-                'response_mime_type': 'application/json',
-                'temperature': 0.4
-            }
+        response = gemini.generate(
+            prompt,
+            task='refine',
+            response_mime_type='application/json',
+            temperature=0.4
         )
         
         refinement = json.loads(response.text.strip())
@@ -77,9 +122,19 @@ Trả về JSON (KHÔNG có markdown):
         if 'optimized_queries' not in state['search_strategy']:
             state['search_strategy']['optimized_queries'] = {}
         
-        for source_key, new_query in new_queries.items():
-            if new_query:
-                state['search_strategy']['optimized_queries'][source_key] = new_query
+        changed = []
+        query_variants = {}
+        for source_key, value in new_queries.items():
+            queries = variant_list(value, variants)
+            if not queries:
+                continue
+            if len(queries) > 1:
+                query_variants[source_key] = queries
+            if queries[0] != state['search_strategy']['optimized_queries'].get(source_key) or len(queries) > 1:
+                state['search_strategy']['optimized_queries'][source_key] = queries[0]
+                changed.append(source_key)
+        if query_variants:
+            state['search_strategy']['query_variants'] = query_variants
         
         # Update filters
         if adjust_filters:
@@ -90,6 +145,9 @@ Trả về JSON (KHÔNG có markdown):
         
         print(f"   - Refinement #{state['refinement_count']}")
         print(f"   - Explanation: {explanation}")
+        print(f"   - Changed queries: {', '.join(changed) if changed else 'none'}")
+        if query_variants:
+            print(f"   - Query variants: {', '.join(f'{k} x{len(v)}' for k, v in query_variants.items())}")
         print(f"   - New year range: {state['search_strategy']['filters'].get('year_range')}")
         
         state['messages'].append({
@@ -100,23 +158,18 @@ Trả về JSON (KHÔNG có markdown):
     except Exception as e:
         print(f"❌ Refinement Error: {e}")
         
-        # Fallback refinement: Mở rộng year range & tăng số lượng
+        # Fallback refinement: tăng số lượng (+ mở rộng year range nếu đã hết kết quả)
         current_filters = state['search_strategy']['filters']
-        year_range = current_filters.get('year_range', [2020, 2025])
-        
-        # Mở rộng 5 năm về trước
-        new_year_start = max(2000, year_range[0] - 5)
-        current_filters['year_range'] = [new_year_start, year_range[1]]
-        
-        # Tăng 50% số lượng
-        current_max = current_filters.get('max_results_per_source', 10)
-        current_filters['max_results_per_source'] = int(current_max * 1.5)
+        new_filters, message = fallback_filters(current_filters,
+                                                state['search_strategy'].get('source_cursors') or {})
+        current_filters.update(new_filters)
+        print(f"   {message}")
         
         state['refinement_count'] = state.get('refinement_count', 0) + 1
         
         state['messages'].append({
             'role': 'system',
-            'content': f"⚠️  Fallback refinement: expanded year range & increased max results"
+            'content': message
         })
     
     return state
@@ -1,12 +1,224 @@
 """
 Node: Synthesize Findings
 AI-generated literature review from filtered papers
+(một lời gọi, hoặc map-reduce theo cluster khi có nhiều bài)
 """
-from typing import Dict
+from typing import Dict, List, Optional
+from collections import Counter, OrderedDict
+from langgraph.config import get_stream_writer
 from ..state_schema import SearchState
 from ..gemini_service import GeminiService
-from ..prompts.filter_prompt import create_synthesis_prompt
+from ..lexical_ranker import tokenize
+from ..record_linkage import article_key
+from ..prompts.filter_prompt import create_synthesis_prompt, create_chunk_summary_prompt, create_reduce_prompt
+from ..prompts.budget import count_tokens
 from datetime import datetime
+import hashlib
+import json
+import re
+import threading
+import time
+import zlib
+
+# Target prompt size for the synthesis call (abstracts are compressed to fit)
+SYNTHESIS_TOKEN_BUDGET = 8000
+
+# Map-reduce synthesis: cluster → tóm tắt từng chunk song song → reduce
+MAP_REDUCE_MIN_PAPERS = 20   # 'auto' mode chuyển sang map-reduce từ số bài này
+CHUNK_MIN_SIZE = 3
+CHUNK_TARGET_SIZE = 8        # kích thước chunk trung bình (content-defined boundaries)
+CHUNK_MAX_SIZE = 12
+REDUCE_FANOUT = 8            # số partial summary tối đa trong một lời gọi reduce
+MAP_CONCURRENCY = 5
+CITATION_RE = re.compile(r'\[(\d+(?:\s*[,–-]\s*\d+)*)\]')
+
+
+class ChunkSummaryCache:
+    """
+    Cache tóm tắt của từng chunk (in-memory, LRU, thread-safe)
+
+    Key = model + query + nội dung các bài trong chunk → tổng hợp lại sau khi
+    danh sách bài thay đổi ít chỉ gọi lại LLM cho các chunk bị ảnh hưởng
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key: str, summary: str):
+        with self._lock:
+            self._entries[key] = summary
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+CHUNK_SUMMARY_CACHE = ChunkSummaryCache()
+
+
+def paper_theme(paper: Dict, query_analysis: Dict) -> str:
+    """
+    Cluster của một bài = keyword của query khớp nhiều nhất (title x2 + abstract)
+
+    Tính riêng cho từng bài nên thêm / bớt bài không làm đổi cluster của bài khác.
+    Không khớp keyword nào → 'other'
+    """
+    title = Counter(tokenize(paper.get('title', '')))
+    abstract = Counter(tokenize(paper.get('abstract', '')))
+    best, best_score = 'other', 0.0
+    for keyword in (query_analysis or {}).get('keywords', []):
+        terms = tokenize(keyword)
+        if not terms:
+            continue
+        score = sum(2 * title[t] + abstract[t] for t in terms) / len(terms)
+        if score > best_score:
+            best, best_score = keyword, score
+    return best
+
+
+def cluster_chunks(papers: List[Dict], query_analysis: Dict) -> List[List[int]]:
+    """
+    Chia papers (index) thành các chunk: theo theme, trong mỗi theme sắp theo
+    article key và cắt theo ranh giới content-defined (hash của key) → một bài
+    mới chỉ làm đổi chunk chứa nó, các chunk khác giữ nguyên (trúng cache)
+    """
+    themes = {}
+    for idx, paper in enumerate(papers):
+        themes.setdefault(paper_theme(paper, query_analysis), []).append((article_key(paper), idx))
+
+    chunks = []
+    for theme in sorted(themes):
+        current = []
+        for key, idx in sorted(themes[theme]):
+            current.append(idx)
+            boundary = zlib.crc32(key.encode('utf-8')) % CHUNK_TARGET_SIZE == 0
+            if len(current) >= CHUNK_MAX_SIZE or (boundary and len(current) >= CHUNK_MIN_SIZE):
+                chunks.append(current)
+                current = []
+        if current:
+            chunks.append(current)
+    return chunks
+
+
+def chunk_cache_key(user_query: str, papers: List[Dict], model: str) -> str:
+    content = [(article_key(p), p.get('title', ''), p.get('abstract', ''), p.get('year')) for p in papers]
+    raw = json.dumps([model, user_query, content], ensure_ascii=False, default=str)
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+def renumber_citations(text: str, numbers: List[int]) -> str:
+    """
+    Citation cục bộ của chunk ([1], [2, 3], [1-3]) → số thứ tự toàn cục của bài
+    (số ngoài phạm vi chunk bị bỏ, tránh trỏ nhầm sang bài khác)
+    """
+    def replace(match):
+        out = []
+        for part in re.split(r'\s*,\s*', match.group(1)):
+            bounds = re.split(r'\s*[–-]\s*', part)
+            local = range(int(bounds[0]), int(bounds[-1]) + 1)
+            out.extend(str(numbers[n - 1]) for n in local if 1 <= n <= len(numbers))
+        return f"[{', '.join(out)}]" if out else ''
+    return CITATION_RE.sub(replace, text)
+
+
+def fallback_chunk_summary(papers: List[Dict]) -> str:
+    """Tóm tắt không cần LLM khi lời gọi map lỗi: title + key finding của từng bài"""
+    lines = []
+    for i, paper in enumerate(papers, 1):
+        finding = paper.get('key_finding', 'N/A')
+        detail = f": {finding}" if finding and finding != 'N/A' else ''
+        lines.append(f"- {paper.get('title', 'N/A')} ({paper.get('year', 'N/A')}){detail} [{i}]")
+    return "\n".join(lines)
+
+
+def prepare_map_reduce(user_query: str, papers: List[Dict], query_analysis: Dict,
+                       gemini: GeminiService, model: str = 'gemini-2.0-flash') -> tuple:
+    """
+    Map: tóm tắt song song từng chunk (cache theo nội dung chunk)
+    Reduce: gộp partial summaries theo nhóm REDUCE_FANOUT cho tới khi vừa một lời gọi
+
+    Returns:
+        (final_prompt, stats) - final_prompt được gọi (stream) giống single-call synthesis
+    """
+    chunks = cluster_chunks(papers, query_analysis)
+    summaries = [None] * len(chunks)
+    pending, requests = [], []
+
+    for c, indices in enumerate(chunks):
+        chunk = [papers[i] for i in indices]
+        key = chunk_cache_key(user_query, chunk, model)
+        cached = CHUNK_SUMMARY_CACHE.get(key)
+        if cached is not None:
+            summaries[c] = cached
+            continue
+        pending.append((c, key))
+        requests.append({
+            'contents': create_chunk_summary_prompt(user_query, chunk, query_analysis),
+            'model': model,
+            'task': 'synthesis_chunk',
+            'temperature': 0.3,
+            'max_output_tokens': 400
+        })
+
+    print(f"   🧩 Map-reduce: {len(chunks)} chunks ({len(chunks) - len(pending)} cached, "
+          f"{len(pending)} to summarize in parallel)")
+
+    failed = 0
+    responses = gemini.generate_batch(requests, max_concurrency=MAP_CONCURRENCY)
+    for (c, key), response in zip(pending, responses):
+        text = '' if isinstance(response, Exception) else (response.text or '').strip()
+        if text:
+            summaries[c] = text
+            CHUNK_SUMMARY_CACHE.set(key, text)
+        else:
+            failed += 1
+            print(f"      ⚠️  Chunk {c + 1} summary failed ({str(response)[:60]}), using paper list")
+            summaries[c] = fallback_chunk_summary([papers[i] for i in chunks[c]])
+
+    partials = [renumber_citations(summary, [i + 1 for i in chunks[c]]) for c, summary in enumerate(summaries)]
+
+    # Hierarchical reduce: quá nhiều partial summaries → gộp từng nhóm trước
+    levels = 0
+    while len(partials) > REDUCE_FANOUT:
+        groups = [partials[i:i + REDUCE_FANOUT] for i in range(0, len(partials), REDUCE_FANOUT)]
+        responses = gemini.generate_batch([{
+            'contents': create_reduce_prompt(user_query, group, papers, query_analysis, final=False),
+            'model': model,
+            'task': 'synthesis_reduce',
+            'temperature': 0.3,
+            'max_output_tokens': 600
+        } for group in groups], max_concurrency=MAP_CONCURRENCY)
+        partials = [
+            response.text.strip() if not isinstance(response, Exception) and (response.text or '').strip()
+            else "\n\n".join(group)
+            for group, response in zip(groups, responses)
+        ]
+        levels += 1
+
+    stats = {
+        'chunks': len(chunks),
+        'cached_chunks': len(chunks) - len(pending),
+        'failed_chunks': failed,
+        'reduce_levels': levels + 1,
+        'chunk_sizes': [len(indices) for indices in chunks]
+    }
+    return create_reduce_prompt(user_query, partials, papers, query_analysis, final=True), stats
+
+
+def stream_writer():
+    """Writer của LangGraph stream_mode='custom' (no-op khi node chạy ngoài graph)"""
+    try:
+        return get_stream_writer()
+    except RuntimeError:
+        return lambda chunk: None
 
 
 def synthesize_findings(state: SearchState, gemini: GeminiService) -> SearchState:
@@ -17,6 +229,8 @@ def synthesize_findings(state: SearchState, gemini: GeminiService) -> SearchStat
     1. Take all filtered high-quality papers (score >= 7)
     2. Send abstracts to Gemini with synthesis prompt
     3. AI writes comprehensive 300-500 word review
+       (streamed: từng chunk được gửi qua stream_mode='custom' dạng
+       {'synthesis_chunk': text}, tắt bằng user_preferences['stream_synthesis'] = False)
     4. Add metadata (paper count, avg year, date)
 
     Args:
@@ -105,20 +319,41 @@ Only {len(filtered_papers)} high-quality paper(s) met the relevance criteria for
     try:
         print("   🤖 Generating AI literature review...")
 
-        # Build synthesis prompt
-        prompt = create_synthesis_prompt(user_query, filtered_papers, query_analysis)
+        # 'single' | 'map_reduce' | 'auto' (map-reduce khi >= MAP_REDUCE_MIN_PAPERS bài)
+        mode = state['user_preferences'].get('synthesis_mode', 'auto')
+        if mode == 'auto':
+            mode = 'map_reduce' if len(filtered_papers) >= MAP_REDUCE_MIN_PAPERS else 'single'
+        start = time.perf_counter()
+        map_reduce_stats = None
 
-        # Call Gemini
-        response = gemini.client.models.generate_content(
-            model='gemini-2.0-flash',
-            contents=prompt,
-            config={
-                'temperature': 0.4,  # Balanced creativity and accuracy
-                'max_output_tokens': 2000  # Allow longer synthesis
-            }
-        )
-
-        synthesis_text = response.text.strip()
+        # Build synthesis prompt
+        if mode == 'map_reduce':
+            prompt, map_reduce_stats = prepare_map_reduce(user_query, filtered_papers, query_analysis, gemini)
+        else:
+            prompt = create_synthesis_prompt(user_query, filtered_papers, query_analysis,
+                                             token_budget=SYNTHESIS_TOKEN_BUDGET)
+
+        generation = {
+            'task': 'synthesis',
+            'temperature': 0.4,  # Balanced creativity and accuracy
+            'max_output_tokens': 2000  # Allow longer synthesis
+        }
+        streamed = state['user_preferences'].get('stream_synthesis', True)
+        first_chunk_s = None
+
+        if streamed:
+            # Gửi từng chunk lên UI ngay khi Gemini sinh ra
+            writer = stream_writer()
+            parts = []
+            for text in gemini.generate_stream(prompt, **generation):
+                if first_chunk_s is None:
+                    first_chunk_s = round(time.perf_counter() - start, 2)
+                parts.append(text)
+                writer({'synthesis_chunk': text})
+            synthesis_text = ''.join(parts).strip()
+        else:
+            response = gemini.generate(prompt, **generation)
+            synthesis_text = response.text.strip()
 
         # Calculate metadata
         years = [p.get('year', 0) for p in filtered_papers if isinstance(p.get('year'), int)]
@@ -130,8 +365,15 @@ Only {len(filtered_papers)} high-quality paper(s) met the relevance criteria for
             'avg_year': round(avg_year, 1) if isinstance(avg_year, (int, float)) else avg_year,
             'synthesis_date': datetime.now().isoformat(),
             'status': 'success',
-            'model': 'gemini-2.0-flash'
+            'model': 'gemini-2.0-flash',
+            'prompt_tokens_estimate': count_tokens(prompt),
+            'streamed': streamed,
+            'time_to_first_chunk_s': first_chunk_s,
+            'generation_s': round(time.perf_counter() - start, 2),
+            'synthesis_mode': mode
         }
+        if map_reduce_stats:
+            state['synthesis_metadata']['map_reduce'] = map_reduce_stats
 
         print(f"   ✅ Synthesis completed")
         print(f"      - Length: {len(synthesis_text)} characters")
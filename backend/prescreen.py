@@ -0,0 +1,370 @@
+"""
+Local Learned Pre-screen Classifier
+Logistic regression trên hashed n-gram features, huấn luyện offline từ các
+relevance_score mà Gemini đã chấm trong các search đã lưu.
+
+Runtime: bài được dự đoán keep/discard với độ tin cậy cao thì không cần gọi Gemini,
+chỉ bài có độ tin cậy thấp mới được gửi lên LLM.
+
+Usage:
+    python -m backend.prescreen train --projects projects --out models/prescreen.json
+    python -m backend.prescreen report --model models/prescreen.json
+"""
+import argparse
+import json
+import os
+import zlib
+from datetime import datetime
+from typing import List, Dict, Tuple, Optional
+
+import numpy as np
+
+from .lexical_ranker import tokenize
+
+
+DEFAULT_MODEL_PATH = os.path.join("models", "prescreen.json")
+KEEP_SCORE = 7.0
+MIN_TRAINING_EXAMPLES = 50
+
+
+def is_disabled() -> bool:
+    """Kill switch: PRESCREEN_DISABLED=1 tắt pre-screen ở mọi nơi"""
+    return os.getenv('PRESCREEN_DISABLED', '').lower() in ('1', 'true', 'yes')
+
+
+def _hash(feature: str, n_features: int) -> int:
+    return zlib.crc32(feature.encode('utf-8')) % n_features
+
+
+def featurize(user_query: str, article: Dict, n_features: int) -> Dict[int, float]:
+    """
+    Hashed features (L2-normalized):
+    - Unigram + bigram của title/abstract (title có prefix riêng)
+    - Query-conditioned: query term xuất hiện trong title/abstract
+    """
+    title_tokens = tokenize(article.get('title', ''))
+    abstract_tokens = tokenize(article.get('abstract', ''))
+    query_tokens = set(tokenize(user_query))
+
+    counts = {}
+
+    def add(feature: str, value: float = 1.0):
+        idx = _hash(feature, n_features)
+        counts[idx] = counts.get(idx, 0.0) + value
+
+    for prefix, tokens in (('t', title_tokens), ('a', abstract_tokens)):
+        for i, token in enumerate(tokens):
+            add(f"{prefix}:{token}")
+            if i + 1 < len(tokens):
+                add(f"{prefix}:{token}_{tokens[i + 1]}")
+
+    title_set, abstract_set = set(title_tokens), set(abstract_tokens)
+    for term in query_tokens:
+        if term in title_set:
+            add(f"qt:{term}", 2.0)
+        if term in abstract_set:
+            add(f"qa:{term}", 2.0)
+    if query_tokens:
+        add("__query_title_overlap__", 3.0 * len(query_tokens & title_set) / len(query_tokens))
+        add("__query_abstract_overlap__", 3.0 * len(query_tokens & abstract_set) / len(query_tokens))
+    if not abstract_tokens:
+        add("__no_abstract__")
+
+    # Log-scale term counts, then L2 normalize
+    values = {idx: np.log1p(v) for idx, v in counts.items()}
+    norm = np.sqrt(sum(v * v for v in values.values())) or 1.0
+    return {idx: v / norm for idx, v in values.items()}
+
+
+def _to_sparse(rows: List[Dict[int, float]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """List of {col: value} → COO arrays (row, col, value)"""
+    row_idx, col_idx, vals = [], [], []
+    for r, features in enumerate(rows):
+        for c, v in features.items():
+            row_idx.append(r)
+            col_idx.append(c)
+            vals.append(v)
+    return (np.array(row_idx, dtype=np.int64), np.array(col_idx, dtype=np.int64),
+            np.array(vals, dtype=np.float64))
+
+
+class PreScreenModel:
+    """Logistic regression (full-batch gradient descent, L2) trên sparse hashed features"""
+
+    def __init__(self, n_features: int = 2 ** 16, l2: float = 1e-4):
+        self.n_features = n_features
+        self.l2 = l2
+        self.weights = np.zeros(n_features)
+        self.bias = 0.0
+        self.metadata = {}
+
+    def _decision(self, rows, cols, vals, n_rows) -> np.ndarray:
+        return np.bincount(rows, weights=vals * self.weights[cols], minlength=n_rows) + self.bias
+
+    def fit(self, queries: List[str], articles: List[Dict], labels: List[int],
+            epochs: int = 300, lr: float = 1.0):
+        features = [featurize(q, a, self.n_features) for q, a in zip(queries, articles)]
+        rows, cols, vals = _to_sparse(features)
+        y = np.array(labels, dtype=np.float64)
+        n = len(y)
+
+        # Cân bằng class: search đã lưu thường có nhiều bài keep hơn discard
+        pos = max(y.sum(), 1.0)
+        neg = max(n - y.sum(), 1.0)
+        sample_weight = np.where(y == 1, n / (2 * pos), n / (2 * neg))
+
+        for _ in range(epochs):
+            p = 1.0 / (1.0 + np.exp(-self._decision(rows, cols, vals, n)))
+            residual = (p - y) * sample_weight / n
+            grad_w = np.bincount(cols, weights=vals * residual[rows], minlength=self.n_features)
+            grad_w += self.l2 * self.weights
+            self.weights -= lr * grad_w
+            self.bias -= lr * residual.sum()
+
+        return self
+
+    def predict_proba(self, user_query: str, articles: List[Dict]) -> np.ndarray:
+        """P(keep) cho từng article"""
+        if not articles:
+            return np.zeros(0)
+        features = [featurize(user_query, a, self.n_features) for a in articles]
+        rows, cols, vals = _to_sparse(features)
+        return 1.0 / (1.0 + np.exp(-self._decision(rows, cols, vals, len(articles))))
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        nonzero = np.nonzero(self.weights)[0]
+        data = {
+            'n_features': self.n_features,
+            'l2': self.l2,
+            'bias': self.bias,
+            'weights': {int(i): round(float(self.weights[i]), 6) for i in nonzero},
+            'metadata': self.metadata
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+
+    @classmethod
+    def load(cls, path: str) -> 'PreScreenModel':
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        model = cls(n_features=data['n_features'], l2=data.get('l2', 1e-4))
+        model.bias = data['bias']
+        for idx, weight in data['weights'].items():
+            model.weights[int(idx)] = weight
+        model.metadata = data.get('metadata', {})
+        return model
+
+
+# ----------------------------------------------------------------------
+# Training data
+# ----------------------------------------------------------------------
+
+def load_training_examples(projects_dir: str = "projects") -> List[Dict]:
+    """
+    Gom các bài có relevance_score do Gemini chấm từ mọi project:
+    - labels.jsonl (cả bài keep lẫn discard, ghi khi lưu search)
+    - results/*.json (search cũ, lưu full articles)
+
+    Returns:
+        [{'query', 'article', 'score'}] - mỗi (query, title) một lần
+    """
+    examples = {}
+    if not os.path.exists(projects_dir):
+        return []
+
+    for project_id in sorted(os.listdir(projects_dir)):
+        project_dir = os.path.join(projects_dir, project_id)
+        if not os.path.isdir(project_dir):
+            continue
+
+        labels_file = os.path.join(project_dir, "labels.jsonl")
+        if os.path.exists(labels_file):
+            with open(labels_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    row = json.loads(line)
+                    key = (row.get('query', ''), row.get('title', ''))
+                    examples[key] = {'query': row.get('query', ''), 'article': row, 'score': row['relevance_score']}
+
+        results_dir = os.path.join(project_dir, "results")
+        if os.path.isdir(results_dir):
+            for filename in sorted(os.listdir(results_dir)):
+                if not filename.endswith('.json'):
+                    continue
+                with open(os.path.join(results_dir, filename), 'r', encoding='utf-8') as f:
+                    search_data = json.load(f)
+                query = search_data.get('user_query', '')
+                for article in search_data.get('articles', []):
+                    if article.get('relevance_score') is None:
+                        continue
+                    key = (query, article.get('title', ''))
+                    examples.setdefault(key, {'query': query, 'article': article, 'score': article['relevance_score']})
+
+    return list(examples.values())
+
+
+def _is_holdout(example: Dict, fraction: float) -> bool:
+    key = f"{example['query']}|{example['article'].get('title', '')}"
+    return (zlib.crc32(key.encode('utf-8')) % 1000) < fraction * 1000
+
+
+def calibration_report(probabilities: np.ndarray, labels: np.ndarray,
+                       thresholds=((0.1, 0.9), (0.2, 0.8), (0.3, 0.7)), bins: int = 10) -> Dict:
+    """
+    Reliability bins, Brier score, và coverage/accuracy tại các ngưỡng tin cậy
+
+    Coverage = tỉ lệ bài được classifier tự quyết (không cần LLM)
+    """
+    report = {'examples': int(len(labels))}
+    if len(labels) == 0:
+        return report
+
+    report['brier_score'] = round(float(np.mean((probabilities - labels) ** 2)), 4)
+    report['accuracy_at_0.5'] = round(float(np.mean((probabilities >= 0.5) == (labels == 1))), 4)
+
+    reliability = []
+    edges = np.linspace(0.0, 1.0, bins + 1)
+    for low, high in zip(edges[:-1], edges[1:]):
+        mask = (probabilities >= low) & ((probabilities < high) if high < 1.0 else (probabilities <= high))
+        if mask.any():
+            reliability.append({
+                'bin': f"{low:.1f}-{high:.1f}",
+                'count': int(mask.sum()),
+                'mean_predicted': round(float(probabilities[mask].mean()), 3),
+                'observed_keep_rate': round(float(labels[mask].mean()), 3)
+            })
+    report['reliability'] = reliability
+
+    operating_points = []
+    for discard_below, keep_above in thresholds:
+        decided = (probabilities <= discard_below) | (probabilities >= keep_above)
+        correct = ((probabilities >= keep_above) & (labels == 1)) | ((probabilities <= discard_below) & (labels == 0))
+        operating_points.append({
+            'discard_below': discard_below,
+            'keep_above': keep_above,
+            'coverage': round(float(decided.mean()), 3),
+            'accuracy_on_decided': round(float(correct.sum() / decided.sum()), 3) if decided.any() else None
+        })
+    report['operating_points'] = operating_points
+    return report
+
+
+def train(projects_dir: str = "projects", out_path: str = DEFAULT_MODEL_PATH,
+          holdout_fraction: float = 0.2) -> Dict:
+    """Train, đánh giá trên holdout, rồi train lại trên toàn bộ dữ liệu và lưu model"""
+    examples = load_training_examples(projects_dir)
+    if len(examples) < MIN_TRAINING_EXAMPLES:
+        raise ValueError(f"Need at least {MIN_TRAINING_EXAMPLES} labelled articles, found {len(examples)}")
+
+    train_set = [e for e in examples if not _is_holdout(e, holdout_fraction)]
+    holdout = [e for e in examples if _is_holdout(e, holdout_fraction)]
+
+    def labels_of(items):
+        return [1 if float(e['score']) >= KEEP_SCORE else 0 for e in items]
+
+    model = PreScreenModel().fit(
+        [e['query'] for e in train_set], [e['article'] for e in train_set], labels_of(train_set)
+    )
+
+    probabilities = np.concatenate([
+        model.predict_proba(e['query'], [e['article']]) for e in holdout
+    ]) if holdout else np.zeros(0)
+    report = calibration_report(probabilities, np.array(labels_of(holdout), dtype=np.float64))
+
+    final_model = PreScreenModel().fit(
+        [e['query'] for e in examples], [e['article'] for e in examples], labels_of(examples)
+    )
+    final_model.metadata = {
+        'trained_at': datetime.now().isoformat(),
+        'examples': len(examples),
+        'positive_rate': round(sum(labels_of(examples)) / len(examples), 3),
+        'calibration': report
+    }
+    final_model.save(out_path)
+    return final_model.metadata
+
+
+# ----------------------------------------------------------------------
+# Runtime
+# ----------------------------------------------------------------------
+
+_model_cache = {}
+
+
+def load_model(path: str = DEFAULT_MODEL_PATH) -> Optional[PreScreenModel]:
+    """Load model (cache theo mtime), None nếu chưa train hoặc bị tắt"""
+    if is_disabled() or not os.path.exists(path):
+        return None
+    mtime = os.path.getmtime(path)
+    cached = _model_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    model = PreScreenModel.load(path)
+    _model_cache[path] = (mtime, model)
+    return model
+
+
+def prescreen(articles: List[Dict], user_query: str, model: PreScreenModel,
+              keep_above: float = 0.9, discard_below: float = 0.1) -> Tuple[List[Dict], List[Dict], List[Dict], Dict]:
+    """
+    Chia articles theo độ tin cậy của classifier
+
+    Returns:
+        (confident_keep, confident_discard, uncertain, stats)
+        uncertain → gửi cho Gemini
+    """
+    probabilities = model.predict_proba(user_query, articles)
+    keep, discard, uncertain = [], [], []
+
+    for article, p in zip(articles, probabilities):
+        p = float(p)
+        article['prescreen_confidence'] = round(p, 3)
+        if p >= keep_above or p <= discard_below:
+            # Map P(keep) về thang 1-10 để đồng nhất với điểm của Gemini
+            article['relevance_score'] = round(1.0 + 9.0 * p, 1)
+            article['ai_reasoning'] = f"Pre-screen classifier decision (P(keep)={p:.2f})"
+            article['key_finding'] = 'N/A'
+            article['scoring_tier'] = 'prescreen'
+            if p >= keep_above:
+                keep.append(article)
+            else:
+                article['discard_reason'] = article['ai_reasoning']
+                discard.append(article)
+        else:
+            uncertain.append(article)
+
+    stats = {
+        'kept': len(keep),
+        'discarded': len(discard),
+        'sent_to_llm': len(uncertain),
+        'llm_calls_saved': len(keep) + len(discard)
+    }
+    print(f"   → Pre-screen: {len(keep)} keep, {len(discard)} discard, {len(uncertain)} uncertain → LLM")
+    return keep, discard, uncertain, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train / inspect the local pre-screen classifier")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    train_parser = sub.add_parser('train', help="Train on saved project searches")
+    train_parser.add_argument('--projects', default="projects")
+    train_parser.add_argument('--out', default=DEFAULT_MODEL_PATH)
+    train_parser.add_argument('--holdout', type=float, default=0.2)
+
+    report_parser = sub.add_parser('report', help="Print the calibration report of a trained model")
+    report_parser.add_argument('--model', default=DEFAULT_MODEL_PATH)
+
+    args = parser.parse_args()
+    if args.command == 'train':
+        metadata = train(args.projects, args.out, args.holdout)
+        print(f"✅ Model saved to {args.out}")
+    else:
+        metadata = PreScreenModel.load(args.model).metadata
+    print(json.dumps(metadata, indent=2))
+
+
+if __name__ == '__main__':
+    main()
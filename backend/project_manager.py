@@ -7,6 +7,7 @@ import os
 from datetime import datetime
 from typing import List, Dict, Optional
 import hashlib
+from .record_linkage import article_key, article_keys
 
 
 class ProjectManager:
@@ -99,6 +100,10 @@ class ProjectManager:
                            selected_articles: List[Dict] = None):
         """
         Lưu kết quả tìm kiếm vào project
+
+        Articles được lưu 1 lần trong article store của project (articles.json),
+        file search chỉ lưu references (article_ids). Seen index được cập nhật
+        để các lần tìm kiếm sau có thể bỏ qua/đánh dấu bài đã biết.
         
         Args:
             project_id: ID của project
@@ -116,6 +121,22 @@ class ProjectManager:
         # Generate search ID
         search_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         search_id = f"search_{search_timestamp}"
+        # Nhiều lần lưu trong cùng một giây (vd batch runner) → thêm hậu tố
+        suffix = 1
+        while os.path.exists(os.path.join(project_dir, "results", f"{search_id}.json")):
+            suffix += 1
+            search_id = f"search_{search_timestamp}_{suffix}"
+
+        # Update article store & seen index
+        article_ids, new_count = self._store_articles(project_id, articles, search_id,
+                                                      search_results.get('user_query', ''))
+
+        # Gemini scores (kept + discarded) → training labels cho pre-screen classifier
+        self._append_labels(
+            project_id,
+            search_results.get('user_query', ''),
+            search_results.get('final_results', []) + (search_results.get('discarded_articles') or [])
+        )
         
         # Save results
         results_file = os.path.join(project_dir, "results", f"{search_id}.json")
@@ -129,7 +150,8 @@ class ProjectManager:
             "metadata": search_results.get('metadata', {}),
             "total_found": len(search_results.get('final_results', [])),
             "saved_count": len(articles),
-            "articles": articles
+            "new_count": new_count,
+            "article_ids": article_ids
         }
         
         with open(results_file, 'w', encoding='utf-8') as f:
@@ -142,6 +164,7 @@ class ProjectManager:
         
         metadata['search_count'] += 1
         metadata['total_articles'] += len(articles)
+        metadata['unique_articles'] = self.count_unique_articles(project_id)
         metadata['updated_at'] = datetime.now().isoformat()
         metadata['last_search_id'] = search_id
         
@@ -152,10 +175,141 @@ class ProjectManager:
         self._add_history(project_id, "Search results saved", {
             "search_id": search_id,
             "articles_count": len(articles),
+            "new_articles": new_count,
             "quality_score": search_results.get('quality_score', 0.0)
         })
         
         return search_id
+
+    def _article_store_file(self, project_id: str) -> str:
+        return os.path.join(self.base_dir, project_id, "articles.json")
+
+    def _seen_index_file(self, project_id: str) -> str:
+        return os.path.join(self.base_dir, project_id, "seen_index.json")
+
+    def _load_article_store(self, project_id: str) -> Dict[str, Dict]:
+        """Load article store {canonical_id: article}"""
+        store_file = self._article_store_file(project_id)
+        if not os.path.exists(store_file):
+            return {}
+        with open(store_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _store_articles(self, project_id: str, articles: List[Dict], search_id: str,
+                        user_query: str = '') -> tuple:
+        """
+        Thêm articles vào store & seen index
+
+        relevance_score chấm mới được ghi kèm scored_query (query dùng để chấm) để lần
+        tìm kiếm sau chỉ dùng lại score khi cùng query
+
+        Returns:
+            (article_ids, new_count)
+        """
+        store = self._load_article_store(project_id)
+        seen = self.get_seen_index(project_id)
+
+        article_ids = []
+        new_count = 0
+        for article in articles:
+            keys = article_keys(article)
+            # Bài đã có trong store (có thể qua ID khác) → dùng lại canonical ID cũ
+            canonical = next((seen[k] for k in keys if k in seen), None) or keys[0]
+            if canonical not in store:
+                new_count += 1
+            entry = {**store.get(canonical, {}), **article, 'first_seen': store.get(canonical, {}).get('first_seen', search_id)}
+            if article.get('relevance_score') is not None and not article.get('score_reused'):
+                entry['scored_query'] = user_query
+            entry.pop('score_reused', None)
+            store[canonical] = entry
+            for key in keys:
+                seen.setdefault(key, canonical)
+            article_ids.append(canonical)
+
+        with open(self._article_store_file(project_id), 'w', encoding='utf-8') as f:
+            json.dump(store, f, indent=2, ensure_ascii=False)
+        with open(self._seen_index_file(project_id), 'w', encoding='utf-8') as f:
+            json.dump(seen, f, ensure_ascii=False)
+
+        return article_ids, new_count
+
+    def _append_labels(self, project_id: str, user_query: str, articles: List[Dict]):
+        """
+        Ghi relevance_score do Gemini chấm vào labels.jsonl (bỏ qua điểm không đến từ LLM:
+        pre-screen, lexical gate, lỗi, điểm dùng lại từ project; và điểm cascade chỉ dựa trên title)
+        """
+        labels_file = os.path.join(self.base_dir, project_id, "labels.jsonl")
+        with open(labels_file, 'a', encoding='utf-8') as f:
+            for article in articles:
+                if article.get('relevance_score') is None or article.get('scoring_error') or article.get('score_reused'):
+                    continue
+                tier = article.get('scoring_tier') or ''
+                if tier in ('prescreen', 'lexical') or tier.endswith('_title'):
+                    continue
+                f.write(json.dumps({
+                    'key': article_key(article),
+                    'query': user_query,
+                    'title': article.get('title', ''),
+                    'abstract': article.get('abstract', ''),
+                    'relevance_score': article['relevance_score']
+                }, ensure_ascii=False) + '\n')
+
+    def get_seen_index(self, project_id: str) -> Dict[str, str]:
+        """
+        Seen index của project: {any_known_id: canonical_id}
+
+        Project cũ (chưa có index) được build lại từ các file results.
+        """
+        index_file = self._seen_index_file(project_id)
+        if os.path.exists(index_file):
+            with open(index_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+
+        seen = {}
+        results_dir = os.path.join(self.base_dir, project_id, "results")
+        if os.path.exists(results_dir):
+            for filename in sorted(os.listdir(results_dir)):
+                if not filename.endswith('.json'):
+                    continue
+                with open(os.path.join(results_dir, filename), 'r', encoding='utf-8') as f:
+                    search_data = json.load(f)
+                for article in search_data.get('articles', []):
+                    keys = article_keys(article)
+                    for key in keys:
+                        seen.setdefault(key, keys[0])
+                for canonical in search_data.get('article_ids', []):
+                    seen.setdefault(canonical, canonical)
+        return seen
+
+    def count_unique_articles(self, project_id: str) -> int:
+        """
+        Số bài unique của project: canonical IDs trong seen index (gồm cả bài của project
+        cũ chỉ nằm trong các file results, chưa có trong article store)
+        """
+        return len(set(self.get_seen_index(project_id).values()))
+
+    def get_seen_articles(self, project_id: str) -> Dict[str, Dict]:
+        """
+        Articles đã lưu trong project, tra cứu theo mọi ID đã biết
+
+        Returns:
+            {known_id: stored_article}
+        """
+        seen = self.get_seen_index(project_id)
+        store = self._load_article_store(project_id)
+        legacy = {}
+        if len(store) < len(set(seen.values())):
+            # Project cũ: articles nằm trong từng file results
+            for search in self.get_project_searches(project_id):
+                data = self.load_search_results(project_id, search['search_id']) or {}
+                for article in data.get('articles', []):
+                    legacy.setdefault(article_key(article), article)
+
+        return {
+            key: store.get(canonical) or legacy.get(canonical)
+            for key, canonical in seen.items()
+            if store.get(canonical) or legacy.get(canonical)
+        }
     
     def _add_history(self, project_id: str, action: str, details: Dict):
         """Thêm entry vào history"""
@@ -253,8 +407,33 @@ class ProjectManager:
             return None
         
         with open(results_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
+            search_data = json.load(f)
+
+        # Search mới chỉ lưu references → rehydrate từ article store
+        if 'articles' not in search_data:
+            store = self._load_article_store(project_id)
+            search_data['articles'] = [
+                store[article_id] for article_id in search_data.get('article_ids', [])
+                if article_id in store
+            ]
+
+        return search_data
     
+    @classmethod
+    def load_results_file(cls, path: str) -> Dict:
+        """
+        Load file search theo đường dẫn (projects/<id>/results/<search>.json), kèm articles
+        đã rehydrate từ article store (dùng cho benchmark / script)
+        """
+        results_dir = os.path.dirname(os.path.abspath(path))
+        project_dir = os.path.dirname(results_dir)
+        search_id = os.path.splitext(os.path.basename(path))[0]
+        pm = cls(os.path.dirname(project_dir))
+        data = pm.load_search_results(os.path.basename(project_dir), search_id)
+        if data is None:
+            raise FileNotFoundError(path)
+        return data
+
     def delete_project(self, project_id: str):
         """Xóa project"""
         import shutil
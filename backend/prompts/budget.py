@@ -0,0 +1,240 @@
+"""
+Prompt Token Budget
+Đếm token, bỏ boilerplate, nén abstract bằng cách chọn câu (extractive)
+thay vì cắt cứng theo số ký tự, và đóng gói prompt theo ngân sách token mỗi lần gọi
+"""
+import re
+import threading
+from contextvars import ContextVar
+from typing import List, Dict, Iterable, Optional
+
+from ..lexical_ranker import tokenize, build_query_terms
+
+
+# ~4 ký tự / token cho tiếng Anh (đủ chính xác để lập ngân sách, không cần tokenizer)
+CHARS_PER_TOKEN = 4
+
+# Ngân sách token cho abstract của mỗi bài, theo loại prompt
+ABSTRACT_TOKENS = {
+    'filter': 200,      # single-paper scoring
+    'batch': 90,        # batch scoring (nhiều bài / prompt)
+    'synthesis': 120    # literature synthesis
+}
+
+SECTION_LABEL_RE = re.compile(
+    r'\b(?:BACKGROUND|INTRODUCTION|OBJECTIVES?|PURPOSE|AIMS?|DESIGN|SETTING|PARTICIPANTS|'
+    r'METHODS?|MATERIALS AND METHODS|RESULTS?|FINDINGS|CONCLUSIONS?|INTERPRETATION|'
+    r'SIGNIFICANCE|IMPORTANCE|CONTEXT)\s*:\s*'
+)
+BOILERPLATE_RE = re.compile(
+    r'^(?:©|\(c\)\s*\d{4}|copyright\b)|all rights reserved|published by elsevier|'
+    r'this article is protected by copyright|trial registration|clinicaltrials\.gov|'
+    r'prospero\s+(?:registration|crd)|john wiley & sons|springer nature|licensee',
+    re.IGNORECASE
+)
+CUE_RE = re.compile(
+    r'\b(?:we found|results? (?:show|suggest|indicate)|conclu\w+|significant\w*|'
+    r'demonstrat\w+|outperform\w*|improv\w+|accuracy|sensitivity|specificity|auc)\b|\d+(?:\.\d+)?\s*%',
+    re.IGNORECASE
+)
+COPYRIGHT_TAIL_RE = re.compile(r'\s*(?:©|\(c\)\s*\d{4}|copyright\s+(?:©\s*)?\d{4}).*$', re.IGNORECASE)
+SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9(\[©])')
+# Câu dài hơn ngưỡng này không bao giờ bị coi là boilerplate
+BOILERPLATE_MAX_WORDS = 20
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """Ước lượng số token của text"""
+    if not text:
+        return 0
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in SENTENCE_SPLIT_RE.split(text) if s.strip()]
+
+
+def strip_boilerplate(text: Optional[str]) -> str:
+    """Bỏ nhãn section (BACKGROUND:, METHODS:...), câu copyright / registration, khoảng trắng thừa"""
+    if not text or text == 'N/A':
+        return ''
+    text = SECTION_LABEL_RE.sub('', ' '.join(str(text).split()))
+    text = COPYRIGHT_TAIL_RE.sub('', text)
+    return ' '.join(s for s in split_sentences(text) if not BOILERPLATE_RE.search(s))
+
+
+def shared_sentences(texts: Iterable[str]) -> set:
+    """Câu ngắn lặp lại ở >= 2 abstracts (thông báo của nhà xuất bản...) → boilerplate"""
+    seen, shared = set(), set()
+    for text in texts:
+        for sentence in set(split_sentences(strip_boilerplate(text))):
+            if len(sentence.split()) > BOILERPLATE_MAX_WORDS:
+                continue
+            if sentence in seen:
+                shared.add(sentence)
+            seen.add(sentence)
+    return shared
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cắt theo ranh giới từ (chỉ dùng khi một câu đơn lẻ đã vượt ngân sách)"""
+    limit = max(0, max_tokens) * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(' ', 1)[0] + '…'
+
+
+def compress_text(text: Optional[str], max_tokens: int, query_terms: List[str] = None,
+                  drop: set = None) -> str:
+    """
+    Nén abstract về tối đa max_tokens bằng cách chọn câu quan trọng nhất
+
+    Điểm mỗi câu = độ phủ query terms + vị trí (câu mở đầu / kết luận) + cue words
+    (kết quả, số liệu). Câu được chọn giữ nguyên thứ tự gốc, chỗ bị lược có dấu '…'.
+    """
+    sentences = split_sentences(strip_boilerplate(text))
+    if drop:
+        # Abstract chỉ gồm câu boilerplate (vd bản trùng) → giữ nguyên
+        sentences = [s for s in sentences if s not in drop] or sentences
+    if not sentences:
+        return ''
+    if count_tokens(' '.join(sentences)) <= max_tokens:
+        return ' '.join(sentences)
+
+    terms = set(query_terms or [])
+    last = len(sentences) - 1
+    ranked = []
+    for i, sentence in enumerate(sentences):
+        coverage = len(terms & set(tokenize(sentence))) / len(terms) if terms else 0.0
+        position = 0.3 if i == 0 else 0.2 if i == last else 0.0
+        cue = 0.2 if CUE_RE.search(sentence) else 0.0
+        ranked.append((coverage + position + cue, i))
+    ranked.sort(key=lambda item: (-item[0], item[1]))
+
+    selected, used = [], 0
+    for _, i in ranked:
+        cost = count_tokens(sentences[i])
+        if used + cost <= max_tokens:
+            selected.append(i)
+            used += cost
+    if not selected:
+        return truncate_to_tokens(sentences[ranked[0][1]], max_tokens)
+
+    parts, previous = [], -1
+    for i in sorted(selected):
+        if parts and i != previous + 1:
+            parts.append('…')
+        parts.append(sentences[i])
+        previous = i
+    if previous != last:
+        parts.append('…')
+    return ' '.join(parts)
+
+
+def compress_abstracts(articles: List[Dict], max_tokens: int, user_query: str = '',
+                       query_analysis: Dict = None) -> List[str]:
+    """
+    Nén abstract của một nhóm bài (cùng một prompt): câu boilerplate lặp lại
+    giữa các bài bị loại, phần còn lại chọn câu theo query
+    """
+    abstracts = [a.get('abstract') or '' for a in articles]
+    drop = shared_sentences(abstracts) if len(abstracts) > 1 else set()
+    query_terms = build_query_terms(user_query, query_analysis) if user_query else []
+    return [compress_text(text, max_tokens, query_terms, drop) for text in abstracts]
+
+
+def fit_abstract_budget(base_tokens: int, n_papers: int, token_budget: int,
+                        per_paper_default: int, per_paper_overhead: int = 30,
+                        per_paper_min: int = 40) -> int:
+    """Ngân sách abstract mỗi bài để cả prompt (n bài) nằm trong token_budget"""
+    if not token_budget or n_papers <= 0:
+        return per_paper_default
+    available = (token_budget - base_tokens) // n_papers - per_paper_overhead
+    return max(per_paper_min, min(per_paper_default, available))
+
+
+def pack_by_tokens(item_tokens: List[int], token_budget: int, max_items: int,
+                   base_tokens: int = 0) -> List[List[int]]:
+    """
+    Gom index thành các nhóm: tối đa max_items phần tử, tổng token
+    (base + items) không vượt token_budget (nhóm 1 phần tử luôn được chấp nhận)
+    """
+    groups, current, current_tokens = [], [], base_tokens
+    for idx, tokens in enumerate(item_tokens):
+        if current and (len(current) >= max_items or current_tokens + tokens > token_budget):
+            groups.append(current)
+            current, current_tokens = [], base_tokens
+        current.append(idx)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+class TokenUsage:
+    """
+    Bộ đếm token dùng chung cho mọi lời gọi Gemini (thread-safe)
+
+    Dùng usage_metadata của response; nếu không có thì ước lượng từ prompt / output text.
+    """
+
+    FIELDS = ('calls', 'prompt_tokens', 'output_tokens', 'cached_tokens', 'estimated_calls')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = dict.fromkeys(self.FIELDS, 0)
+
+    def record(self, response, prompt: str = None):
+        usage = getattr(response, 'usage_metadata', None)
+        prompt_tokens = getattr(usage, 'prompt_token_count', None)
+        output_tokens = getattr(usage, 'candidates_token_count', None)
+        cached_tokens = getattr(usage, 'cached_content_token_count', None) or 0
+        estimated = prompt_tokens is None
+        if prompt_tokens is None:
+            prompt_tokens = count_tokens(prompt)
+        if output_tokens is None:
+            output_tokens = count_tokens(getattr(response, 'text', None))
+
+        with self._lock:
+            self.totals['calls'] += 1
+            self.totals['prompt_tokens'] += prompt_tokens or 0
+            self.totals['output_tokens'] += output_tokens or 0
+            self.totals['cached_tokens'] += cached_tokens
+            self.totals['estimated_calls'] += int(estimated)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.totals)
+
+    @classmethod
+    def delta(cls, after: Dict[str, int], before: Dict[str, int]) -> Dict[str, int]:
+        return {field: after.get(field, 0) - before.get(field, 0) for field in cls.FIELDS}
+
+
+# Bộ đếm riêng của run hiện tại (ainvoke_search set cho mỗi run): nhiều run chạy song
+# song trên cùng GeminiService (batch runner) vẫn đếm token đúng cho từng run
+_run_usage: ContextVar[Optional[TokenUsage]] = ContextVar('run_token_usage', default=None)
+
+
+def run_usage() -> Optional[TokenUsage]:
+    return _run_usage.get()
+
+
+def start_run_usage():
+    """Bắt đầu bộ đếm mới cho run trong context hiện tại; trả về token để reset"""
+    return _run_usage.set(TokenUsage())
+
+
+def end_run_usage(token):
+    _run_usage.reset(token)
+
+
+def add_node_usage(token_usage: Optional[Dict], node: str, usage: Dict[str, int]) -> Dict:
+    """Cộng dồn usage của một lần chạy node vào state['token_usage'] ({node: totals, 'total': ...})"""
+    token_usage = dict(token_usage or {})
+    for key in (node, 'total'):
+        current = dict(token_usage.get(key) or dict.fromkeys(TokenUsage.FIELDS, 0))
+        for field in TokenUsage.FIELDS:
+            current[field] = current.get(field, 0) + usage.get(field, 0)
+        token_usage[key] = current
+    return token_usage
@@ -2,27 +2,24 @@
 AI Filter Prompt Templates
 Used for filtering and ranking research papers by relevance
 """
+from .budget import ABSTRACT_TOKENS, count_tokens, compress_text, compress_abstracts, fit_abstract_budget
+from ..lexical_ranker import build_query_terms
 
 
-def create_filter_prompt(user_query: str, article: dict, topic_analysis: dict = None) -> str:
+def create_filter_rubric(user_query: str, topic_analysis: dict = None) -> str:
     """
-    Create prompt for AI to evaluate paper relevance
+    Static part of the single-paper filter prompt: role, query context,
+    scoring rubric and output format. Identical for every paper of a run,
+    so it can be sent once as a system instruction / cached content.
 
     Args:
         user_query: Original user search query
-        article: Paper metadata (title, abstract, year, journal)
         topic_analysis: Optional topic/intent analysis from query_analysis
 
     Returns:
-        Formatted prompt string
+        Rubric string
     """
 
-    # Extract article info
-    title = article.get('title', 'N/A')
-    abstract = article.get('abstract', 'N/A')
-    year = article.get('year', 'N/A')
-    journal = article.get('journal', 'N/A')
-
     # Build context from topic analysis if available
     context = ""
     if topic_analysis:
@@ -33,27 +30,12 @@ def create_filter_prompt(user_query: str, article: dict, topic_analysis: dict =
         if intent:
             context += f"\nUser Intent: {intent}"
 
-    # Handle missing abstract
-    if abstract == 'N/A' or not abstract:
-        abstract_section = "Abstract: NOT AVAILABLE (please evaluate based on title only)"
-        note = "\nNOTE: Since abstract is missing, use title-based scoring and apply more lenient criteria."
-    else:
-        abstract_section = f"Abstract: {abstract[:500]}..."  # Limit to 500 chars to save tokens
-        note = ""
-
-    prompt = f"""You are an expert research paper reviewer specializing in academic literature evaluation.
+    rubric = f"""You are an expert research paper reviewer specializing in academic literature evaluation.
 
-TASK: Evaluate how relevant this research paper is to the user's query.
+TASK: Evaluate how relevant each research paper you are given is to the user's query.
 
 USER QUERY: "{user_query}"{context}
 
-PAPER DETAILS:
-- Title: {title}
-- {abstract_section}
-- Journal: {journal}
-- Year: {year}
-{note}
-
 EVALUATION CRITERIA (Score 1-10):
 1. **Direct Relevance** (0-4 points):
    - Does the paper directly address the user's query topic?
@@ -98,10 +80,68 @@ IMPORTANT:
 - Return ONLY the JSON object, no additional text
 """
 
-    return prompt
+    return rubric
+
+
+def create_paper_prompt(user_query: str, article: dict, topic_analysis: dict = None,
+                        abstract_tokens: int = ABSTRACT_TOKENS['filter']) -> str:
+    """
+    Per-paper part of the filter prompt (sent with every call)
+
+    Args:
+        user_query: Original user search query (used to pick abstract sentences)
+        article: Paper metadata (title, abstract, year, journal)
+        topic_analysis: Optional topic/intent analysis from query_analysis
+        abstract_tokens: Token budget for the (extractively compressed) abstract
+
+    Returns:
+        Paper details string
+    """
+
+    # Extract article info
+    title = article.get('title', 'N/A')
+    abstract = compress_text(article.get('abstract', 'N/A'), abstract_tokens,
+                             build_query_terms(user_query, topic_analysis))
+    year = article.get('year', 'N/A')
+    journal = article.get('journal', 'N/A')
+
+    # Handle missing abstract
+    if not abstract:
+        abstract_section = "Abstract: NOT AVAILABLE (please evaluate based on title only)"
+        note = "\nNOTE: Since abstract is missing, use title-based scoring and apply more lenient criteria."
+    else:
+        abstract_section = f"Abstract: {abstract}"
+        note = ""
+
+    return f"""PAPER DETAILS:
+- Title: {title}
+- {abstract_section}
+- Journal: {journal}
+- Year: {year}
+{note}"""
+
+
+def create_filter_prompt(user_query: str, article: dict, topic_analysis: dict = None,
+                         abstract_tokens: int = ABSTRACT_TOKENS['filter']) -> str:
+    """
+    Create prompt for AI to evaluate paper relevance (rubric + paper in one prompt)
+
+    Args:
+        user_query: Original user search query
+        article: Paper metadata (title, abstract, year, journal)
+        topic_analysis: Optional topic/intent analysis from query_analysis
+        abstract_tokens: Token budget for the (extractively compressed) abstract
+
+    Returns:
+        Formatted prompt string
+    """
+    rubric = create_filter_rubric(user_query, topic_analysis)
+    paper = create_paper_prompt(user_query, article, topic_analysis, abstract_tokens)
+    return f"{rubric}\n{paper}"
 
 
-def create_batch_filter_prompt(user_query: str, articles: list, topic_analysis: dict = None) -> str:
+def create_batch_filter_prompt(user_query: str, articles: list, topic_analysis: dict = None,
+                               abstract_tokens: int = ABSTRACT_TOKENS['batch']) -> str:
     """
     Create prompt for batch evaluation (evaluate multiple papers at once)
     More efficient for API calls
@@ -110,6 +150,8 @@ def create_batch_filter_prompt(user_query: str, articles: list, topic_analysis:
         user_query: Original user search query
         articles: List of paper metadata
         topic_analysis: Optional topic/intent analysis
+        abstract_tokens: Token budget per abstract (boilerplate shared across
+            the batch is dropped, the rest is compressed extractively)
 
     Returns:
         Formatted batch prompt
@@ -126,15 +168,11 @@ def create_batch_filter_prompt(user_query: str, articles: list, topic_analysis:
 
     # Build papers list
     papers_text = ""
-    for i, article in enumerate(articles, 1):
+    abstracts = compress_abstracts(articles, abstract_tokens, user_query, topic_analysis)
+    for i, (article, abstract) in enumerate(zip(articles, abstracts), 1):
         title = article.get('title', 'N/A')
-        abstract = article.get('abstract', 'N/A')
         year = article.get('year', 'N/A')
-
-        if abstract == 'N/A' or not abstract:
-            abstract_text = "[NO ABSTRACT]"
-        else:
-            abstract_text = abstract[:300]  # Limit length
+        abstract_text = abstract or "[NO ABSTRACT]"
 
         papers_text += f"\n\n--- PAPER {i} ---\nTitle: {title}\nAbstract: {abstract_text}\nYear: {year}\n"
 
@@ -164,18 +202,21 @@ OUTPUT FORMAT (Valid JSON array):
     "paper_id": 1,
     "relevance_score": <1-10>,
     "keep": <true/false>,
-    "reasoning": "<brief explanation>"
+    "reasoning": "<brief explanation>",
+    "key_finding": "<1 sentence summary if relevant, or 'N/A' if not>"
   }},
   ...
 ]
 
+Return exactly one entry per paper, using the paper number as paper_id.
 Return ONLY the JSON array, no additional text.
 """
 
     return prompt
 
 
-def create_synthesis_prompt(user_query: str, papers: list, query_analysis: dict = None) -> str:
+def create_synthesis_prompt(user_query: str, papers: list, query_analysis: dict = None,
+                            token_budget: int = None) -> str:
     """
     Create prompt for literature synthesis
 
@@ -183,32 +224,127 @@ def create_synthesis_prompt(user_query: str, papers: list, query_analysis: dict
         user_query: Original user search query
         papers: List of filtered high-quality papers
         query_analysis: Optional query analysis context
+        token_budget: Target prompt size; abstracts are compressed further
+            when all papers would not fit at the default per-paper budget
 
     Returns:
         Synthesis prompt
     """
+    base_tokens = count_tokens(_synthesis_template(user_query, [], query_analysis, ""))
+    abstract_tokens = fit_abstract_budget(base_tokens, len(papers), token_budget,
+                                          ABSTRACT_TOKENS['synthesis'])
+    abstracts = compress_abstracts(papers, abstract_tokens, user_query, query_analysis)
 
     # Build papers text with citations
-    papers_text = ""
-    for i, paper in enumerate(papers, 1):
-        title = paper.get('title', 'N/A')
-        abstract = paper.get('abstract', 'N/A')
-        year = paper.get('year', 'N/A')
-        authors = paper.get('authors', [])
-
-        # Format authors
-        if authors:
-            if len(authors) > 2:
-                author_text = f"{authors[0]} et al."
-            else:
-                author_text = ", ".join(authors)
+    papers_text = _papers_text(papers, abstracts)
+
+    return _synthesis_template(user_query, papers, query_analysis, papers_text)
+
+
+def format_citation(paper: dict) -> str:
+    """'Author et al. (year): title'"""
+    title = paper.get('title', 'N/A')
+    year = paper.get('year', 'N/A')
+    authors = paper.get('authors', [])
+
+    # Format authors
+    if authors:
+        if len(authors) > 2:
+            author_text = f"{authors[0]} et al."
         else:
-            author_text = "Unknown"
+            author_text = ", ".join(authors)
+    else:
+        author_text = "Unknown"
+
+    return f"{author_text} ({year}): {title}"
+
+
+def _papers_text(papers: list, abstracts: list) -> str:
+    papers_text = ""
+    for i, (paper, abstract) in enumerate(zip(papers, abstracts), 1):
+        papers_text += f"\n[{i}] {format_citation(paper)}\n"
+        if abstract:
+            papers_text += f"    Summary: {abstract}\n"
+    return papers_text
+
+
+def create_chunk_summary_prompt(user_query: str, papers: list, query_analysis: dict = None,
+                                abstract_tokens: int = ABSTRACT_TOKENS['synthesis']) -> str:
+    """
+    Map step of map-reduce synthesis: summarize one cluster of papers
+
+    Papers are numbered locally [1..k] so the summary does not depend on the
+    paper's position in the full result set (cacheable); the caller renumbers
+    citations when reducing.
+
+    Args:
+        user_query: Original user search query
+        papers: Papers of one cluster (typically 5-12)
+        query_analysis: Optional query analysis context
+        abstract_tokens: Token budget per (compressed) abstract
+
+    Returns:
+        Chunk summary prompt
+    """
+    abstracts = compress_abstracts(papers, abstract_tokens, user_query, query_analysis)
+    papers_text = _papers_text(papers, abstracts)
+
+    return f"""You are an expert research synthesizer. Summarize the following {len(papers)} papers
+as input for a larger literature review.
+
+USER QUERY: "{user_query}"
+
+PAPERS:{papers_text}
+
+INSTRUCTIONS:
+- 100-180 words, markdown bullet points
+- Focus on findings, methods and results that answer the query
+- Note agreements, conflicts and limitations between these papers
+- Cite papers ONLY with the numbers above: [1], [2], ...
+- Return only the bullet points
+"""
+
+
+def create_reduce_prompt(user_query: str, summaries: list, papers: list,
+                         query_analysis: dict = None, final: bool = True) -> str:
+    """
+    Reduce step of map-reduce synthesis
+
+    Args:
+        user_query: Original user search query
+        summaries: Partial summaries (citations already use global paper numbers)
+        papers: All papers being synthesized (global numbering = list order)
+        query_analysis: Optional query analysis context
+        final: True → full literature review (same structure as single-call synthesis);
+            False → intermediate merge of a group of summaries
+
+    Returns:
+        Reduce prompt
+    """
+    summaries_text = "\n\n".join(f"--- PARTIAL SUMMARY {i} ---\n{summary.strip()}"
+                                  for i, summary in enumerate(summaries, 1))
+    if not final:
+        return f"""You are an expert research synthesizer. Merge the following {len(summaries)} partial
+summaries of a literature search into one summary.
+
+USER QUERY: "{user_query}"
+
+{summaries_text}
+
+INSTRUCTIONS:
+- 150-250 words, markdown bullet points
+- Keep every important finding, conflict and limitation
+- Keep citation numbers exactly as written ([12], [31], ...), do not renumber
+- Return only the bullet points
+"""
+
+    index = "".join(f"\n[{i}] {format_citation(paper)}" for i, paper in enumerate(papers, 1))
+    papers_text = (f"{index}\n\nPARTIAL SUMMARIES (grouped by theme; citations refer to the "
+                   f"numbers above):\n\n{summaries_text}\n")
+    return _synthesis_template(user_query, papers, query_analysis, papers_text)
 
-        papers_text += f"\n[{i}] {author_text} ({year}): {title}\n"
-        if abstract and abstract != 'N/A':
-            papers_text += f"    Summary: {abstract[:400]}...\n"
 
+def _synthesis_template(user_query: str, papers: list, query_analysis: dict, papers_text: str) -> str:
     # Add context
     context = ""
     if query_analysis:
@@ -13,9 +13,11 @@ class PubMedAPI:
         self.api_key = api_key
         self.base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
 
-    def search(self, query: str, max_results: int = 5, year_start: int = None, year_end: int = None) -> List[str]:
+    def search(self, query: str, max_results: int = 5, year_start: int = None, year_end: int = None,
+               offset: int = 0) -> List[str]:
         """
         Tìm kiếm PubMed và trả về danh sách PMIDs
+        offset → retstart: lấy trang tiếp theo của cùng query
         """
         esearch_url = f"{self.base_url}/esearch.fcgi"
         
@@ -30,6 +32,7 @@ class PubMedAPI:
             "db": "pubmed",
             "term": final_query,
             "retmax": max_results,
+            "retstart": offset,
             "retmode": "json"
         }
         if self.api_key:
@@ -142,11 +145,12 @@ class PubMedAPI:
             print(f"Error parsing article: {e}")
             return None
 
-    def search_and_fetch(self, query: str, max_results: int = 5, year_start: int = None, year_end: int = None) -> List[Dict]:
+    def search_and_fetch(self, query: str, max_results: int = 5, year_start: int = None, year_end: int = None,
+                         offset: int = 0) -> List[Dict]:
         """
         Tìm kiếm và lấy chi tiết bài báo trong một lần gọi
         """
-        pmids = self.search(query, max_results, year_start, year_end)
+        pmids = self.search(query, max_results, year_start, year_end, offset)
         if pmids:
             return self.fetch_details(pmids)
         return []
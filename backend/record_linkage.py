@@ -0,0 +1,402 @@
+"""
+Record Linkage for Duplicate Articles
+Ghép các bản ghi trùng mà DOI/PMID/Title similarity bỏ sót (preprint → published,
+bản ghi thiếu metadata) bằng blocking keys + pairwise scoring có giải thích
+"""
+import hashlib
+import re
+import unicodedata
+from difflib import SequenceMatcher
+from typing import List, Dict, Tuple, Optional
+
+
+PREPRINT_VENUE_PATTERN = re.compile(r'arxiv|biorxiv|medrxiv|ssrn|preprint|research square', re.IGNORECASE)
+PREPRINT_DOI_PREFIXES = ('10.48550/', '10.1101/', '10.2139/', '10.21203/')
+
+# Từ quá phổ biến trong title, không dùng làm blocking key
+TITLE_STOPWORDS = {
+    'a', 'an', 'the', 'of', 'in', 'on', 'for', 'and', 'or', 'with', 'to', 'from', 'by',
+    'at', 'as', 'via', 'using', 'based', 'study', 'analysis', 'review', 'towards', 'toward'
+}
+
+
+class RecordLinker:
+    """
+    Blocking-key record linkage
+
+    - Mỗi article được gán vào các block: first-author surname + year, venue + year,
+      rare title tokens (cho bản ghi thiếu tác giả)
+    - Chỉ so sánh cặp trong cùng block (year ±1) → chi phí gần tuyến tính
+    - Mỗi match ghi lại score + lý do để có thể giải thích
+    - Không ghép 2 bản ghi có DOI hoặc PMID khác nhau (trừ cặp preprint → published)
+    """
+
+    def __init__(self, match_threshold: float = 0.75, year_tolerance: int = 1,
+                 short_title_tokens: int = 5, max_block_size: int = 100):
+        self.match_threshold = match_threshold
+        self.year_tolerance = year_tolerance
+        self.short_title_tokens = short_title_tokens
+        self.max_block_size = max_block_size
+
+    # ------------------------------------------------------------------
+    # Field normalization
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _ascii_fold(text: str) -> str:
+        """Bỏ dấu (Nguyễn → nguyen) và lowercase"""
+        text = unicodedata.normalize('NFKD', text)
+        return ''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+    @staticmethod
+    def _is_missing(value) -> bool:
+        return value is None or str(value).strip() in ('', 'N/A')
+
+    @staticmethod
+    def surname(author: str) -> str:
+        """
+        Lấy họ từ các format tác giả khác nhau:
+        - PubMed / Semantic Scholar: "John Smith"
+        - Scopus authname: "Smith J." hoặc "Smith, J."
+        """
+        if not author:
+            return ''
+        name = RecordLinker._ascii_fold(author).strip()
+        if ',' in name:
+            return re.sub(r'[^a-z\-]', '', name.split(',')[0])
+
+        tokens = name.split()
+        if not tokens:
+            return ''
+        # "smith j." / "smith j.k." → token cuối là initials
+        if len(tokens) > 1 and (tokens[-1].endswith('.') or len(tokens[-1].replace('.', '')) <= 2):
+            return re.sub(r'[^a-z\-]', '', tokens[0])
+        return re.sub(r'[^a-z\-]', '', tokens[-1])
+
+    @staticmethod
+    def parse_year(article: Dict) -> Optional[int]:
+        year = article.get('year')
+        try:
+            return int(str(year)[:4])
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def normalize_venue(venue) -> str:
+        if RecordLinker._is_missing(venue):
+            return ''
+        venue = RecordLinker._ascii_fold(str(venue))
+        return re.sub(r'[^a-z0-9]+', ' ', venue).strip()
+
+    @staticmethod
+    def title_tokens(title) -> List[str]:
+        if RecordLinker._is_missing(title):
+            return []
+        title = RecordLinker._ascii_fold(str(title))
+        return re.findall(r'[a-z0-9]+', title)
+
+    @staticmethod
+    def is_preprint(article: Dict) -> bool:
+        venue = str(article.get('journal', '') or '')
+        doi = str(article.get('doi', '') or '').lower()
+        return bool(PREPRINT_VENUE_PATTERN.search(venue)) or doi.startswith(PREPRINT_DOI_PREFIXES)
+
+    @staticmethod
+    def _identifier(article: Dict, field: str) -> str:
+        if field == 'pmid':
+            value = article.get('pmid')
+            if RecordLinker._is_missing(value) and article.get('source') == 'PubMed':
+                value = article.get('id')
+        else:
+            value = article.get(field)
+        return '' if RecordLinker._is_missing(value) else str(value).strip().lower()
+
+    @staticmethod
+    def identifier_conflict(a: Dict, b: Dict) -> Optional[str]:
+        """
+        Hai bản ghi có DOI khác nhau hoặc PMID khác nhau → chắc chắn là 2 bài khác nhau
+        (trừ cặp DOI preprint → published rõ ràng); trả về lý do, None nếu không xung đột
+        """
+        doi_a = RecordLinker._identifier(a, 'doi')
+        doi_b = RecordLinker._identifier(b, 'doi')
+        if doi_a and doi_b and doi_a.startswith(PREPRINT_DOI_PREFIXES) != doi_b.startswith(PREPRINT_DOI_PREFIXES):
+            return None
+        if doi_a and doi_b and doi_a != doi_b:
+            return "conflicting DOIs"
+        pmid_a = RecordLinker._identifier(a, 'pmid')
+        pmid_b = RecordLinker._identifier(b, 'pmid')
+        if pmid_a and pmid_b and pmid_a != pmid_b:
+            return "conflicting PMIDs"
+        return None
+
+    # ------------------------------------------------------------------
+    # Blocking
+    # ------------------------------------------------------------------
+
+    def blocking_keys(self, article: Dict) -> List[str]:
+        """
+        Blocking keys (không chứa năm; năm được xử lý ±tolerance khi ghép cặp)
+        """
+        keys = []
+        authors = article.get('authors') or []
+        if authors:
+            surname = self.surname(authors[0])
+            if surname:
+                keys.append(f"au:{surname}")
+
+        venue = self.normalize_venue(article.get('journal'))
+        if venue:
+            keys.append(f"ve:{venue}")
+
+        # Bản ghi thiếu tác giả: block theo 2 token hiếm nhất (dài nhất) của title
+        if not keys:
+            tokens = [t for t in self.title_tokens(article.get('title')) if t not in TITLE_STOPWORDS]
+            if len(tokens) >= 2:
+                rare = sorted(set(tokens), key=lambda t: (-len(t), t))[:2]
+                keys.append("ti:" + "|".join(sorted(rare)))
+
+        return keys
+
+    def _build_blocks(self, articles: List[Dict]) -> Dict[Tuple[str, int], List[int]]:
+        """Index article theo (key, year); article không có năm dùng year=None"""
+        blocks = {}
+        for idx, article in enumerate(articles):
+            year = self.parse_year(article)
+            for key in self.blocking_keys(article):
+                blocks.setdefault((key, year), []).append(idx)
+        return blocks
+
+    def candidate_pairs(self, articles: List[Dict]) -> List[Tuple[int, int]]:
+        """Sinh các cặp cần so sánh: cùng key, năm lệch ≤ year_tolerance"""
+        blocks = self._build_blocks(articles)
+        pairs = set()
+
+        for (key, year), members in blocks.items():
+            neighbours = list(members)
+            if year is not None:
+                for offset in range(1, self.year_tolerance + 1):
+                    neighbours.extend(blocks.get((key, year + offset), []))
+
+            if len(neighbours) > self.max_block_size:
+                # Block quá lớn (venue phổ biến...) → bỏ qua để giữ chi phí tuyến tính
+                continue
+
+            for i in members:
+                for j in neighbours:
+                    if i != j:
+                        pairs.add((min(i, j), max(i, j)))
+
+        return sorted(pairs)
+
+    # ------------------------------------------------------------------
+    # Pairwise scoring
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _jaccard(a: set, b: set) -> float:
+        if not a or not b:
+            return 0.0
+        return len(a & b) / len(a | b)
+
+    def score_pair(self, a: Dict, b: Dict) -> Tuple[float, List[str]]:
+        """
+        Tính điểm trùng (0-1) và danh sách lý do
+
+        Weights: title 0.45, authors 0.30, abstract 0.15, year/venue 0.10
+        """
+        reasons = []
+
+        tokens_a = self.title_tokens(a.get('title'))
+        tokens_b = self.title_tokens(b.get('title'))
+        title_ratio = SequenceMatcher(None, ' '.join(tokens_a), ' '.join(tokens_b)).ratio()
+        title_jaccard = self._jaccard(set(tokens_a), set(tokens_b))
+        title_score = max(title_ratio, title_jaccard)
+        reasons.append(f"title similarity {title_score:.2f}")
+
+        surnames_a = {self.surname(x) for x in (a.get('authors') or []) if x}
+        surnames_b = {self.surname(x) for x in (b.get('authors') or []) if x}
+        surnames_a.discard('')
+        surnames_b.discard('')
+        first_author_match = bool(
+            a.get('authors') and b.get('authors')
+            and self.surname(a['authors'][0]) == self.surname(b['authors'][0])
+        )
+        author_score = self._jaccard(surnames_a, surnames_b)
+        if first_author_match:
+            author_score = max(author_score, 0.6)
+            reasons.append("same first author")
+        if surnames_a and surnames_b:
+            reasons.append(f"author overlap {self._jaccard(surnames_a, surnames_b):.2f}")
+
+        abstract_a = a.get('abstract')
+        abstract_b = b.get('abstract')
+        has_abstracts = not self._is_missing(abstract_a) and not self._is_missing(abstract_b)
+        abstract_score = 0.0
+        if has_abstracts:
+            abstract_score = self._jaccard(
+                set(self.title_tokens(abstract_a)[:120]),
+                set(self.title_tokens(abstract_b)[:120])
+            )
+            reasons.append(f"abstract overlap {abstract_score:.2f}")
+
+        year_a, year_b = self.parse_year(a), self.parse_year(b)
+        year_score = 0.0
+        if year_a is not None and year_b is not None:
+            diff = abs(year_a - year_b)
+            year_score = 1.0 if diff == 0 else (0.7 if diff <= self.year_tolerance else 0.0)
+            reasons.append(f"year diff {diff}")
+
+        venue_a = self.normalize_venue(a.get('journal'))
+        venue_b = self.normalize_venue(b.get('journal'))
+        venue_score = 1.0 if venue_a and venue_a == venue_b else 0.0
+        if venue_score:
+            reasons.append("same venue")
+
+        preprint_pair = self.is_preprint(a) != self.is_preprint(b)
+        if preprint_pair:
+            # Preprint vs bản chính thức: venue khác là bình thường
+            venue_score = max(venue_score, 0.5)
+            reasons.append("preprint/published pair")
+
+        # Không có abstract → phân bổ lại trọng số cho title & authors
+        if has_abstracts:
+            score = 0.45 * title_score + 0.30 * author_score + 0.15 * abstract_score
+        else:
+            score = 0.55 * title_score + 0.35 * author_score
+        score += 0.07 * year_score + 0.03 * venue_score
+
+        # Title ngắn/chung chung: không bao giờ merge chỉ dựa vào title
+        short_title = min(len(tokens_a), len(tokens_b)) < self.short_title_tokens
+        if short_title and not first_author_match:
+            score = min(score, self.match_threshold - 0.01)
+            reasons.append("short title without author evidence")
+
+        # DOI / PMID khác nhau: không bao giờ merge dù metadata giống
+        conflict = self.identifier_conflict(a, b)
+        if conflict:
+            score = min(score, self.match_threshold - 0.01)
+            reasons.append(conflict)
+
+        return round(score, 3), reasons
+
+    # ------------------------------------------------------------------
+    # Linking
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _merge_fields(primary: Dict, duplicate: Dict):
+        """Bổ sung field còn thiếu của bản ghi giữ lại từ bản ghi trùng"""
+        for field in ('doi', 'abstract', 'journal', 'year', 'pmc_id'):
+            if RecordLinker._is_missing(primary.get(field)) and not RecordLinker._is_missing(duplicate.get(field)):
+                primary[field] = duplicate[field]
+        if not primary.get('authors') and duplicate.get('authors'):
+            primary['authors'] = duplicate['authors']
+
+    def link(self, articles: List[Dict]) -> List[Dict]:
+        """
+        Ghép bản ghi trùng, trả về danh sách unique (giữ thứ tự ưu tiên ban đầu)
+
+        Bản ghi bị ghép được lưu trong `linked_records` của bản ghi giữ lại,
+        kèm score & reasons.
+        """
+        if len(articles) < 2:
+            return articles
+
+        parent = list(range(len(articles)))
+        members = {i: [i] for i in range(len(articles))}
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        matches = []
+        for i, j in self.candidate_pairs(articles):
+            score, reasons = self.score_pair(articles[i], articles[j])
+            if score >= self.match_threshold:
+                matches.append((i, j, score, reasons))
+                root_i, root_j = find(i), find(j)
+                if root_i == root_j:
+                    continue
+                # Ghép bắc cầu (A~C, B~C) không được gộp 2 bản ghi có ID xung đột
+                if any(self.identifier_conflict(articles[x], articles[y])
+                       for x in members[root_i] for y in members[root_j]):
+                    continue
+                # Giữ bản ghi xuất hiện trước (PubMed > Scopus > Semantic Scholar)
+                keep, drop = min(root_i, root_j), max(root_i, root_j)
+                parent[drop] = keep
+                members[keep].extend(members.pop(drop))
+
+        if not matches:
+            return articles
+
+        evidence = {}
+        for i, j, score, reasons in matches:
+            evidence.setdefault(j, (score, reasons))
+            evidence.setdefault(i, (score, reasons))
+
+        unique_articles = []
+        for idx, article in enumerate(articles):
+            root = find(idx)
+            if root == idx:
+                unique_articles.append(article)
+                continue
+
+            primary = articles[root]
+            # Ưu tiên bản chính thức: preprint giữ lại sẽ lấy DOI/journal của bản published
+            if self.is_preprint(primary) and not self.is_preprint(article):
+                for field in ('doi', 'journal', 'year'):
+                    if not self._is_missing(article.get(field)):
+                        primary[field] = article[field]
+            self._merge_fields(primary, article)
+
+            score, reasons = evidence.get(idx, (None, []))
+            primary.setdefault('linked_records', []).append({
+                'source': article.get('source'),
+                'id': article.get('id'),
+                'title': article.get('title'),
+                'score': score,
+                'reasons': reasons
+            })
+            print(f"🔗 Linked duplicate ({score}): {str(article.get('title', ''))[:60]}... [{'; '.join(reasons)}]")
+
+        removed = len(articles) - len(unique_articles)
+        print(f"🔗 Record linkage merged {removed} duplicates from {len(articles)} articles")
+        return unique_articles
+
+
+def article_key(article: Dict) -> str:
+    """
+    Canonical ID của article, ổn định giữa các lần tìm kiếm:
+    DOI > PubMed ID > source:id > hash(title)
+    """
+    doi = str(article.get('doi', '') or '').strip().lower()
+    if doi and doi != 'n/a':
+        return f"doi:{doi}"
+
+    pmid = str(article.get('pmid', '') or '').strip()
+    if not pmid or pmid == 'N/A':
+        pmid = str(article.get('id', '') or '').strip() if article.get('source') == 'PubMed' else ''
+    if pmid and pmid != 'N/A':
+        return f"pmid:{pmid}"
+
+    source = str(article.get('source', '') or '').strip().lower().replace(' ', '_')
+    source_id = str(article.get('id', '') or '').strip()
+    if source and source_id and source_id != 'N/A':
+        return f"{source}:{source_id}"
+
+    title = ' '.join(RecordLinker.title_tokens(article.get('title')))
+    return "title:" + hashlib.md5(title.encode()).hexdigest()[:16]
+
+
+def article_keys(article: Dict) -> List[str]:
+    """Tất cả ID đã biết của article (kể cả các bản ghi đã được RecordLinker ghép vào)"""
+    keys = [article_key(article)]
+    for linked in article.get('linked_records', []):
+        if linked.get('source') and linked.get('id'):
+            source = str(linked['source']).lower().replace(' ', '_')
+            key = f"pmid:{linked['id']}" if linked['source'] == 'PubMed' else f"{source}:{linked['id']}"
+            if key not in keys:
+                keys.append(key)
+    return keys
@@ -15,9 +15,11 @@ class ScopusAPI:
             "Accept": "application/json"
         }
 
-    def search(self, query: str, max_results: int = 5, year_start: int = None, year_end: int = None) -> List[Dict]:
+    def search(self, query: str, max_results: int = 5, year_start: int = None, year_end: int = None,
+               offset: int = 0) -> List[Dict]:
         """
         Tìm kiếm Scopus và trả về danh sách bài báo
+        offset → start: lấy trang tiếp theo của cùng query
         """
         if not self.api_key:
             return []
@@ -32,6 +34,7 @@ class ScopusAPI:
         params = {
             "query": final_query,
             "count": max_results,
+            "start": offset,
             "view": "COMPLETE"  # Changed to COMPLETE to get full abstract
         }
 
@@ -96,9 +99,10 @@ class ScopusAPI:
                 
         return results
 
-    def search_and_fetch(self, query: str, max_results: int = 5, year_start: int = None, year_end: int = None) -> List[Dict]:
+    def search_and_fetch(self, query: str, max_results: int = 5, year_start: int = None, year_end: int = None,
+                         offset: int = 0) -> List[Dict]:
         """
         Tìm kiếm và lấy chi tiết bài báo
         """
-        return self.search(query, max_results, year_start, year_end)
+        return self.search(query, max_results, year_start, year_end, offset)
 
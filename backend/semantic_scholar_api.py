@@ -15,13 +15,16 @@ class SemanticScholarAPI:
         if self.api_key:
             self.headers["x-api-key"] = self.api_key
 
-    def search(self, query: str, max_results: int = 5, year_start: int = None, year_end: int = None) -> List[Dict]:
+    def search(self, query: str, max_results: int = 5, year_start: int = None, year_end: int = None,
+               offset: int = 0) -> List[Dict]:
         """
         Tìm kiếm Semantic Scholar
+        offset: lấy trang tiếp theo của cùng query
         """
         params = {
             "query": query,
             "limit": max_results,
+            "offset": offset,
             "fields": "paperId,title,authors,venue,year,abstract,externalIds,url,citationCount"
         }
         
@@ -85,8 +88,9 @@ class SemanticScholarAPI:
                 
         return results
 
-    def search_and_fetch(self, query: str, max_results: int = 5, year_start: int = None, year_end: int = None) -> List[Dict]:
+    def search_and_fetch(self, query: str, max_results: int = 5, year_start: int = None, year_end: int = None,
+                         offset: int = 0) -> List[Dict]:
         """
         Tìm kiếm và trả về kết quả
         """
-        return self.search(query, max_results, year_start, year_end)
+        return self.search(query, max_results, year_start, year_end, offset)
@@ -0,0 +1,154 @@
+"""
+Speculative Prefetch
+Trong lúc evaluate_results chấm điểm, chạy trước tìm kiếm của vòng refine
+"dễ đoán" (fallback refinement: trang tiếp theo hoặc mở rộng year range)
+
+- Chạy trên event loop dùng chung (event_loop.shared_loop) song song với evaluate
+- Budget riêng (RateLimiter + số request tối đa mỗi lượt), tách khỏi search thật
+- Kết quả chỉ ghi vào SearchCache của AsyncSearchAPIs → khi refine thật sự xảy ra,
+  execute_search cache hit; không cần refine → cancel
+"""
+import asyncio
+import hashlib
+import json
+import threading
+from typing import Dict, List, Optional
+
+from .async_apis import AsyncSearchAPIs
+from .event_loop import shared_loop
+from .gemini_service import RateLimiter
+from .nodes.execute import plan_delta
+from .nodes.refine import fallback_filters
+
+
+class SpeculativePrefetcher:
+    """
+    Chạy prefetch ở mức ưu tiên thấp trên event loop nền
+
+    start() trả về key của lượt prefetch (lưu trong state, serializable);
+    claim() dừng phát request mới, chờ các request đang chạy (kết quả vào cache),
+    nguồn chưa kịp prefetch do execute_search tự chạy; cancel() huỷ toàn bộ
+    """
+
+    def __init__(self, async_apis: AsyncSearchAPIs, requests_per_minute: int = 60,
+                 max_requests: int = 3, wait_timeout: float = 30.0):
+        self.async_apis = async_apis
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        self.max_requests = max_requests
+        self.wait_timeout = wait_timeout
+        self.stats = {'started': 0, 'requests': 0, 'hits': 0, 'misses': 0, 'cancelled': 0}
+        self._pending: Dict[str, Dict] = {}  # key → {'launcher': Future, 'requests': [Task]}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(queries: Dict[str, str], pages: Dict[str, tuple], year_range: List[int],
+                max_per_source: int) -> str:
+        payload = json.dumps([sorted(queries.items()), sorted((k, list(v)) for k, v in pages.items()),
+                              list(year_range), max_per_source], ensure_ascii=False)
+        return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+    async def _launch(self, record: Dict, queries: Dict[str, str], pages: Dict[str, tuple],
+                      year_range: List[int], max_per_source: int):
+        # Mỗi request trừ vào budget riêng của prefetcher
+        for key, query in list(queries.items())[:self.max_requests]:
+            await self.rate_limiter.acquire_async()
+            self.stats['requests'] += 1
+            offset, count = pages.get(key, (0, max_per_source))
+            record['requests'].append(asyncio.ensure_future(self.async_apis.search_source(
+                key, query, count, year_range[0], year_range[1], offset)))
+
+    async def _wait_requests(self, record: Dict):
+        if record['requests']:
+            await asyncio.wait(record['requests'], timeout=self.wait_timeout)
+
+    def start(self, queries: Dict[str, str], pages: Dict[str, tuple], year_range: List[int],
+              max_per_source: int) -> Optional[str]:
+        if not queries:
+            return None
+        key = self.key_for(queries, pages, year_range, max_per_source)
+        with self._lock:
+            if key in self._pending:
+                return key
+            record = {'requests': []}
+            record['launcher'] = shared_loop().submit(
+                self._launch(record, queries, pages, year_range, max_per_source))
+            self._pending[key] = record
+        self.stats['started'] += 1
+        return key
+
+    def claim(self, key: str, search_key: str) -> bool:
+        """
+        Lượt tìm kiếm thật (search_key) trùng lượt đã prefetch (key) → chờ các request
+        prefetch đang chạy xong (tối đa wait_timeout) để kết quả nằm sẵn trong cache;
+        đoán sai → huỷ
+        """
+        if key != search_key:
+            self.cancel(key)
+            self.stats['misses'] += 1
+            return False
+        with self._lock:
+            record = self._pending.pop(key, None)
+        if record is None:
+            self.stats['misses'] += 1
+            return False
+        record['launcher'].cancel()
+        try:
+            shared_loop().run(self._wait_requests(record))
+        except Exception as e:
+            print(f"⚠️  Speculative prefetch failed: {e}")
+        self.stats['hits'] += 1
+        return True
+
+    def cancel(self, key: str):
+        with self._lock:
+            record = self._pending.pop(key, None)
+        if record is None:
+            return
+        record['launcher'].cancel()
+        shared_loop().loop.call_soon_threadsafe(lambda: [task.cancel() for task in record['requests']])
+        self.stats['cancelled'] += 1
+
+
+def predict_refinement_search(state: Dict) -> Optional[Dict]:
+    """Lượt tìm kiếm của fallback refinement: {'queries', 'pages', 'year_range', 'max_per_source'}"""
+    strategy = state.get('search_strategy') or {}
+    queries = strategy.get('optimized_queries') or {}
+    if not queries:
+        return None
+    filters, _ = fallback_filters(strategy.get('filters', {}), strategy.get('source_cursors') or {})
+    year_range = filters.get('year_range', [2020, 2025])
+    max_per_source = filters.get('max_results_per_source', 10)
+    delta = plan_delta(state, queries, year_range, max_per_source, verbose=False)
+    if not delta['run']:
+        return None
+    return {'queries': delta['run'], 'pages': delta['pages'], 'year_range': year_range,
+            'max_per_source': max_per_source}
+
+
+def with_speculative_prefetch(evaluate_node, prefetcher: SpeculativePrefetcher):
+    """
+    Wrap evaluate_results: bắt đầu prefetch trước khi chấm điểm, cancel nếu không cần refine
+
+    Chỉ bật khi user_preferences['speculative_prefetch'] = True: lượt được đoán là fallback
+    refinement (khi LLM refine lỗi); refine bình thường viết query mới nên đoán trượt và
+    request prefetch bị bỏ phí
+    """
+    def wrapped(state):
+        key = None
+        if state['user_preferences'].get('speculative_prefetch', False) and state.get('refinement_count', 0) < 2:
+            prediction = predict_refinement_search(state)
+            if prediction:
+                key = prefetcher.start(**prediction)
+                print(f"🔮 Speculative prefetch started: {', '.join(prediction['queries'])} "
+                      f"({len(prediction['pages'])} next-page)")
+
+        state = evaluate_node(state)
+
+        if key:
+            if state.get('needs_refinement') and state.get('refinement_count', 0) < 2:
+                state['search_strategy']['prefetch'] = key
+            else:
+                prefetcher.cancel(key)
+                print("🔮 Speculative prefetch cancelled (no refinement needed)")
+        return state
+    return wrapped
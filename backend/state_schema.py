@@ -32,13 +32,22 @@ class SearchState(TypedDict):
     # NEW: AI Filtering & Ranking
     filtered_results: Optional[List[Dict]]  # Papers that passed AI filter (score >= 7)
     discarded_articles: Optional[List[Dict]]  # Papers rejected by AI + reasons
+    pending_articles: Optional[List[Dict]]  # Unscored papers left by early stop (scored lazily on demand)
     relevance_scores: Optional[Dict]  # {article_id: score} mapping
     filter_statistics: Optional[Dict]  # {total_found, kept, discarded, avg_score, pass_rate}
+    article_scores: Optional[Dict]  # {article key: LLM result} scored during pipelined search
+    pipeline_stats: Optional[Dict]  # {sources, queued, scored, errors, llm_calls, llm_calls_saved_*, time_to_first_score_s, total_s}
+    article_pool: Optional[Dict]  # {article key: scored article} cộng dồn qua các vòng refinement
 
     # NEW: Literature Synthesis
     synthesis_summary: Optional[str]  # AI-generated literature review
     synthesis_metadata: Optional[Dict]  # {papers_count, avg_year, synthesis_date}
 
+    # Token spend per node: {node: {calls, prompt_tokens, output_tokens, estimated_calls}, 'total': {...}}
+    token_usage: Optional[Dict]
+    # Wall time per node (s, cumulative over refinements) + time_to_first_search_s
+    timings: Optional[Dict]
+
     # Output
     final_results: List[Dict]
     metadata: Dict
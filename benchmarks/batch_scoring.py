@@ -0,0 +1,87 @@
+"""
+Benchmark: batched vs single-paper relevance scoring
+
+So sánh wall time, số lần gọi Gemini và mức độ đồng thuận (keep/discard,
+chênh lệch score) giữa batch_size=1 và batch_size=N.
+
+Usage:
+    python -m benchmarks.batch_scoring --input projects/<id>/results/<search>.json \\
+        --query "AI in wound diagnosis" --batch-size 5
+"""
+import argparse
+import copy
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+
+from backend.gemini_service import GeminiService
+from backend.nodes.evaluate import filter_by_ai_relevance
+from backend.project_manager import ProjectManager
+
+
+def run_mode(articles, query, analysis, gemini, batch_size, concurrency):
+    start = time.perf_counter()
+    _, _, scores, stats = filter_by_ai_relevance(
+        copy.deepcopy(articles), query, analysis, gemini,
+        batch_size=batch_size, concurrency=concurrency
+    )
+    return {
+        'batch_size': batch_size,
+        'wall_time_s': round(time.perf_counter() - start, 2),
+        'calls': stats['llm_calls'],
+        'scores': scores
+    }
+
+
+def agreement(single: dict, batched: dict, threshold: float = 7.0) -> dict:
+    common = [k for k in single if k in batched]
+    if not common:
+        return {'papers': 0, 'keep_agreement': 0.0, 'mean_abs_score_diff': 0.0}
+    same_decision = sum((single[k] >= threshold) == (batched[k] >= threshold) for k in common)
+    abs_diff = sum(abs(single[k] - batched[k]) for k in common) / len(common)
+    return {
+        'papers': len(common),
+        'keep_agreement': round(same_decision / len(common) * 100, 1),
+        'mean_abs_score_diff': round(abs_diff, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched vs single-paper scoring benchmark")
+    parser.add_argument('--input', required=True, help="Saved search JSON (projects/<id>/results/<search>.json)")
+    parser.add_argument('--query', help="User query (default: query stored in the file)")
+    parser.add_argument('--batch-size', type=int, default=5)
+    parser.add_argument('--limit', type=int, default=30, help="Max articles to score")
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help="Concurrent single-paper calls (1 = sequential)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    data = ProjectManager.load_results_file(args.input)
+
+    articles = data.get('articles', [])[:args.limit]
+    query = args.query or data.get('user_query') or data.get('query', '')
+    analysis = {'topic': '', 'intent': ''}
+
+    gemini = GeminiService(os.getenv('GEMINI_API_KEY', ''))
+    if not gemini.available:
+        raise SystemExit("GEMINI_API_KEY is required")
+
+    single = run_mode(articles, query, analysis, gemini, 1, args.concurrency)
+    batched = run_mode(articles, query, analysis, gemini, args.batch_size, args.concurrency)
+
+    report = {
+        'articles': len(articles),
+        'single': {k: v for k, v in single.items() if k != 'scores'},
+        'batched': {k: v for k, v in batched.items() if k != 'scores'},
+        'agreement': agreement(single['scores'], batched['scores'])
+    }
+    report['speedup'] = round(single['wall_time_s'] / batched['wall_time_s'], 2) if batched['wall_time_s'] else None
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
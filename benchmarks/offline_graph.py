@@ -0,0 +1,108 @@
+"""
+Benchmark (offline): toàn bộ LangGraph workflow với StubProvider + StubSearchAPIs
+
+Không cần API key / network: LLM và search API đều giả lập deterministic với
+latency cấu hình được và lỗi giả lập, nên có thể profile từng node (timings,
+số lời gọi theo task, token) và so sánh các mode (planner, pipeline, batch...).
+
+Usage:
+    python -m benchmarks.offline_graph --query "AI in chronic wound assessment" --runs 3
+    python -m benchmarks.offline_graph --error-rate 0.1 --pipeline --planner multi
+"""
+import argparse
+import json
+import statistics
+import time
+
+from backend.async_apis import StubSearchAPIs
+from backend.langgraph_orchestrator import build_search_graph, invoke_search
+from backend.llm_providers import StubProvider
+
+
+def run_once(args, run: int) -> dict:
+    provider = StubProvider(base_latency=args.llm_latency, latency_per_1k=args.latency_per_1k,
+                            error_rate=args.error_rate, seed=args.seed + run)
+    search_apis = StubSearchAPIs(latency={
+        'PubMed': args.search_latency,
+        'Scopus': args.search_latency * 2,
+        'Semantic Scholar': args.search_latency * 1.5
+    })
+    graph = build_search_graph('', planner_mode=args.planner, llm_provider=provider, search_apis=search_apis)
+    preferences = {
+        'max_results': args.max_results,
+        'year_range': [2020, 2025],
+        'sources': args.sources,
+        'planner': args.planner,
+        'pipeline': args.pipeline,
+        'speculative_prefetch': args.prefetch,
+        'refine_variants': args.refine_variants,
+        'scoring': {'batch_size': args.batch_size, 'concurrency': args.concurrency}
+    }
+
+    start = time.perf_counter()
+    state = invoke_search(graph, args.query, preferences)
+    wall = time.perf_counter() - start
+
+    total = (state.get('token_usage') or {}).get('total') or {}
+    return {
+        'wall_time_s': round(wall, 2),
+        'timings': state.get('timings') or {},
+        'llm_calls_by_task': dict(provider.stats['by_task']),
+        'llm_errors': provider.stats['errors'],
+        'search_calls': dict(search_apis.calls),
+        'search_records': dict(search_apis.records),
+        'prompt_tokens': total.get('prompt_tokens', 0),
+        'output_tokens': total.get('output_tokens', 0),
+        'kept': len(state.get('final_results') or []),
+        'refinements': state.get('refinement_count', 0)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end graph benchmark (stub LLM + search)")
+    parser.add_argument('--query', default="AI in chronic wound assessment")
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--sources', nargs='*', default=['PubMed', 'Scopus', 'Semantic Scholar'])
+    parser.add_argument('--max-results', type=int, default=10)
+    parser.add_argument('--planner', choices=['combined', 'multi'], default='combined')
+    parser.add_argument('--pipeline', action='store_true', help="Pipelined execute → evaluate")
+    parser.add_argument('--prefetch', action='store_true', help="Enable speculative refinement prefetch")
+    parser.add_argument('--refine-variants', type=int, default=1, help="Query variants per source on refinement")
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=5)
+    parser.add_argument('--llm-latency', type=float, default=0.3, help="Simulated fixed latency per LLM call (s)")
+    parser.add_argument('--latency-per-1k', type=float, default=0.2, help="Simulated latency per 1k prompt tokens (s)")
+    parser.add_argument('--search-latency', type=float, default=0.4, help="Simulated PubMed latency (s); Scopus x2, S2 x1.5")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of LLM calls that fail")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    runs = [run_once(args, run) for run in range(args.runs)]
+    walls = [r['wall_time_s'] for r in runs]
+    nodes = sorted({node for r in runs for node in r['timings'] if node != 'time_to_first_search_s'})
+
+    report = {
+        'query': args.query,
+        'config': {k: v for k, v in vars(args).items() if k not in ('query', 'runs')},
+        'runs': args.runs,
+        'wall_time_mean_s': round(statistics.mean(walls), 2),
+        'wall_time_max_s': round(max(walls), 2),
+        'time_to_first_search_mean_s': round(statistics.mean(
+            r['timings'].get('time_to_first_search_s', 0.0) for r in runs), 2),
+        'node_time_mean_s': {
+            node: round(statistics.mean(r['timings'].get(node, 0.0) for r in runs), 2) for node in nodes
+        },
+        'llm_calls_per_run': round(statistics.mean(sum(r['llm_calls_by_task'].values()) for r in runs), 1),
+        'llm_calls_by_task': runs[-1]['llm_calls_by_task'],
+        'llm_errors': sum(r['llm_errors'] for r in runs),
+        'search_calls_per_run': round(statistics.mean(sum(r['search_calls'].values()) for r in runs), 1),
+        'search_records_per_run': round(statistics.mean(sum(r['search_records'].values()) for r in runs), 1),
+        'prompt_tokens_per_run': round(statistics.mean(r['prompt_tokens'] for r in runs)),
+        'kept_per_run': [r['kept'] for r in runs],
+        'refinements_per_run': [r['refinements'] for r in runs]
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
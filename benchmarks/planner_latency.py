@@ -0,0 +1,86 @@
+"""
+Benchmark: combined query planner vs analyze → plan → optimize
+
+Đo time-to-first-search (thời gian từ lúc nhận query tới lúc có
+optimized_queries) và số lần gọi Gemini của hai mode, chạy lặp nhiều lần.
+
+Usage:
+    python -m benchmarks.planner_latency --query "AI in wound diagnosis" --runs 3
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+from dotenv import load_dotenv
+
+from backend.gemini_service import GeminiService
+from backend.nodes.planner import plan_query
+from backend.nodes.analyze import analyze_query
+from backend.nodes.plan import plan_strategy
+from backend.nodes.optimize import optimize_queries
+
+
+def initial_state(query: str, preferences: dict) -> dict:
+    return {
+        'user_query': query,
+        'user_preferences': preferences,
+        'query_analysis': None,
+        'search_strategy': None,
+        'messages': []
+    }
+
+
+def run_multi(state, gemini):
+    state = analyze_query(state, gemini)
+    state = plan_strategy(state, gemini)
+    return optimize_queries(state, gemini)
+
+
+def run_mode(name, planner, query, preferences, gemini, runs):
+    times, calls, planners = [], [], []
+    for _ in range(runs):
+        before = gemini.usage.snapshot()['calls']
+        start = time.perf_counter()
+        state = planner(initial_state(query, preferences), gemini)
+        times.append(time.perf_counter() - start)
+        calls.append(gemini.usage.snapshot()['calls'] - before)
+        planners.append(state['search_strategy'].get('planner', 'multi'))
+    return {
+        'mode': name,
+        'runs': runs,
+        'time_to_first_search_mean_s': round(statistics.mean(times), 2),
+        'time_to_first_search_max_s': round(max(times), 2),
+        'calls_per_run': round(statistics.mean(calls), 1),
+        'planner_used': sorted(set(planners))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Combined vs multi-call query planning benchmark")
+    parser.add_argument('--query', required=True)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--sources', nargs='*', default=[], help="Force sources (default: auto-select)")
+    parser.add_argument('--max-results', type=int, default=10)
+    args = parser.parse_args()
+
+    load_dotenv()
+    gemini = GeminiService(os.getenv('GEMINI_API_KEY', ''))
+    if not gemini.available:
+        raise SystemExit("GEMINI_API_KEY is required")
+
+    preferences = {'max_results': args.max_results, 'year_range': [2020, 2025], 'sources': args.sources}
+    multi = run_mode('multi', run_multi, args.query, preferences, gemini, args.runs)
+    combined = run_mode('combined', plan_query, args.query, preferences, gemini, args.runs)
+
+    report = {'query': args.query, 'multi': multi, 'combined': combined}
+    report['time_saved_s'] = round(multi['time_to_first_search_mean_s'] - combined['time_to_first_search_mean_s'], 2)
+    if combined['time_to_first_search_mean_s']:
+        report['speedup'] = round(multi['time_to_first_search_mean_s'] / combined['time_to_first_search_mean_s'], 2)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()